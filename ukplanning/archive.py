@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import threading
+import hashlib
+import atexit
+import sqlite3
+import struct
+import zlib
+import os
+from datetime import datetime
+
+# content addressed archive of the raw pages fetched by the scrapers - see BaseScraper.use_archive()
+# each distinct page body is stored once, keyed on its SHA-1 hash and zlib compressed, appended to a pack file
+# (pack-NNNNN.zpk, a new pack is started when the current one reaches pack_size)
+# an SQLite index maps each hash to its pack position, and each fetch (authority, uid, kind, url, fetched_at) to a hash
+# so unchanged pages fetched again cost one index row, and old pages can be parsed again later without the network
+# index rows are committed in batches - flush() or close() (also called at exit) writes everything out
+# one archive directory should only be written by one process at a time (threads can share an archive)
+
+PACK_MAGIC = 'UKPA' # at the start of each pack file
+ENTRY_HEADER = struct.Struct('>20sI') # raw hash digest and compressed length before each body in a pack
+
+_archives = {} # directory -> open PageArchive, so all scrapers using one directory share it
+_archives_lock = threading.Lock()
+
+def open_archive(directory, **kwargs):
+    ' returns the shared PageArchive for this directory, opening it if necessary '
+    directory = os.path.abspath(directory)
+    with _archives_lock:
+        archive = _archives.get(directory)
+        if archive is None or archive.closed:
+            archive = _archives[directory] = PageArchive(directory, **kwargs)
+    return archive
+
+class PageArchive(object):
+
+    def __init__(self, directory, pack_size=64*1024*1024, level=6, batch_size=200, readonly=False):
+        """ 'directory' holds the pack files and index (created if necessary), 'pack_size' is the size in bytes at which
+        a new pack file is started, 'level' is the zlib compression level and 'batch_size' the number of
+        index rows written per transaction - a 'readonly' archive must already exist, and any number of
+        processes can read one at the same time """
+        self.directory = directory
+        self.pack_size = pack_size
+        self.level = level
+        self.batch_size = batch_size
+        self.readonly = readonly
+        self.closed = False
+        index_path = os.path.join(directory, 'index.db')
+        if readonly and not os.path.exists(index_path):
+            raise IOError("no page archive in %s" % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._new_blobs = {} # hash -> blob row not yet committed
+        self._new_pages = [] # page rows not yet committed
+        self._readers = {} # pack number -> open file for reading
+        self._writer = None # append handle of the current pack (None if read only)
+        if not readonly:
+            with self._db:
+                self._db.execute("""CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, pack INTEGER, offset INTEGER,
+                    length INTEGER, size INTEGER)""")
+                self._db.execute("""CREATE TABLE IF NOT EXISTS pages (authority TEXT, uid TEXT, kind TEXT, url TEXT,
+                    fetched_at TEXT, hash TEXT, text INTEGER)""")
+                self._db.execute("CREATE INDEX IF NOT EXISTS pages_key ON pages (authority, uid, kind, fetched_at)")
+            row = self._db.execute("SELECT MAX(pack) FROM blobs").fetchone()
+            self._pack = row[0] or 1
+            self._open_pack()
+            atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _pack_path(self, pack):
+        return os.path.join(self.directory, 'pack-%05d.zpk' % pack)
+
+    def _open_pack(self):
+        ' opens the current pack for appending - any bytes after the last indexed entry (eg from a crash) are ignored '
+        self._writer = open(self._pack_path(self._pack), 'ab')
+        self._writer.seek(0, os.SEEK_END)
+        if self._writer.tell() == 0:
+            self._writer.write(PACK_MAGIC)
+
+    def store(self, authority, uid, kind, url, body, fetched_at=None):
+        """ archive one fetched page - 'kind' labels the page (eg 'detail'), 'uid' may be None (eg search results)
+        'fetched_at' defaults to now - returns the content hash of the body """
+        text = isinstance(body, unicode)
+        data = body.encode('utf-8') if text else (body or '')
+        digest = hashlib.sha1(data)
+        key = digest.hexdigest()
+        fetched_at = (fetched_at or datetime.now()).isoformat()
+        if self.readonly:
+            raise IOError("page archive %s is read only" % self.directory)
+        with self._lock:
+            if key not in self._new_blobs and not self._has_blob(key):
+                compressed = zlib.compress(data, self.level)
+                if self._writer.tell() + len(compressed) > self.pack_size and self._writer.tell() > len(PACK_MAGIC):
+                    self._writer.close()
+                    self._pack += 1
+                    self._open_pack()
+                self._writer.write(ENTRY_HEADER.pack(digest.digest(), len(compressed)))
+                offset = self._writer.tell()
+                self._writer.write(compressed)
+                self._new_blobs[key] = (key, self._pack, offset, len(compressed), len(data))
+            self._new_pages.append((authority, uid, kind, url, fetched_at, key, int(text)))
+            if len(self._new_pages) >= self.batch_size:
+                self.flush()
+        return key
+
+    def _has_blob(self, key):
+        return self._db.execute("SELECT 1 FROM blobs WHERE hash=?", (key,)).fetchone() is not None
+
+    def flush(self):
+        ' write the pack data and then the index rows (so the index never points past the end of a pack) '
+        with self._lock:
+            if self._writer is None:
+                return
+            self._writer.flush()
+            if self._new_blobs or self._new_pages:
+                with self._db: # one transaction per batch
+                    self._db.executemany("INSERT OR IGNORE INTO blobs VALUES (?,?,?,?,?)", self._new_blobs.values())
+                    self._db.executemany("INSERT INTO pages VALUES (?,?,?,?,?,?,?)", self._new_pages)
+                self._new_blobs = {}
+                self._new_pages = []
+
+    def get(self, key, text=False):
+        """ the page body with this content hash (decoded from UTF-8 if 'text') or None if it is not archived """
+        with self._lock:
+            self.flush()
+            row = self._db.execute("SELECT pack, offset, length FROM blobs WHERE hash=?", (key,)).fetchone()
+            if not row:
+                return None
+            pack, offset, length = row
+            reader = self._readers.get(pack)
+            if reader is None:
+                reader = self._readers[pack] = open(self._pack_path(pack), 'rb')
+            reader.seek(offset)
+            data = zlib.decompress(reader.read(length))
+        return data.decode('utf-8') if text else data
+
+    def pages(self, authority, uid=None, kind=None):
+        """ list of the archived fetches for an authority (optionally one uid and/or kind), oldest first
+        each is a dict with 'authority', 'uid', 'kind', 'url', 'fetched_at', 'hash' and 'text' keys """
+        sql = "SELECT authority, uid, kind, url, fetched_at, hash, text FROM pages WHERE authority=?"
+        args = [ authority ]
+        if uid is not None:
+            sql += " AND uid=?"; args.append(uid)
+        if kind is not None:
+            sql += " AND kind=?"; args.append(kind)
+        with self._lock:
+            self.flush()
+            rows = self._db.execute(sql + " ORDER BY fetched_at, rowid", args).fetchall()
+        fields = ('authority', 'uid', 'kind', 'url', 'fetched_at', 'hash', 'text')
+        return [ dict(zip(fields, r), text=bool(r[6])) for r in rows ]
+
+    def latest(self, authority, uid, kind='detail'):
+        ' the most recent archived fetch of this kind for one uid, as in pages() plus its \'body\' - or None '
+        found = self.pages(authority, uid, kind)
+        if not found:
+            return None
+        page = found[-1]
+        page['body'] = self.get(page['hash'], page['text'])
+        return page
+
+    def uids(self, authority, kind='detail'):
+        ' the distinct uids of an authority which have archived pages of this kind '
+        with self._lock:
+            self.flush()
+            return [ r[0] for r in self._db.execute("SELECT DISTINCT uid FROM pages WHERE authority=? AND kind=? ORDER BY uid",
+                (authority, kind)) ]
+
+    def authorities(self):
+        with self._lock:
+            self.flush()
+            return [ r[0] for r in self._db.execute("SELECT DISTINCT authority FROM pages ORDER BY authority") ]
+
+    def stats(self):
+        ' number of fetches and distinct bodies, plus the total raw and compressed sizes of the bodies '
+        with self._lock:
+            self.flush()
+            pages = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size, length = self._db.execute("SELECT COUNT(*), SUM(size), SUM(length) FROM blobs").fetchone()
+        return { 'pages': pages, 'blobs': blobs, 'bytes': size or 0, 'stored_bytes': length or 0 }
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.flush()
+            if self._writer is not None:
+                self._writer.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._db.close()
+            self.closed = True
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import run
+from scrapers import base
+from datetime import date, timedelta
+import mockserver
+import resource
+import tempfile
+import shutil
+import random
+import timeit
+import time
+
+# micro-benchmarks for the CPU bound parts of scraping - no network access
+geo = base.geo # the geo module as used by the scrapers
+
+# each benchmark prints the time per record (or call) for the variants it compares
+
+def sample_applics(count, sites=200, seed=1):
+    """ synthetic application records - locations are drawn from a fixed number of 'sites'
+    as real data where many applications share the coordinates of one development """
+    rnd = random.Random(seed)
+    locations = []
+    for i in range(sites):
+        east = rnd.randint(200000, 600000)
+        north = rnd.randint(100000, 900000)
+        kind = rnd.random()
+        if kind < 0.6:
+            locations.append({ 'easting': str(east), 'northing': str(north) })
+        elif kind < 0.9:
+            locations.append({ 'os_grid_ref': geo.eastnorth_to_osgb(east, north, 5) })
+        else:
+            locations.append({ 'latitude': '%.6f' % rnd.uniform(50.0, 55.0), 'longitude': '%.6f' % rnd.uniform(-4.0, 1.0) })
+    applics = []
+    for i in range(count):
+        applic = { 'uid': 'APP/%d' % i, 'address': '%d High Street, Sometown AB1 2CD' % i,
+            'date_received': '2017-01-%02d' % (1 + i % 28), 'date_validated': '2017-02-%02d' % (1 + i % 28) }
+        applic.update(rnd.choice(locations))
+        applics.append(applic)
+    return applics
+
+def bench_process_applic(scraper_name='Hart', count=10000, repeat=3):
+    """ per record cost of _process_applic with and without the geo conversion caches """
+    scraper = run.get_scraper_class(scraper_name).create_parser()
+    applics = sample_applics(count)
+    def process():
+        for a in applics:
+            scraper._process_applic(dict(a))
+    results = {}
+    for label, caching in [ ('uncached', False), ('cached', True) ]:
+        geo.caching = caching
+        geo.clear_caches()
+        process() # warm up (and fill the caches)
+        best = min(timeit.repeat(process, number=1, repeat=repeat))
+        results[label] = best / count
+        print '_process_applic %-8s %8.1f us/record' % (label, results[label] * 1000000.0)
+    geo.caching = True
+    print 'geo cache stats:', geo.cache_stats()
+    return results
+
+def mock_scraper(portal, family, **kwargs):
+    ' an instance of the scraper class for a platform family, pointed at a mockserver.MockPortal '
+    module_name, class_name, attrs = mockserver.families[family]
+    attrs = dict(attrs, _authority_name='Mock' + family)
+    attrs['_search_url'] = portal.url + attrs['_search_url']
+    cls = type('Mock%sScraper' % family, (run.get_class(module_name, class_name),), attrs)
+    return cls(**kwargs)
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))] if values else 0.0
+
+def bench_portal(count=200, families=None, per_day=20, latency=0.0, padding=20000, updates=50):
+    """ end to end gather_ids and update_application throughput against a local mock server for each platform family
+    'count' applications are gathered, then the first 'updates' are updated - 'latency' is the server delay per request
+    note memory is the growth in peak RSS of the process, so only shows a family that needs more than those run before it """
+    log_directory = tempfile.mkdtemp()
+    days = max(1, count / per_day)
+    date_to = date(2017, 1, 1)
+    date_from = date_to - timedelta(days=days - 1)
+    results = {}
+    try:
+        for family in families or sorted(mockserver.families.keys()):
+            with mockserver.MockPortal(per_day=per_day, latency=latency, padding=padding) as portal:
+                scraper = mock_scraper(portal, family, log_directory=log_directory)
+                scraper.batch_size = days # all in one batch
+                scraper.min_id_goal = days * per_day
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                start = time.time()
+                gathered = scraper.gather_ids(date_from.isoformat(), (date_to + timedelta(days=1)).isoformat())
+                gather_time = time.time() - start
+                if 'scrape_error' in gathered:
+                    print '%-16s gather_ids error: %s' % (family, gathered['scrape_error'])
+                    continue
+                ids = gathered['result']
+                gather_requests = scraper.metrics.requests
+                request_time = scraper.metrics.summary('http_request_seconds')
+                latencies = []; errors = 0
+                for applic in ids[:updates]:
+                    start = time.time()
+                    updated = scraper.update_application(applic)
+                    latencies.append(time.time() - start)
+                    if 'scrape_error' in updated:
+                        errors += 1
+                update_time = sum(latencies)
+                result = { 'ids': len(ids), 'gather_seconds': gather_time, 'ids_per_second': len(ids) / gather_time,
+                    'gather_requests': gather_requests, 'request_mean_seconds': request_time['mean'],
+                    'updates': len(latencies), 'update_errors': errors,
+                    'updates_per_second': len(latencies) / update_time if update_time else 0.0,
+                    'update_mean_seconds': update_time / len(latencies) if latencies else 0.0,
+                    'update_p95_seconds': _percentile(latencies, 95),
+                    'update_requests': scraper.metrics.requests - gather_requests,
+                    'peak_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss }
+                results[family] = result
+                print '%-16s gather_ids %5d ids %8.1f ids/s %4d requests | update_application %4d apps %d errors %7.1f apps/s mean %6.1f ms p95 %6.1f ms | +%d KB' % (
+                    family, result['ids'], result['ids_per_second'], result['gather_requests'], result['updates'],
+                    result['update_errors'], result['updates_per_second'], result['update_mean_seconds'] * 1000.0,
+                    result['update_p95_seconds'] * 1000.0, result['peak_rss_growth_kb'])
+    finally:
+        shutil.rmtree(log_directory, ignore_errors=True)
+    return results
+
+benchmarks = { 'process_applic': bench_process_applic, 'portal': bench_portal }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run micro-benchmarks')
+    parser.add_argument("benchmarks", help="benchmarks to run (default all): %s" % ", ".join(sorted(benchmarks.keys())), nargs="*")
+    parser.add_argument("-n", "--number", help="number of records (default depends on the benchmark)", type=int)
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error('unknown benchmark: %s' % name)
+
+    for name in args.benchmarks or sorted(benchmarks.keys()):
+        print '*** %s ***' % name
+        if args.number:
+            benchmarks[name](count=args.number)
+        else:
+            benchmarks[name]()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from cStringIO import StringIO
+import threading
+import urlparse
+import urllib
+import httplib
+import atexit
+import json
+import gzip
+import os
+import mechanize
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.response import HTTPResponse
+
+# record and replay of HTTP traffic, so scraper flows can be run offline - see BaseScraper.use_cassette()
+# in 'record' mode every request/response pair is saved to a cassette (gzipped JSON) when the cassette is saved,
+# in 'replay' mode requests are answered from the cassette and never reach the network
+# each redirect hop is a separate interaction, so redirects and cookies are handled by the browser/session as normal
+# requests are matched on method, URL and body (eg form POST data) - repeats of the same request are served
+# in the order they were recorded, with the last one repeated if there are more requests than recordings
+# the same cassette format is used by the mechanize Browser (CassetteHandler) and requests Session (CassetteAdapter)
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = [ RECORD, REPLAY ]
+
+_skip_headers = ('content-encoding', 'transfer-encoding', 'content-length') # bodies are stored decoded
+
+_cassettes = {} # path -> open Cassette, so all scrapers/instances using one path share it
+_cassettes_lock = threading.Lock()
+
+def open_cassette(path, mode=REPLAY, ignore=()):
+    ' returns the shared Cassette for this path, opening it if necessary '
+    path = os.path.abspath(path)
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None or cassette.mode != mode:
+            cassette = _cassettes[path] = Cassette(path, mode, ignore)
+    return cassette
+
+def save_all():
+    ' saves all recording cassettes '
+    with _cassettes_lock:
+        cassettes = _cassettes.values()
+    for cassette in cassettes:
+        cassette.save()
+
+class CassetteMiss(Exception):
+    ' a request that is not in a replay cassette '
+    pass
+
+# replay misses are raised as the fetch errors each client expects (so scrapers fail the fetch as usual)
+# but are still a CassetteMiss, so the host health tracking does not count them as host failures
+class MissURLError(CassetteMiss, mechanize.URLError):
+    pass
+
+class MissConnectionError(CassetteMiss, requests.exceptions.ConnectionError):
+    pass
+
+class Cassette(object):
+
+    def __init__(self, path, mode=REPLAY, ignore=()):
+        """ 'mode' is 'record' (starts empty, saved on save() or at exit) or 'replay' (the file must exist,
+        or if 'path' is None the cassette starts empty and is filled with record() - eg see reextract.py)
+        'ignore' are names of query or form parameters which vary between runs (eg cache busting timestamps)
+        and are not used to match requests """
+        if mode not in MODES:
+            raise ValueError("unknown cassette mode '%s'" % mode)
+        self.path = path
+        self.mode = mode
+        self.ignore = set(ignore)
+        self.interactions = []
+        self.misses = 0 # replay requests that were not found
+        self._index = {} # request key -> list of interactions
+        self._played = {} # request key -> number of times served
+        self._dirty = False
+        self._lock = threading.Lock()
+        if mode == RECORD:
+            atexit.register(self.save)
+        elif path is not None:
+            with gzip.open(path, 'rb') as f:
+                for i in json.load(f)['interactions']:
+                    self._add(i)
+
+    def __len__(self):
+        return len(self.interactions)
+
+    @property
+    def recording(self):
+        return self.mode == RECORD
+
+    def key(self, method, url, body):
+        ' the identity of a request - method, URL and body with any ignored parameters removed '
+        body = _to_bytes(body)
+        if self.ignore:
+            parts = urlparse.urlsplit(url)
+            if parts.query:
+                url = urlparse.urlunsplit(parts[:3] + (self._strip(parts.query),) + parts[4:])
+            if body and '=' in body:
+                body = self._strip(body)
+        return (method.upper(), url, body)
+
+    def _strip(self, query):
+        pairs = urlparse.parse_qsl(query, keep_blank_values=True)
+        return urllib.urlencode([ (k, v) for k, v in pairs if k not in self.ignore ])
+
+    def _add(self, interaction):
+        self.interactions.append(interaction)
+        key = self.key(interaction['method'], interaction['url'], _from_text(interaction['body']))
+        self._index.setdefault(key, []).append(interaction)
+
+    def record(self, method, url, body, status, reason, headers, data):
+        """ add one request/response - 'headers' is a list of (name, value) tuples, 'body' and 'data' are byte strings """
+        interaction = { 'method': method.upper(), 'url': url, 'body': _to_text(body), 'status': status, 'reason': reason,
+            'headers': [ [ k, v ] for k, v in headers if k.lower() not in _skip_headers ], 'data': _to_text(data) }
+        with self._lock:
+            self._add(interaction)
+            self._dirty = True
+
+    def play(self, method, url, body):
+        """ returns (status, reason, headers, data) for the next recording of the request
+        raises CassetteMiss if the request was never recorded """
+        key = self.key(method, url, body)
+        with self._lock:
+            found = self._index.get(key)
+            if not found:
+                self.misses += 1
+                raise CassetteMiss('%s %s not in cassette %s' % (method.upper(), url, self.path))
+            count = self._played.get(key, 0)
+            self._played[key] = count + 1
+        interaction = found[min(count, len(found) - 1)]
+        return (interaction['status'], interaction['reason'], [ tuple(h) for h in interaction['headers'] ],
+            _from_text(interaction['data']))
+
+    def rewind(self):
+        ' start replaying from the first recording of each request again '
+        with self._lock:
+            self._played = {}
+
+    def save(self):
+        ' writes the recordings to the cassette file (only if anything new has been recorded) '
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + '.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                json.dump({ 'version': 1, 'interactions': self.interactions }, f, separators=(',', ':'))
+            os.rename(tmp_path, self.path)
+            self._dirty = False
+
+# note bodies are byte strings - they are stored in JSON as latin-1 text, which maps every byte to one character
+def _to_bytes(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def _to_text(value):
+    return _to_bytes(value).decode('latin-1')
+
+def _from_text(value):
+    return value.encode('latin-1') if value else ''
+
+def _header_pairs(lines):
+    ' (name, value) tuples from raw header lines, keeping repeated headers eg Set-Cookie '
+    pairs = []
+    for line in lines:
+        if line[:1] in (' ', '\t') and pairs: # continuation line
+            pairs[-1] = (pairs[-1][0], pairs[-1][1] + ' ' + line.strip())
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            pairs.append((name.strip(), value.strip()))
+    return pairs
+
+class CassetteHandler(mechanize.BaseHandler):
+    """ mechanize handler which records responses to (or replays them from) a cassette
+    runs after gzip decoding but before the standard handlers, so recordings are of the pages before any etree/soup massaging 
+    note mechanize only allows one handler for each order value """
+
+    handler_order = 250
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def http_open(self, request):
+        if self.cassette.recording:
+            return None # carry on to the real HTTP handler
+        try:
+            status, reason, headers, data = self.cassette.play(request.get_method(), request.get_full_url(), request.get_data())
+        except CassetteMiss as e:
+            raise MissURLError(str(e))
+        return mechanize.make_response(data, headers, request.get_full_url(), status, reason)
+
+    https_open = http_open
+
+    def http_response(self, request, response):
+        if not self.cassette.recording:
+            return response
+        data = response.read()
+        headers = _header_pairs(response.info().headers)
+        self.cassette.record(request.get_method(), request.get_full_url(), request.get_data(),
+            response.code, response.msg, headers, data)
+        return mechanize.make_response(data, headers, response.geturl(), response.code, response.msg)
+
+    https_response = http_response
+
+class _OriginalResponse(object):
+    ' stands in for the httplib response, so requests can extract the cookies from a replayed response '
+    def __init__(self, headers):
+        self.msg = httplib.HTTPMessage(StringIO(''.join('%s: %s\r\n' % (k, v) for k, v in headers) + '\r\n'))
+
+    def isclosed(self):
+        return True
+
+class CassetteAdapter(HTTPAdapter):
+    """ requests transport adapter which records responses to (or replays them from) a cassette
+    when recording, requests are sent by 'adapter' (by default a standard HTTPAdapter) """
+
+    def __init__(self, cassette, adapter=None):
+        super(CassetteAdapter, self).__init__()
+        self.cassette = cassette
+        self.adapter = adapter or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        if self.cassette.recording:
+            response = self.adapter.send(request, **kwargs)
+            headers = response.raw.headers if response.raw is not None else response.headers
+            headers = list(getattr(headers, 'iteritems', headers.items)())
+            self.cassette.record(request.method, request.url, request.body, response.status_code, response.reason,
+                headers, response.content)
+            return response
+        try:
+            status, reason, headers, data = self.cassette.play(request.method, request.url, request.body)
+        except CassetteMiss as e:
+            raise MissConnectionError(str(e), request=request)
+        raw = HTTPResponse(body=StringIO(data), headers=headers, status=status, reason=reason,
+            preload_content=False, decode_content=False, original_response=_OriginalResponse(headers))
+        return self.build_response(request, raw)
+
+    def close(self):
+        self.adapter.close()
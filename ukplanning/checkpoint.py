@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import sqlite3
+import threading
+import json
+from datetime import datetime, time
+
+# durable progress of gather_ids() calls - see BaseScraper.use_checkpoints()
+# after each successful batch the scraper records its cursor and the batch results here,
+# so if the process dies a repeat of the same gather_ids() call carries on from the last completed batch
+# checkpoints are keyed on the authority and the sequence range of the gather_ids() call, and deleted when the call returns
+# a checkpoint saved on an earlier day (or more than 'max_age' ago) is stale - it is never resumed and is removed
+
+class CheckpointStore(object):
+
+    def __init__(self, path, max_age=None):
+        """ 'path' is the SQLite database file (one store can be shared by many scrapers and threads)
+        'max_age' is an optional timedelta - checkpoints older than this are stale even if saved on the same day """
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS checkpoints (authority TEXT, request TEXT,
+                start TEXT, current TEXT, ok_current TEXT, batches INTEGER, updated TEXT, PRIMARY KEY (authority, request))""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS batches (authority TEXT, request TEXT, batch INTEGER,
+                result TEXT, PRIMARY KEY (authority, request, batch))""")
+        self.expire()
+
+    def _stale_before(self):
+        ' checkpoints last updated before this time (an iso string) are stale '
+        now = datetime.now()
+        oldest = datetime.combine(now.date(), time())
+        if self.max_age is not None and now - self.max_age > oldest:
+            oldest = now - self.max_age
+        return oldest.isoformat()
+
+    def save(self, authority, request, start, current, ok_current, result):
+        """ record a completed batch - cursor values are sequence strings, 'result' is the list of records from the batch
+        returns the number of batches now stored """
+        with self._lock:
+            with self._db: # one transaction, so the cursor and results always agree
+                row = self._db.execute("SELECT batches FROM checkpoints WHERE authority=? AND request=?",
+                    (authority, request)).fetchone()
+                batch = row[0] + 1 if row else 1
+                self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?,?,?,?,?,?,?)",
+                    (authority, request, start, current, ok_current, batch, datetime.now().isoformat()))
+                self._db.execute("INSERT OR REPLACE INTO batches VALUES (?,?,?,?)",
+                    (authority, request, batch, json.dumps(result, default=str)))
+            return batch
+
+    def load(self, authority, request):
+        """ returns a dict with the 'start', 'current', 'ok_current' cursor strings and the accumulated 'result'
+        or None if there is no checkpoint (or it is stale) """
+        with self._lock:
+            row = self._db.execute("SELECT start, current, ok_current, updated FROM checkpoints WHERE authority=? AND request=?",
+                (authority, request)).fetchone()
+            if not row:
+                return None
+            if row[3] < self._stale_before(): # removed, so a new run of the same request starts from scratch
+                with self._db:
+                    self._db.execute("DELETE FROM checkpoints WHERE authority=? AND request=?", (authority, request))
+                    self._db.execute("DELETE FROM batches WHERE authority=? AND request=?", (authority, request))
+                return None
+            result = []
+            for batch in self._db.execute("SELECT result FROM batches WHERE authority=? AND request=? ORDER BY batch",
+                    (authority, request)):
+                result.extend(json.loads(batch[0]))
+        return { 'start': row[0], 'current': row[1], 'ok_current': row[2], 'result': result }
+
+    def delete(self, authority, request=None):
+        ' remove the checkpoint for one request - or all checkpoints for the authority '
+        with self._lock:
+            with self._db:
+                if request is None:
+                    self._db.execute("DELETE FROM checkpoints WHERE authority=?", (authority,))
+                    self._db.execute("DELETE FROM batches WHERE authority=?", (authority,))
+                else:
+                    self._db.execute("DELETE FROM checkpoints WHERE authority=? AND request=?", (authority, request))
+                    self._db.execute("DELETE FROM batches WHERE authority=? AND request=?", (authority, request))
+
+    def expire(self):
+        ' remove all stale checkpoints - returns the number removed '
+        with self._lock:
+            with self._db:
+                before = self._stale_before()
+                self._db.execute("""DELETE FROM batches WHERE EXISTS (SELECT 1 FROM checkpoints c WHERE c.authority=batches.authority
+                    AND c.request=batches.request AND c.updated < ?)""", (before,))
+                return self._db.execute("DELETE FROM checkpoints WHERE updated < ?", (before,)).rowcount
+
+    def pending(self):
+        ' list of (authority, request, batches, updated) for all unfinished gathers '
+        with self._lock:
+            return self._db.execute("SELECT authority, request, batches, updated FROM checkpoints ORDER BY authority").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,11 +1,17 @@
 from osgb import eastnorth_to_osgb, osgb_to_lonlat, lonlat_to_eastnorth, osgb_to_eastnorth
 from geo_helper import turn_osgb36_into_wgs84, turn_eastingnorthing_into_osgb36, turn_eastingnorthing_into_osie36, turn_osie36_into_wgs84
 from geo_helper import turn_wgs84_into_osgb36, turn_osgb36_into_eastingnorthing, turn_wgs84_into_osie36, turn_osie36_into_eastingnorthing
+from vector import eastnorth_to_latlng, has_numpy
+from postcodes import PostcodeIndex
 from math import radians, cos, sin, asin, sqrt, pi
 import urllib2
 import re
 import sys
 sys.path.append('..')
+try:
+    from ukplanning.myutils import LRUCache
+except ImportError:
+    from myutils import LRUCache
 
 MINUKLNG = -11.0 # now includes most westerly point of Ireland as well
 MAXUKLNG = 4.0
@@ -21,6 +27,19 @@ LOWEAST_IE = 1000.0
 LOWNORTH_IE = 1000.0 
 
 
+# bounded caches for repeated conversions - the same coordinates recur across refresh runs
+# and across the many applications for one development site
+caching = True
+eastnorth_cache = LRUCache(100000) # (grid, easting, northing) -> (lng, lat) or None
+grid_ref_cache = LRUCache(100000) # os grid ref string -> (easting, northing) or None if invalid
+
+def cache_stats():
+    return { 'eastnorth': eastnorth_cache.stats(), 'grid_ref': grid_ref_cache.stats() }
+    
+def clear_caches():
+    eastnorth_cache.clear()
+    grid_ref_cache.clear()
+
 try:
   import json
 except:
@@ -94,6 +113,48 @@ def lnglat_from_app_lnglat(applic):
                  
 def lnglat_from_app_eastnorth(applic):
     # try to get valid lat and lng from easting, northing or OS grid ref values if they exist
+    result = eastnorth_from_applic(applic)
+    if not result:
+        return None
+    east, north, grid = result
+    if not caching:
+        return lnglat_from_eastnorth(east, north, grid)
+    key = (grid, east, north)
+    result = eastnorth_cache.get(key, False) # note None is a valid cached result
+    if result is False:
+        result = lnglat_from_eastnorth(east, north, grid)
+        eastnorth_cache.put(key, result)
+    return result
+    
+def lnglat_from_eastnorth(east, north, grid='GB'):
+    try: 
+        result = os_easting_northing_to_latlng(east, north, grid)
+        lat = float(result[0])
+        lng = float(result[1])
+        if lng > MINUKLNG and lng < MAXUKLNG and lat > MINUKLAT and lat < MAXUKLAT:
+            # sanity check - make sure the converted values are within the UK/Irish rough lat lon range
+            return lng, lat
+    except:
+        pass
+    return None
+    
+def eastnorth_from_grid_ref(grid_ref):
+    ' cached osgb_to_eastnorth - raises ValueError if the grid ref is invalid '
+    if not caching:
+        return osgb_to_eastnorth(grid_ref)
+    result = grid_ref_cache.get(grid_ref, False)
+    if result is False:
+        try:
+            result = osgb_to_eastnorth(grid_ref)
+        except:
+            result = None
+        grid_ref_cache.put(grid_ref, result)
+    if result is None:
+        raise ValueError('Invalid OS grid reference: %s' % grid_ref)
+    return result
+    
+def eastnorth_from_applic(applic):
+    # get valid easting, northing and grid from easting, northing or OS grid ref values if they exist
     # NB need postcode information to say whether it is on the Irish or GB grids
     east = None; north = None
     pc = applic.get('postcode')
@@ -110,33 +171,75 @@ def lnglat_from_app_eastnorth(applic):
                 coords = applic['os_grid_ref'].split(',')
                 east, north = eastnorth_float(coords[0], coords[1])
             else:
-                east, north = osgb_to_eastnorth(applic['os_grid_ref'])
-        if grid == 'GB':
-            if east <= 0.0 or north <= 0.0 or east >= MAXEAST or north >= MAXNORTH:
-                # sanity check - make sure the values are within the GB grid range
-                return None
-            elif east <= LOWEAST and north <= LOWNORTH: # in lower left SW Atlantic
-                return None
-        elif grid == 'IE':
-            if east <= 0.0 or north <= 0.0 or east >= MAXEAST_IE or north >= MAXNORTH_IE:
-                # sanity check - make sure the values are within the IE grid range
-                return None
-            elif east <= LOWEAST_IE and north <= LOWNORTH_IE: # in lower left SW Atlantic
-                return None
+                east, north = eastnorth_from_grid_ref(applic['os_grid_ref'])
+        if not eastnorth_in_range(east, north, grid):
+            return None
     except:
         return None
     if not east and not north:
         return None
-    try: 
-        result = os_easting_northing_to_latlng(east, north, grid)
-        lat = float(result[0])
-        lng = float(result[1])
+    return east, north, grid
+    
+def eastnorth_in_range(east, north, grid='GB'):
+    # sanity check - make sure the values are within the GB or IE grid range
+    if grid == 'GB':
+        if east <= 0.0 or north <= 0.0 or east >= MAXEAST or north >= MAXNORTH:
+            return False
+        elif east <= LOWEAST and north <= LOWNORTH: # in lower left SW Atlantic
+            return False
+    elif grid == 'IE':
+        if east <= 0.0 or north <= 0.0 or east >= MAXEAST_IE or north >= MAXNORTH_IE:
+            return False
+        elif east <= LOWEAST_IE and north <= LOWNORTH_IE: # in lower left SW Atlantic
+            return False
+    return True
+    
+def lnglats_from_eastnorths(eastings, northings, grid='GB'):
+    """ batch version of os_easting_northing_to_latlng for sequences of eastings and northings on one grid 
+    converted in one vectorised call (if numpy is installed) with the same sanity checks as lnglat_from_applic
+    returns a list of (lng, lat) tuples, or None where the input or converted values are out of range """
+    results = [ None ] * len(eastings)
+    valid = [ i for i, (e, n) in enumerate(zip(eastings, northings)) if (e or n) and eastnorth_in_range(e, n, grid) ]
+    if not valid:
+        return results
+    lats, lngs = eastnorth_to_latlng([ eastings[i] for i in valid ], [ northings[i] for i in valid ], grid)
+    for i, lat, lng in zip(valid, lats, lngs):
+        lat = float(lat); lng = float(lng)
         if lng > MINUKLNG and lng < MAXUKLNG and lat > MINUKLAT and lat < MAXUKLAT:
-            # sanity check - make sure the converted values are within the UK/Irish rough lat lon range
-            return lng, lat
-    except:
-        pass
-    return None
+            results[i] = (lng, lat)
+    return results
+    
+def lnglats_from_grid_refs(grid_refs):
+    """ batch conversion of OS (GB) grid references to WGS84 - returns a list of (lng, lat) tuples or None """
+    eastings = []; northings = []
+    for ref in grid_refs:
+        try:
+            east, north = eastnorth_from_grid_ref(ref)
+        except:
+            east, north = None, None
+        eastings.append(east); northings.append(north)
+    return lnglats_from_eastnorths(eastings, northings)
+    
+def lnglats_from_applics(applics):
+    """ batch version of lnglat_from_applic - returns a list of (lng, lat) tuples or None for each application
+    the easting/northing conversions for each grid are done in one vectorised call """
+    results = []
+    pending = { 'GB': [], 'IE': [] }
+    for i, applic in enumerate(applics):
+        result = None
+        if 'latitude' in applic and 'longitude' in applic:
+            result = lnglat_from_app_lnglat(applic) # any directly specified longitude/latitude values get priority
+        if not result:
+            eastnorth = eastnorth_from_applic(applic)
+            if eastnorth:
+                pending[eastnorth[2]].append((i, eastnorth[0], eastnorth[1]))
+        results.append(result)
+    for grid, items in pending.items():
+        if items:
+            lnglats = lnglats_from_eastnorths([ x[1] for x in items ], [ x[2] for x in items ], grid)
+            for item, lnglat in zip(items, lnglats):
+                results[item[0]] = lnglat
+    return results
     
 def haversine(lon1, lat1, lon2, lat2):
     """
@@ -178,3 +281,4 @@ def great_circle(lon, lat, radius, npoints=32):
     return points
     
 
+from spatial import SpatialIndex # after haversine, which it uses
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import csv
+import mmap
+import os
+import struct
+
+# offline postcode centroid lookup - no network geocoding
+# the index file is built once from an ONS style postcode CSV (e.g. ONSPD or NSPL - columns pcd/pcds, lat, long)
+# and holds fixed width records sorted on postcode, so a lookup is a binary search over a memory mapped file
+# (nothing is read at startup, the OS pages in only the parts of the file that are used)
+
+MAGIC = 'UKPCIDX1'
+HEADER = struct.Struct('<8sQ') # magic, number of records
+RECORD = struct.Struct('<8sii') # postcode (no spaces, space padded), latitude and longitude in microdegrees
+SCALE = 1000000.0
+
+POSTCODE_COLUMNS = [ 'pcds', 'pcd', 'pcd7', 'pcd8', 'postcode' ]
+LAT_COLUMNS = [ 'lat', 'latitude' ]
+LNG_COLUMNS = [ 'long', 'lng', 'longitude' ]
+
+def postcode_key(postcode):
+    ' fixed width index key for a postcode eg "SW1A 1AA" -> "SW1A1AA " '
+    return postcode.replace(' ', '').upper()[:8].ljust(8)
+
+class PostcodeIndex(object):
+    """ read only sorted postcode index file - lookups return (lng, lat) tuples as other geo functions """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD.size:
+            self.close()
+            raise ValueError('Not a valid postcode index file: %s' % path)
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i):
+        start = HEADER.size + i * RECORD.size
+        return self._map[start:start+8]
+
+    def lookup(self, postcode):
+        ' returns (lng, lat) for a full postcode or None if it is not in the index '
+        if not postcode:
+            return None
+        key = postcode_key(postcode)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._key(lo) == key:
+            k, lat, lng = RECORD.unpack_from(self._map, HEADER.size + lo * RECORD.size)
+            return lng / SCALE, lat / SCALE
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+def _column(fieldnames, choices):
+    lower = dict((f.strip().lower(), f) for f in fieldnames)
+    for c in choices:
+        if c in lower:
+            return lower[c]
+    raise ValueError('No column found from %s' % str(choices))
+
+def build_index(csv_path, index_path, min_lng=-11.0, max_lng=4.0, min_lat=48.0, max_lat=62.0):
+    """ build a sorted binary index file from an ONS style postcode CSV file
+    rows with no valid location (ONS uses lat 99.999999 for these) are skipped
+    returns the number of postcodes in the index """
+    rows = {}
+    with open(csv_path, 'rb') as f:
+        reader = csv.DictReader(f)
+        pc_col = _column(reader.fieldnames, POSTCODE_COLUMNS)
+        lat_col = _column(reader.fieldnames, LAT_COLUMNS)
+        lng_col = _column(reader.fieldnames, LNG_COLUMNS)
+        for row in reader:
+            try:
+                lat = float(row[lat_col])
+                lng = float(row[lng_col])
+            except (ValueError, TypeError):
+                continue
+            if row[pc_col] and lng > min_lng and lng < max_lng and lat > min_lat and lat < max_lat:
+                rows[postcode_key(row[pc_col])] = (int(round(lat * SCALE)), int(round(lng * SCALE)))
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(rows)))
+        for key in sorted(rows.keys()):
+            lat, lng = rows[key]
+            f.write(RECORD.pack(key, lat, lng))
+    if os.path.exists(index_path): # rename is not atomic over an existing file on Windows
+        os.remove(index_path)
+    os.rename(tmp_path, index_path)
+    return len(rows)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build or query an offline postcode centroid index')
+    parser.add_argument("index", help="index file")
+    parser.add_argument("-b", "--build", help="ONS style postcode CSV file to build the index from")
+    parser.add_argument("-q", "--query", help="postcodes to look up", nargs='*', default=[])
+    args = parser.parse_args()
+
+    if args.build:
+        print 'Built %s with %d postcodes' % (args.index, build_index(args.build, args.index))
+    if args.query:
+        index = PostcodeIndex(args.index)
+        for pc in args.query:
+            print pc, index.lookup(pc)
+        index.close()
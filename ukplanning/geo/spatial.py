@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from math import floor, sin, cos, asin, radians, degrees
+import threading
+from . import haversine
+
+# in memory spatial index over scraped applications (or any located items)
+# points are bucketed into a regular grid of lng/lat cells, so a query only visits the cells
+# overlapping its bounding box, and haversine is only used to filter the candidates in those cells
+
+EARTH_RADIUS = 6372.8 # km, as haversine()
+
+def record_key(record):
+    ' default index key for a scraped application '
+    return (record.get('authority'), record.get('uid'))
+
+class SpatialIndex(object):
+
+    def __init__(self, cell_size=0.01):
+        """ 'cell_size' is the grid cell size in degrees (0.01 is roughly 1km north/south, 0.7km east/west in the UK) """
+        self.cell_size = float(cell_size)
+        self._cells = {} # (lat cell, lng cell) -> { key: (lng, lat, item) }
+        self._where = {} # key -> cell, to allow updates and removals
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _cell(self, lng, lat):
+        return (int(floor(lat / self.cell_size)), int(floor(lng / self.cell_size)))
+
+    def add(self, key, lng, lat, item=None):
+        """ add or move an item - 'key' identifies it for later updates, 'item' is what queries return (defaults to the key) """
+        cell = self._cell(lng, lat)
+        with self._lock:
+            self._discard(key)
+            self._cells.setdefault(cell, {})[key] = (lng, lat, key if item is None else item)
+            self._where[key] = cell
+
+    def remove(self, key):
+        ' remove an item - returns False if it is not in the index '
+        with self._lock:
+            return self._discard(key)
+
+    def _discard(self, key):
+        cell = self._where.pop(key, None)
+        if cell is None:
+            return False
+        bucket = self._cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self._cells[cell]
+        return True
+
+    def add_record(self, record, key_func=record_key):
+        """ add, move or remove a scraped application record according to its 'lat'/'lng' values
+        (as set by _process_applic) - returns True if the record is located in the index """
+        key = key_func(record)
+        lng = record.get('lng')
+        lat = record.get('lat')
+        if lng is None or lat is None:
+            self.remove(key)
+            return False
+        self.add(key, float(lng), float(lat), record)
+        return True
+
+    def load(self, records, key_func=record_key):
+        ' bulk load scraped application records - returns the number located in the index '
+        count = 0
+        with self._lock:
+            for record in records:
+                if self.add_record(record, key_func):
+                    count += 1
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._cells = {}
+            self._where = {}
+
+    def _candidates(self, min_lng, min_lat, max_lng, max_lat):
+        ' all (lng, lat, item) in the cells overlapping the bounding box '
+        lat0, lng0 = self._cell(min_lng, min_lat)
+        lat1, lng1 = self._cell(max_lng, max_lat)
+        results = []
+        with self._lock:
+            if (lat1 - lat0 + 1) * (lng1 - lng0 + 1) > len(self._cells): # big box - cheaper to visit every occupied cell
+                for (clat, clng), bucket in self._cells.iteritems():
+                    if lat0 <= clat <= lat1 and lng0 <= clng <= lng1:
+                        results.extend(bucket.itervalues())
+            else:
+                for clat in xrange(lat0, lat1 + 1):
+                    for clng in xrange(lng0, lng1 + 1):
+                        bucket = self._cells.get((clat, clng))
+                        if bucket:
+                            results.extend(bucket.itervalues())
+        return results
+
+    def within_bbox(self, min_lng, min_lat, max_lng, max_lat):
+        ' list of items inside the bounding box '
+        return [ item for lng, lat, item in self._candidates(min_lng, min_lat, max_lng, max_lat)
+            if min_lng <= lng <= max_lng and min_lat <= lat <= max_lat ]
+
+    def within_radius(self, lng, lat, radius):
+        """ items within 'radius' km of the point as a list of (distance km, item) tuples, nearest first """
+        angle = radius / EARTH_RADIUS # angular radius in radians
+        dlat = degrees(angle)
+        max_lat = min(lat + dlat, 90.0)
+        min_lat = max(lat - dlat, -90.0)
+        ratio = sin(angle) / cos(radians(lat)) if abs(lat) < 90.0 else 2.0
+        if max_lat >= 90.0 or min_lat <= -90.0 or ratio >= 1.0: # circle contains a pole
+            min_lng, max_lng = -180.0, 180.0
+        else:
+            dlng = degrees(asin(ratio)) # exact longitude half width of a circle on a sphere
+            min_lng, max_lng = lng - dlng, lng + dlng
+        results = []
+        for plng, plat, item in self._candidates(min_lng, min_lat, max_lng, max_lat):
+            distance = haversine(lng, lat, plng, plat)
+            if distance <= radius:
+                results.append((distance, item))
+        results.sort(key=lambda x: x[0])
+        return results
+
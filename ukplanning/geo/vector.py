@@ -0,0 +1,129 @@
+# Vectorised (batch) versions of the geo_helper easting/northing -> WGS84 conversion
+#
+# Same calculations as turn_eastingnorthing_into_latlong, turn_llh_into_xyz,
+#  turn_xyz_into_other_xyz and turn_xyz_into_llh but applied to whole arrays
+#  of eastings and northings in one call using numpy
+#
+# If numpy is not installed the same functions fall back to a (slow) loop
+#  over the scalar geo_helper functions
+
+import math
+from geo_helper import abe_values, transform_values, en_values
+from geo_helper import turn_eastingnorthing_into_latlong, turn_llh_into_xyz, turn_xyz_into_other_xyz, turn_xyz_into_llh
+
+try:
+        import numpy as np
+except ImportError:
+        np = None
+
+HEIGHT = 200.0 # assumed altitude in metres (as os_easting_northing_to_latlng)
+
+schemes = { 'GB': 'osgb', 'IE': 'osie' }
+
+def has_numpy():
+        return np is not None
+
+def eastingnorthing_into_latlong(easting,northing,scheme):
+        """Array version of turn_eastingnorthing_into_latlong - returns arrays of OSGB36 / OSIE36 (decimal) lat, long"""
+
+        n0, e0, f0, theta0, landa0 = en_values[scheme]
+        a, b, e2 = abe_values[scheme]
+
+        n = (a-b) / (a+b)
+        mc = [ 1.0 + n + 5.0/4.0 *n*n + 5.0/4.0 *n*n*n, 3.0*n + 3.0*n*n + 21.0/8.0 *n*n*n,
+                15.0/8.0*n*n + 15.0/8.0*n*n*n, 35.0/24.0*n*n*n ] # meridian arc coefficients
+
+        # Iterate, 4 times should be enough
+        M = np.zeros_like(northing)
+        theta = np.full_like(northing, theta0)
+        for i in range(4):
+                theta = ((northing - n0 - M) / (a * f0)) + theta
+                dtheta = theta - theta0
+                stheta = theta + theta0
+                M = b * f0 * ( mc[0] * dtheta - mc[1] * np.sin(dtheta) * np.cos(stheta) + \
+                        mc[2] * np.sin(2.0*dtheta) * np.cos(2.0*stheta) - mc[3] * np.sin(3.0*dtheta) * np.cos(3.0*stheta) )
+
+        # Compute intermediate values
+        sin2 = np.sin(theta) * np.sin(theta)
+        v = a * f0 * np.power(1 - e2 * sin2, -0.5)
+        ro = a * f0 * (1 - e2) * np.power(1 - e2 * sin2, -1.5)
+        nu2 = v/ro - 1
+        tantheta = np.tan(theta)
+        tantheta2 = tantheta * tantheta
+        costheta = np.cos(theta)
+
+        VII = tantheta / (2 * ro * v)
+        VIII = tantheta / (24 * ro * np.power(v,3)) * (5 + 3 * tantheta2 + nu2 - 9 * tantheta2 * nu2)
+        IX = tantheta / (720 * ro * np.power(v,5)) * (61 + 90 * tantheta2 + 45 * tantheta2 * tantheta2)
+        X = 1 / (costheta * v)
+        XI = 1 / (costheta * 6 * np.power(v,3)) * (v/ro + 2*tantheta2)
+        XII = 1 / (costheta * 120 * np.power(v,5)) * (5 + 28 * tantheta2 + 24 * tantheta2 * tantheta2)
+        XIIa = 1 / (costheta * 5040 * np.power(v,7)) \
+                * (61 + 662 * tantheta2 + 1320 * tantheta2 * tantheta2 + 720 * tantheta2 * tantheta2 * tantheta2)
+
+        de = easting - e0
+        lat_rad = theta - VII * np.power(de,2) + VIII * np.power(de,4) - IX * np.power(de,6)
+        long_rad = landa0 + X * de - XI * np.power(de,3) + XII * np.power(de,5) - XIIa * np.power(de,7)
+
+        return np.degrees(lat_rad), np.degrees(long_rad)
+
+def llh_into_xyz(lat_dec,long_dec,height,system):
+        """Array version of turn_llh_into_xyz"""
+
+        a, b, e2 = abe_values[system]
+
+        theta = np.radians(lat_dec)
+        landa = np.radians(long_dec)
+
+        v = a / np.sqrt( 1.0 - e2 * (np.sin(theta) * np.sin(theta)) )
+        x = (v + height) * np.cos(theta) * np.cos(landa)
+        y = (v + height) * np.cos(theta) * np.sin(landa)
+        z = ( (1.0 - e2) * v + height ) * np.sin(theta)
+
+        return x, y, z
+
+def xyz_into_other_xyz(old_x,old_y,old_z,from_scheme,to_scheme):
+        """Array version of turn_xyz_into_other_xyz (Helmert Transformation)"""
+
+        tx, ty, tz, s, rx, ry, rz = transform_values[from_scheme + "_to_" + to_scheme]
+
+        new_x = tx + ((1.0+s) * old_x) + (-rz * old_y) + (ry * old_z)
+        new_y = ty + (rz * old_x) + ((1.0+s) * old_y) + (-rx * old_z)
+        new_z = tz + (-ry * old_x) + (rx * old_y) + ((1.0+s) * old_z)
+
+        return new_x, new_y, new_z
+
+def xyz_into_llh(x,y,z,system):
+        """Array version of turn_xyz_into_llh - returns arrays of (decimal) lat, long (height is ignored)"""
+
+        a, b, e2 = abe_values[system]
+
+        p = np.sqrt(x*x + y*y)
+
+        long = np.arctan(y/x)
+        lat_init = np.arctan( z / (p * (1.0 - e2)) )
+        v = a / np.sqrt( 1.0 - e2 * (np.sin(lat_init) * np.sin(lat_init)) )
+        lat = np.arctan( (z + e2*v*np.sin(lat_init)) / p )
+
+        return np.degrees(lat), np.degrees(long)
+
+def eastnorth_to_latlng(eastings, northings, grid='GB'):
+        """Convert sequences of eastings and northings on the GB or IE grid to WGS84 latitudes and longitudes
+        (as os_easting_northing_to_latlng for each pair, assuming altitude 200m)
+        returns a pair of numpy float arrays (lats, lngs) - or lists if numpy is not available"""
+        scheme = schemes[grid]
+        if np is None:
+                lats = []; lngs = []
+                for easting, northing in zip(eastings, northings):
+                        lat, lng = turn_eastingnorthing_into_latlong(float(easting), float(northing), scheme)
+                        xyz = turn_llh_into_xyz(lat, lng, HEIGHT, scheme)
+                        xyz = turn_xyz_into_other_xyz(xyz[0], xyz[1], xyz[2], scheme, 'wgs84')
+                        llh = turn_xyz_into_llh(xyz[0], xyz[1], xyz[2], 'wgs84')
+                        lats.append(llh[0]); lngs.append(llh[1])
+                return lats, lngs
+        eastings = np.asarray(eastings, dtype=np.float64)
+        northings = np.asarray(northings, dtype=np.float64)
+        lats, lngs = eastingnorthing_into_latlong(eastings, northings, scheme)
+        x, y, z = llh_into_xyz(lats, lngs, HEIGHT, scheme)
+        x, y, z = xyz_into_other_xyz(x, y, z, scheme, 'wgs84')
+        return xyz_into_llh(x, y, z, 'wgs84')
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import functools
+import threading
+import urlparse
+import json
+import time
+
+# in process counters and timings for a scraper (see BaseScraper.metrics)
+# counters are totals, summaries hold the count, sum and max of observed values (eg seconds, pages)
+# each value is identified by a name and a set of labels, as in Prometheus
+# HTTP requests are recorded by the browser/session observers, and id batches, detail pages and
+# parse stages by the scraper wrapper methods - so no per-scraper code is needed
+
+class Metrics(object):
+
+    def __init__(self, **labels):
+        """ 'labels' are constant labels for all values (eg authority) """
+        self.labels = labels
+        self.requests = 0 # total HTTP requests - used to count the pages fetched for each batch
+        self._counters = {} # (name, labels) -> value
+        self._summaries = {} # (name, labels) -> [ count, sum, max ]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary:
+                summary[0] += 1
+                summary[1] += value
+                if value > summary[2]:
+                    summary[2] = value
+            else:
+                self._summaries[key] = [ 1, value, value ]
+
+    def total(self, name, **labels):
+        ' sum of the counter values with this name which match all the supplied labels '
+        match = set(labels.items())
+        with self._lock:
+            return sum(v for (n, l), v in self._counters.items() if n == name and match.issubset(l))
+
+    def summary(self, name, **labels):
+        ' combined count, sum, max and mean of the summary values with this name which match all the supplied labels '
+        match = set(labels.items())
+        count = 0; total = 0; maximum = None
+        with self._lock:
+            for (n, l), v in self._summaries.items():
+                if n == name and match.issubset(l):
+                    count += v[0]
+                    total += v[1]
+                    maximum = v[2] if maximum is None or v[2] > maximum else maximum
+        return { 'count': count, 'sum': total, 'max': maximum, 'mean': total / float(count) if count else None }
+
+    def record_request(self, method, url, status, elapsed, nbytes, error=None):
+        """ observer for Browser and HealthSession requests (see scrapeutils.Browser)
+        'status' is the HTTP status code or None if there was no response """
+        host = urlparse.urlsplit(url).netloc
+        with self._lock:
+            self.requests += 1
+        self.inc('http_requests_total', host=host, method=method, status=str(status) if status else 'error')
+        self.observe('http_request_seconds', elapsed, host=host, method=method)
+        if nbytes:
+            self.inc('http_response_bytes_total', nbytes, host=host)
+
+    def record_call(self, kind, elapsed, pages, result):
+        ' records the outcome of one scraper wrapper call (see measure) '
+        if not result or 'scrape_error' in result:
+            outcome = 'error'; records = 0
+        else:
+            outcome = 'ok'
+            records = len(result['result']) if isinstance(result.get('result'), list) else 1
+        self.inc('calls_total', kind=kind, outcome=outcome)
+        self.observe('call_seconds', elapsed, kind=kind)
+        self.observe('call_pages', pages, kind=kind)
+        self.observe('call_records', records, kind=kind)
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self._counters = {}
+            self._summaries = {}
+
+    def snapshot(self):
+        ' all current values as a dict of lists - suitable for JSON '
+        with self._lock:
+            counters = [ { 'name': n, 'labels': dict(l), 'value': v } for (n, l), v in sorted(self._counters.items()) ]
+            summaries = [ { 'name': n, 'labels': dict(l), 'count': v[0], 'sum': v[1], 'max': v[2] }
+                for (n, l), v in sorted(self._summaries.items()) ]
+        return { 'labels': dict(self.labels), 'counters': counters, 'summaries': summaries }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix='ukplanning_'):
+        return to_prometheus([ self ], prefix)
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = [ '%s="%s"' % (k, unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in sorted(labels.items()) ]
+    return '{' + ','.join(pairs) + '}'
+
+def to_prometheus(metrics_list, prefix='ukplanning_'):
+    ' Prometheus text exposition format for the combined values of many Metrics (eg one per scraper) '
+    counters = {}; summaries = {}
+    for m in metrics_list:
+        snap = m.snapshot()
+        for c in snap['counters']:
+            labels = dict(snap['labels'], **c['labels'])
+            counters.setdefault(c['name'], []).append((labels, c['value']))
+        for s in snap['summaries']:
+            labels = dict(snap['labels'], **s['labels'])
+            summaries.setdefault(s['name'], []).append((labels, s))
+    lines = []
+    for name in sorted(counters.keys()):
+        lines.append('# TYPE %s%s counter' % (prefix, name))
+        for labels, value in counters[name]:
+            lines.append('%s%s%s %s' % (prefix, name, _label_text(labels), value))
+    for name in sorted(summaries.keys()):
+        lines.append('# TYPE %s%s summary' % (prefix, name))
+        for labels, s in summaries[name]:
+            lines.append('%s%s_count%s %s' % (prefix, name, _label_text(labels), s['count']))
+            lines.append('%s%s_sum%s %s' % (prefix, name, _label_text(labels), s['sum']))
+        lines.append('# TYPE %s%s_max gauge' % (prefix, name))
+        for labels, s in summaries[name]:
+            lines.append('%s%s_max%s %s' % (prefix, name, _label_text(labels), s['max']))
+    return '\n'.join(lines) + '\n'
+
+def measure(kind):
+    """ decorator for scraper methods which return a result dict (eg _get_id_batch_wrapper)
+    records the time, number of HTTP requests (pages) and number of records for each call in self.metrics """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            start = time.time()
+            requests = metrics.requests
+            result = func(self, *args, **kwargs)
+            metrics.record_call(kind, time.time() - start, metrics.requests - requests, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from datetime import date, timedelta
+from cgi import escape
+import threading
+import urlparse
+import urllib
+import time
+import re
+
+# local HTTP server imitating the main planning portal families, for end to end benchmarks with no network (see bench.py)
+# every day has 'per_day' synthetic applications, generated on demand from the uid, so the server holds no data
+# the pages carry just the markup the family scrapers look for, plus optional 'padding' to bring them up to a realistic size
+#   Idox: search.do form, paged results with a next link (searchCriteria.resultsPerPage sets the size, max 100),
+#     applicationDetails.do with summary/dates/details subtabs
+#   SwiftLG: criteria form, results paged by StartIndex with a max records count, one detail page
+#   PlanningExplorer: M3Form search, results with a 'Go to next page' link, details and dates pages
+#   Civica: uid only access, results paged by a next form and limited to 'page_limit' pages, like the real sites
+
+DATE_FORMAT = '%d/%m/%Y'
+UID_REGEX = re.compile(r'^MK/(\d+)/(\d+)$')
+
+# scraper class and class variables which point a scraper of each family at the server
+families = {
+    'Idox': ('scrapers.dates.idox', 'IdoxScraper', { '_search_url': '/idox/search.do?action=advanced' }),
+    'SwiftLG': ('scrapers.dates.swiftlg', 'SwiftLGSpanScraper', { '_search_url': '/swiftlg/wphappcriteria.display' }),
+    'PlanningExplorer': ('scrapers.dates.planningexplorer', 'PlanningExplorerScraper',
+        { '_search_url': '/pe/GeneralSearch.aspx', '_search_fields': { 'rbGroup': ['rbRange'] } }),
+    'Civica': ('scrapers.dates.civica', 'CivicaScraper', { '_search_url': '/civica/plansearch.page',
+        '_date_from_field': 'dateFrom', '_date_to_field': 'dateTo', '_search_submit': 'search',
+        '_ref_field': 'ref_no', '_next_field': 'scroll_1',
+        '_scrape_min_data': """
+        <td> Reference Number </td> <td> {{ reference }} </td>
+        <td> Location </td> <td> {{ address }} </td>
+        <td> Proposal </td> <td> {{ description }} </td>
+        <td> Received Date </td> <td> {{ date_received }} </td>
+        <td> Valid Date </td> <td> {{ date_validated }} </td>
+        """ }),
+}
+
+def make_uid(day, n):
+    return 'MK/%d/%d' % (day.toordinal(), n)
+
+def application(uid):
+    ' synthetic application record for a uid (or None if the uid is not one of ours) '
+    match = UID_REGEX.match(uid or '')
+    if not match:
+        return None
+    day = date.fromordinal(int(match.group(1)))
+    n = int(match.group(2))
+    return { 'uid': uid, 'day': day,
+        'date_received': (day - timedelta(days=n % 5)).strftime(DATE_FORMAT),
+        'date_validated': day.strftime(DATE_FORMAT),
+        'target_decision_date': (day + timedelta(days=56)).strftime(DATE_FORMAT),
+        'address': '%d Mock Street, Mocktown, MK%d %dAB' % (n + 1, n % 20, n % 10),
+        'description': 'Erection of a single storey rear extension and associated works (application %d)' % n,
+        'application_type': [ 'Full Application', 'Householder', 'Listed Building Consent', 'Outline' ][n % 4],
+        'status': [ 'Pending Consideration', 'Decided', 'Withdrawn' ][n % 3],
+        'case_officer': 'Officer %d' % (n % 7), 'ward_name': 'Ward %d' % (n % 11), 'parish': 'Parish %d' % (n % 13),
+        'applicant_name': 'Applicant %d' % n, 'agent_name': 'Agent %d' % (n % 17) }
+
+class MockPortal(object):
+
+    def __init__(self, per_day=10, page_size=10, page_limit=10, latency=0.0, padding=0, host='127.0.0.1', port=0):
+        """ 'per_day' applications on each day, 'page_size' results per list page, 'page_limit' max Civica result pages
+        'latency' seconds delay before each response, 'padding' extra bytes of filler markup on each page """
+        self.per_day = per_day
+        self.page_size = page_size
+        self.page_limit = page_limit
+        self.latency = latency
+        self.padding = padding
+        self.requests = 0 # total requests served
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.portal = self
+        self._thread = None
+
+    @property
+    def url(self):
+        ' root URL of the server '
+        return 'http://%s:%d' % self._server.server_address
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        ' serve requests in a background thread '
+        if not self._thread:
+            self._thread = threading.Thread(target=self._server.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def uids(self, date_from, date_to):
+        ' all uids with a date in the range (inclusive) '
+        uids = []
+        day = date_from
+        while day <= date_to:
+            uids.extend(make_uid(day, n) for n in range(self.per_day))
+            day += timedelta(days=1)
+        return uids
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+def _dt(value):
+    try:
+        return date(*time.strptime(value.strip(), DATE_FORMAT)[:3])
+    except (ValueError, AttributeError):
+        return None
+
+def _q(value):
+    return escape(urllib.quote_plus(value), True)
+
+def _link(path, **params):
+    ' escaped URL with sorted query parameters '
+    return escape(path + '?' + urllib.urlencode(sorted(params.items())), True)
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' # keep alive
+
+    def log_message(self, format, *args): # no logging to stderr
+        pass
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        self._dispatch(dict(urlparse.parse_qsl(body, keep_blank_values=True)))
+
+    def _dispatch(self, form):
+        portal = self.server.portal
+        portal.count()
+        if portal.latency:
+            time.sleep(portal.latency)
+        parts = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(parts.query, keep_blank_values=True))
+        params.update(form)
+        route = self.routes.get(parts.path)
+        page = route(self, portal, params) if route else None
+        if page is None:
+            self._send(404, '<html><body><h1>Not Found</h1></body></html>')
+        else:
+            self._send(200, page)
+
+    def _send(self, status, page):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def _page(self, portal, body, title='Planning'):
+        filler = ''
+        if portal.padding:
+            para = '<p class="filler">Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.</p>\n'
+            filler = '<div id="footer">\n' + para * (portal.padding / len(para) + 1) + '</div>\n'
+        # note the footer text includes a quote, which the Civica data block pattern expects to follow the content
+        return '<html><head><title>%s</title></head>\n<body>\n%s\n%s<p class="footer">Mock Borough Council "Planning Online"</p>\n</body></html>' % (
+            title, body, filler)
+
+    def _range(self, params, from_field, to_field):
+        ' dates requested in a search - None if not a valid date search '
+        date_from = _dt(params.get(from_field))
+        date_to = _dt(params.get(to_field))
+        if not date_from or not date_to or date_from > date_to:
+            return None
+        return date_from, date_to
+
+    def _rows(self, portal, uids, page, page_size=None):
+        ' the uids on a (1 based) page of results and the total number of pages '
+        page_size = page_size or portal.page_size
+        pages = (len(uids) + page_size - 1) / page_size
+        return uids[(page - 1) * page_size:page * page_size], pages
+
+    # Idox
+
+    def idox_search(self, portal, params):
+        return self._page(portal, """
+        <form name="searchCriteriaForm" id="advancedSearchForm" action="advancedSearchResults.do?action=firstPage" method="post">
+        <input type="text" name="searchCriteria.reference" value=""/>
+        <input type="text" name="date(applicationReceivedStart)" value=""/>
+        <input type="text" name="date(applicationReceivedEnd)" value=""/>
+        <input type="submit" value="Search"/>
+        </form>""", 'Advanced Search')
+
+    def idox_results(self, portal, params):
+        if params.get('searchCriteria.reference'): # one application - shown directly
+            params = { 'activeTab': 'summary', 'keyVal': params['searchCriteria.reference'] }
+            return self.idox_detail(portal, params)
+        found = self._range(params, 'date(applicationReceivedStart)', 'date(applicationReceivedEnd)')
+        if not found:
+            return self._page(portal, '<div class="messagebox errors"><ul><li>No results found.</li></ul></div>')
+        date_from, date_to = found
+        page = int(params.get('page', 1))
+        page_size = min(int(params.get('searchCriteria.resultsPerPage') or portal.page_size), 100)
+        uids, pages = self._rows(portal, portal.uids(date_from, date_to), page, page_size)
+        items = []
+        for uid in uids:
+            a = application(uid)
+            items.append("""<li class="searchresult">
+            <a href="%s">%s</a>
+            <p class="address">%s</p>
+            <p class="metaInfo"> Ref. No: %s <span class="divider">|</span> Received: %s <span class="divider">|</span>
+            Validated: %s <span class="divider">|</span> Status: %s </p>
+            </li>""" % (_link('applicationDetails.do', activeTab='summary', keyVal=uid), escape(a['description']),
+                escape(a['address']), escape(uid), a['date_received'], a['date_validated'], a['status']))
+        pager = ''
+        if page < pages:
+            pager = '<p class="pager top"> <a href="%s" class="next">Next</a> </p>' % _link('pagedSearchResults.do',
+                action='page', page=page + 1, **{ 'date(applicationReceivedStart)': date_from.strftime(DATE_FORMAT),
+                'date(applicationReceivedEnd)': date_to.strftime(DATE_FORMAT), 'searchCriteria.resultsPerPage': page_size })
+        return self._page(portal, '%s\n<ul id="searchresults">\n%s\n</ul>' % (pager, '\n'.join(items)), 'Results')
+
+    def idox_detail(self, portal, params):
+        a = application(params.get('keyVal'))
+        if not a:
+            return None
+        uid = a['uid']
+        tabs = '\n'.join('<a id="subtab_%s" href="%s">%s</a>' % (tab, _link('applicationDetails.do', activeTab=tab, keyVal=uid), label)
+            for tab, label in [ ('summary', 'Summary'), ('details', 'Further Information'), ('dates', 'Important Dates') ])
+        tab = params.get('activeTab', 'summary')
+        if tab == 'dates':
+            rows = [ ('Received', a['date_received']), ('Validated', a['date_validated']),
+                ('Determination Deadline', a['target_decision_date']) ]
+        elif tab == 'details':
+            rows = [ ('Application Type', a['application_type']), ('Case Officer', a['case_officer']), ('Parish', a['parish']),
+                ('Ward', a['ward_name']), ('Applicant Name', a['applicant_name']), ('Agent Name', a['agent_name']) ]
+        else:
+            rows = [ ('Reference', uid), ('Received', a['date_received']), ('Validated', a['date_validated']),
+                ('Address', a['address']), ('Proposal', a['description']), ('Status', a['status']) ]
+        table = '\n'.join('<tr><th scope="row">%s</th><td>%s</td></tr>' % (k, escape(v)) for k, v in rows)
+        return self._page(portal, '<div class="tabcontainer">\n%s\n</div>\n<table id="simpleDetailsTable">\n%s\n</table>' % (tabs, table),
+            'Application Details')
+
+    # SwiftLG
+
+    def swiftlg_search(self, portal, params):
+        return self._page(portal, """
+        <form name="searchform" action="WPHAPPSEARCHRES.displayResultsURL" method="post">
+        <input type="text" name="APNID.MAINBODY.WPACIS.1" value=""/>
+        <input type="text" name="REGFROMDATE.MAINBODY.WPACIS.1" value=""/>
+        <input type="text" name="REGTODATE.MAINBODY.WPACIS.1" value=""/>
+        <input type="submit" name="SEARCHBUTTON.MAINBODY.WPACIS.1" value="Search"/>
+        </form>""", 'Search Criteria')
+
+    def swiftlg_results(self, portal, params):
+        found = self._range(params, 'REGFROMDATE.MAINBODY.WPACIS.1', 'REGTODATE.MAINBODY.WPACIS.1')
+        if not found:
+            return self._page(portal, '<p>Your search returned 0 matches.</p>')
+        date_from, date_to = found
+        all_uids = portal.uids(date_from, date_to)
+        start = int(params.get('StartIndex', 1))
+        uids = all_uids[start - 1:start - 1 + portal.page_size]
+        rows = '\n'.join('<tr><td><a href="%s&amp;backURL=%s">%s</a></td><td>%s</td></tr>' % (
+            _link('WPHAPPDETAIL.DisplayUrl', theApnID=uid), _q('<a href=wphappcriteria.display>Search</a>'), escape(uid),
+            escape(application(uid)['address'])) for uid in uids)
+        pages = []
+        for i, index in enumerate(range(1, len(all_uids) + 1, portal.page_size)):
+            link = 'WPHAPPSEARCHRES.displayResultsURL?ResultID=1&amp;StartIndex=%d&amp;SortOrder=rgndat:asc&amp;%s' % (index,
+                _link('', **{ 'REGFROMDATE.MAINBODY.WPACIS.1': date_from.strftime(DATE_FORMAT),
+                'REGTODATE.MAINBODY.WPACIS.1': date_to.strftime(DATE_FORMAT) })[1:])
+            pages.append('<a href="%s">%d</a>' % (link, i + 1))
+        return self._page(portal, """<p>Your search returned %d matches.</p>
+        <form name="results">
+        <table><tr><th>Application</th><th>Location</th></tr>
+        %s
+        </table>
+        Pages %s
+        </form>""" % (len(all_uids), rows, ' '.join(pages)), 'Search Results')
+
+    def swiftlg_detail(self, portal, params):
+        a = application(params.get('theApnID'))
+        if not a:
+            return None
+        rows = [ ('Application Ref:', a['uid']), ('Application Date:', a['date_received']), ('Registration Date:', a['date_validated']),
+            ('Main Location:', a['address']), ('Full Description:', a['description']), ('Application Type:', a['application_type']),
+            ('Ward', a['ward_name']), ('Parish:', a['parish']), ('Case Officer:', a['case_officer']) ]
+        fields = '\n'.join('<span>%s</span><p>%s</p>' % (k, escape(v)) for k, v in rows)
+        return self._page(portal, '<form action="WPHAPPDETAIL" name="detail">\n%s\n</form>' % fields, 'Application Details')
+
+    # PlanningExplorer
+
+    def pe_search(self, portal, params):
+        if 'dateStart' not in params and 'txtApplicationNumber' not in params:
+            return self._page(portal, """
+            <form name="M3Form" id="M3Form" action="GeneralSearch.aspx" method="post">
+            <input type="text" name="txtApplicationNumber" value=""/>
+            <input type="radio" name="rbGroup" value="rbNotApplicable"/>
+            <input type="radio" name="rbGroup" value="rbRange"/>
+            <input type="text" name="dateStart" value=""/>
+            <input type="text" name="dateEnd" value=""/>
+            <input type="submit" name="csbtnSearch" id="csbtnSearch" value="Search"/>
+            </form>""", 'General Search')
+        if params.get('txtApplicationNumber'):
+            uids = [ params['txtApplicationNumber'] ] if application(params['txtApplicationNumber']) else []
+            return self._pe_results(portal, uids, 1, 1, {})
+        found = self._range(params, 'dateStart', 'dateEnd')
+        if not found:
+            return self._page(portal, '<div id="pageCenter"> Sorry, the search did not find any results </div>')
+        date_from, date_to = found
+        uids, pages = self._rows(portal, portal.uids(date_from, date_to), 1)
+        return self._pe_results(portal, uids, 1, pages, { 'dateStart': params['dateStart'], 'dateEnd': params['dateEnd'] })
+
+    def pe_paged(self, portal, params):
+        found = self._range(params, 'dateStart', 'dateEnd')
+        if not found:
+            return None
+        page = int(params.get('page', 1))
+        uids, pages = self._rows(portal, portal.uids(*found), page)
+        return self._pe_results(portal, uids, page, pages, { 'dateStart': params['dateStart'], 'dateEnd': params['dateEnd'] })
+
+    def _pe_results(self, portal, uids, page, pages, search):
+        rows = '\n'.join('<tr><td><a href="%s">%s</a></td><td>%s</td></tr>' % (
+            _link('/pe/Generic/StdDetails.aspx', PT='Planning', PARAM0=uid), escape(uid), escape(application(uid)['address']))
+            for uid in uids)
+        pager = ''
+        if page < pages:
+            pager = '<a href="%s"><img src="next.gif" title="Go to next page"/></a>' % _link('/pe/Generic/StdResults.aspx',
+                page=page + 1, **search)
+        return self._page(portal, '<table class="display_table">\n<tr><th>Application</th><th>Site Address</th></tr>\n%s\n</table>\n%s' %
+            (rows, pager), 'Search Results')
+
+    def pe_detail(self, portal, params):
+        a = application(params.get('PARAM0'))
+        if not a:
+            return None
+        rows = [ ('Application Registered', a['date_validated']), ('Application Number', a['uid']), ('Site Address', a['address']),
+            ('Proposal', a['description']), ('Application Type', a['application_type']), ('Current Status', a['status']),
+            ('Applicant', a['applicant_name']), ('Agent', a['agent_name']), ('Ward', a['ward_name']), ('Officer', a['case_officer']) ]
+        items = '\n'.join('<li><span>%s</span> %s </li>' % (k, escape(v)) for k, v in rows)
+        return self._page(portal, 'Details Page <ul>\n%s\n</ul>\n<a href="%s">Application Dates</a>' % (items,
+            _link('/pe/Generic/StdDates.aspx', PT='Planning', PARAM0=a['uid'])), 'Details')
+
+    def pe_dates(self, portal, params):
+        a = application(params.get('PARAM0'))
+        if not a:
+            return None
+        rows = [ ('Received', a['date_received']), ('Validated', a['date_validated']), ('Target Date', a['target_decision_date']) ]
+        items = '\n'.join('<li><span>%s</span> %s </li>' % (k, escape(v)) for k, v in rows)
+        return self._page(portal, 'Dates Page <ul>\n%s\n</ul>' % items, 'Dates')
+
+    # Civica
+
+    def civica_search(self, portal, params):
+        if params.get('ref_no'): # one application - shown directly
+            return self._civica_detail(portal, application(params['ref_no']))
+        if 'dateFrom' in params:
+            found = self._range(params, 'dateFrom', 'dateTo')
+            if found:
+                return self._civica_results(portal, found[0], found[1], 1)
+            return self._page(portal, '<p>No matching applications</p>')
+        return self._page(portal, """
+        <form name="search" action="plansearch.page" method="post">
+        <input type="text" name="ref_no" value=""/>
+        <input type="text" name="dateFrom" value=""/>
+        <input type="text" name="dateTo" value=""/>
+        <input type="submit" name="search" value="Search"/>
+        </form>""", 'Planning Search')
+
+    def civica_next(self, portal, params):
+        found = self._range(params, 'dateFrom', 'dateTo')
+        if not found:
+            return None
+        page = int(params.get('page', 1))
+        if params.get('scroll_1') == 'next':
+            page += 1
+        return self._civica_results(portal, found[0], found[1], page)
+
+    def _civica_results(self, portal, date_from, date_to, page):
+        uids, pages = self._rows(portal, portal.uids(date_from, date_to), page)
+        pages = min(pages, portal.page_limit) # results beyond the page limit are not available
+        if page > pages:
+            uids = []
+        rows = '\n'.join('<tr><td><input type="submit" name="select" value="%s"/></td><td>%s</td></tr>' % (escape(uid),
+            escape(application(uid)['address'])) for uid in uids)
+        scroller = ' '.join('<a href="#">%d</a>' % (i + 1) for i in range(pages))
+        return self._page(portal, """<table title="List of planning applications"><thead><tr><th>Reference</th><th>Location</th></tr></thead>
+        <tbody>\n%s\n</tbody></table>
+        <table class="scroller"><tr><td>%s</td></tr></table>
+        <form name="scroll" action="results.page" method="post">
+        <input type="hidden" name="dateFrom" value="%s"/>
+        <input type="hidden" name="dateTo" value="%s"/>
+        <input type="hidden" name="page" value="%d"/>
+        </form>""" % (rows, scroller, date_from.strftime(DATE_FORMAT), date_to.strftime(DATE_FORMAT), page), 'Results')
+
+    def _civica_detail(self, portal, a):
+        if not a:
+            return self._page(portal, '<div id="content"><p>No matching applications</p></div>')
+        rows = [ ('Reference Number', a['uid']), ('Location', a['address']), ('Proposal', a['description']),
+            ('Received Date', a['date_received']), ('Valid Date', a['date_validated']), ('Application Type', a['application_type']),
+            ('Status', a['status']), ('Case Officer', a['case_officer']), ('Ward', a['ward_name']), ('Parish', a['parish']) ]
+        table = '\n'.join('<tr><td>%s</td><td>%s</td></tr>' % (k, escape(v)) for k, v in rows)
+        return self._page(portal, '<div id="content">\n<table title="Application Details">\n%s\n</table>\n</div>' % table, 'Details')
+
+    routes = {
+        '/idox/search.do': idox_search,
+        '/idox/advancedSearchResults.do': idox_results,
+        '/idox/pagedSearchResults.do': idox_results,
+        '/idox/applicationDetails.do': idox_detail,
+        '/swiftlg/wphappcriteria.display': swiftlg_search,
+        '/swiftlg/WPHAPPSEARCHRES.displayResultsURL': swiftlg_results,
+        '/swiftlg/WPHAPPDETAIL.DisplayUrl': swiftlg_detail,
+        '/pe/GeneralSearch.aspx': pe_search,
+        '/pe/Generic/StdResults.aspx': pe_paged,
+        '/pe/Generic/StdDetails.aspx': pe_detail,
+        '/pe/Generic/StdDates.aspx': pe_dates,
+        '/civica/plansearch.page': civica_search,
+        '/civica/results.page': civica_next,
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a mock planning portal server')
+    parser.add_argument("-p", "--port", help="port to listen on", type=int, default=8080)
+    parser.add_argument("-d", "--per-day", help="applications per day", type=int, default=10)
+    parser.add_argument("-l", "--latency", help="delay before each response (seconds)", type=float, default=0.0)
+    parser.add_argument("-b", "--padding", help="filler bytes added to each page", type=int, default=0)
+    args = parser.parse_args()
+
+    portal = MockPortal(per_day=args.per_day, latency=args.latency, padding=args.padding, port=args.port)
+    print 'Serving on %s (Ctrl-C to stop)' % portal.url
+    try:
+        portal._server.serve_forever()
+    except KeyboardInterrupt:
+        portal._server.server_close()
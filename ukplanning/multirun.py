@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import run
+from scrapers.base import BaseScraper
+from checkpoint import CheckpointStore
+from seen import SeenIndex
+import sinks
+import metrics
+import json
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import importlib
+import threading
+import collections
+import logging
+
+# note this module runs scraper methods for many authorities concurrently within one process
+# the scrapers are blocking (mechanize/requests) so concurrency comes from a pool of worker threads
+# each scraper instance has its own browser/session, so calls for the same authority are run in turn
+# but calls for different authorities overlap - giving many requests in flight at once
+# the calls are queued per authority and the thread pool holds at most one task for each authority, which runs
+# its next call then goes to the back of the pool queue - so the workers take the authorities round robin
+# and none are tied up waiting on one busy authority
+# results are exactly those returned by the scraper methods (e.g. gather_ids, update_application)
+
+logger = logging.getLogger(__name__)
+
+# the scraping (scrapemark), cleaning and html tidying of each page is CPU bound and holds the GIL
+# so a ParsePool can take raw pages from the I/O threads and do that work in separate processes
+# each process uses parse only scraper instances (no browser or session state is shared)
+
+_parsers = {} # parse only scraper instances in this (worker) process
+
+def _parser(class_ref):
+    parser = _parsers.get(class_ref)
+    if not parser:
+        module_name, class_name = class_ref
+        this_class = getattr(importlib.import_module(module_name), class_name)
+        parser = this_class.create_parser()
+        _parsers[class_ref] = parser
+    return parser
+
+def _extract(class_ref, html, url, configs, update_url, process):
+    """ worker function - scrapes and cleans one page, returns the same result as _get_detail()
+    'configs' are optional scrapemark configs (data_block, min_data, optional_data, invalid_format) """
+    try:
+        parser = _parser(class_ref)
+        result = parser._get_detail(html, url, *configs)
+        if 'scrape_error' not in result:
+            if update_url and url and not result.get('url'):
+                result['url'] = url
+            if process:
+                parser._process_applic(result)
+        return result
+    except Exception:
+        logger.exception("Error extracting %s page %s" % (class_ref[1], url))
+        return { 'scrape_error': BaseScraper.errors[BaseScraper.GET_ERROR] }
+
+def _class_ref(scraper):
+    ' picklable reference to a scraper class or instance '
+    this_class = scraper if isinstance(scraper, type) else type(scraper)
+    return (this_class.__module__, this_class.__name__)
+
+class ParsePool(object):
+
+    def __init__(self, processes=None):
+        """ 'processes' defaults to the number of CPUs """
+        self._pool = multiprocessing.Pool(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, scraper, html, url, data_block=None, min_data=None, optional_data=[], invalid_format=None,
+            update_url=False, process=False):
+        """ queue one page to be scraped by the scraper class (or the class of a scraper instance)
+        optional scrapemark configs default to the class ones, as in _get_detail()
+        'update_url' sets the 'url' field from the page URL, 'process' post processes the record as in fetch_application()
+        returns an AsyncResult, use get() for the cleaned record or a dict with a 'scrape_error' """
+        configs = (data_block, min_data, optional_data, invalid_format)
+        return self._pool.apply_async(_extract, (_class_ref(scraper), html, url, configs, update_url, process))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+class PendingCall(object):
+    """ a queued ScraperPool call - as an AsyncResult, get() waits for the result
+    'function' returns the result and the number of HTTP requests made, which is kept as 'requests' (None if not known) """
+
+    def __init__(self, function, args):
+        self._function = function
+        self._args = args
+        self._done = threading.Event()
+        self._value = None
+        self.requests = None
+
+    def run(self):
+        try:
+            self._value, self.requests = self._function(*self._args)
+        finally:
+            self._done.set()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise multiprocessing.TimeoutError
+        return self._value
+
+class ScraperPool(object):
+
+    def __init__(self, workers=100, checkpoints=None, seen=None, **kwargs):
+        """ 'workers' is the max number of concurrent calls (and so in flight requests)
+        'checkpoints' is an optional database path, shared by all the scrapers to make gather_ids() resumable
+        'seen' is an optional database path (or seen.SeenIndex) of uids gathered before, shared by all the scrapers
+        so gather_ids() marks or leaves out known uids (see BaseScraper.use_seen_index) - uids are added to it
+        once written by the sink of a gather_ids() call, or by mark_stored()
+        "log_level", "log_directory", "log_name" named arguments are passed to each scraper """
+        self._pool = ThreadPool(workers)
+        self._checkpoints = CheckpointStore(checkpoints) if checkpoints else None
+        self._seen_path = isinstance(seen, basestring) # the index is only closed here if it was opened here
+        self._seen = SeenIndex(seen) if self._seen_path else seen
+        self._kwargs = kwargs
+        self._scrapers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._queues = {} # authority -> deque of PendingCalls not yet run (present while it has a task in the pool)
+        self._idle = threading.Condition(self._lock) # notified when there are no queues left
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _scraper(self, scraper_name):
+        ' get the (one) scraper instance for this authority and the lock which serialises calls to it '
+        with self._lock:
+            if scraper_name not in self._scrapers:
+                scraper = run.get_scraper(scraper_name, **self._kwargs)
+                if not scraper:
+                    raise RuntimeError('instance of %s scraper already running' % scraper_name)
+                if self._checkpoints:
+                    scraper.use_checkpoints(self._checkpoints)
+                if self._seen is not None:
+                    scraper.use_seen_index(self._seen)
+                self._scrapers[scraper_name] = scraper
+                self._locks[scraper_name] = threading.Lock()
+            return self._scrapers[scraper_name], self._locks[scraper_name]
+
+    def _call(self, scraper_name, function_name, args, kwargs):
+        try:
+            scraper, lock = self._scraper(scraper_name)
+            with lock:
+                requests = scraper.metrics.requests
+                result = getattr(scraper, function_name)(*args, **kwargs)
+                return result, scraper.metrics.requests - requests
+        except Exception: # result contract is always a dict, so errors are returned not raised
+            logger.exception("Error running %s %s" % (scraper_name, function_name))
+            return { 'scrape_error': BaseScraper.errors[BaseScraper.GET_ERROR] }, None
+
+    def _queue(self, scraper_name, function, args):
+        ' queue a call for one authority - a pool task is added if the authority does not have one already '
+        call = PendingCall(function, args)
+        with self._lock:
+            queue = self._queues.get(scraper_name)
+            new = queue is None
+            if new:
+                queue = self._queues[scraper_name] = collections.deque()
+            queue.append(call)
+        if new:
+            self._pool.apply_async(self._next_call, (scraper_name,))
+        return call
+
+    def _next_call(self, scraper_name):
+        ' pool task - runs the next queued call for one authority, then if it has more goes to the back of the pool queue '
+        with self._lock:
+            call = self._queues[scraper_name].popleft()
+        try:
+            call.run()
+        finally:
+            with self._lock:
+                more = bool(self._queues[scraper_name])
+                if not more:
+                    del self._queues[scraper_name]
+                    if not self._queues:
+                        self._idle.notify_all()
+            if more:
+                self._pool.apply_async(self._next_call, (scraper_name,))
+
+    def submit(self, scraper_name, function_name, *args, **kwargs):
+        """ queue a call to a scraper method - returns a PendingCall (as an AsyncResult), use get() for the method result
+        once it is ready, its 'requests' attribute is the number of HTTP requests the call made """
+        return self._queue(scraper_name, self._call, (scraper_name, function_name, args, kwargs))
+
+    def map(self, calls, sink=None):
+        """ run a list of (scraper_name, function_name, args) calls concurrently
+        returns a list of results in the same order, each is also written to the 'sink' (see sinks.py) if supplied """
+        pending = [ self.submit(c[0], c[1], *(c[2] if len(c) > 2 else ())) for c in calls ]
+        return self._collect(pending, sink)
+
+    def _collect(self, pending, sink, costs=None):
+        results = []
+        for p in pending:
+            result = p.get()
+            if sink:
+                sink.write_result(result)
+            results.append(result)
+            if costs is not None:
+                costs.append(p.requests)
+        return results
+
+    def gather_ids(self, scraper_names, sequence_from=None, sequence_to=None, sink=None):
+        """ gather_ids for many authorities at once - returns a dict of results keyed on authority name
+        with a seen index, the uids written by the 'sink' are added to it (otherwise see mark_stored) """
+        if sink and self._seen is not None and self.mark_stored not in sink.observers:
+            sink.observers.append(self.mark_stored)
+        calls = [ (name, 'gather_ids', (sequence_from, sequence_to)) for name in scraper_names ]
+        return dict(zip(scraper_names, self.map(calls, sink)))
+
+    def mark_stored(self, records):
+        """ adds the uids of stored records (each with 'authority' and 'uid' fields) to the seen index
+        so later gather_ids() calls treat them as known """
+        seen_index = self._seen
+        if seen_index is None:
+            return
+        uids = {}
+        for r in records:
+            if r.get('authority') and r.get('uid'):
+                uids.setdefault(r['authority'], []).append(r['uid'])
+        for authority, these_uids in uids.items():
+            seen_index.add(authority, these_uids)
+
+    def update_applications(self, applics, sink=None, listing_only=False, diff=False, costs=None):
+        """ update_application for a list of applications (each with 'authority' and 'uid' fields)
+        each application is updated in place and a list of results is returned in the same order
+        if 'listing_only' is set, applications which already have their scraper's _listing_fields are not fetched
+        if 'diff' is set, each result has the field level 'changes' and a 'changed' flag (and unchanged ones are not written to the sink)
+        if 'costs' is a list, the number of HTTP requests made for each application is appended to it (None if not known) """
+        pending = [ self.submit(a.get('authority'), 'update_application', a, listing_only, diff) for a in applics ]
+        return self._collect(pending, sink, costs)
+
+    def _fetch_application(self, applic, parse_pool, listing_only, diff):
+        """ update_application, but with each detail page handed to the parse pool
+        (only for scrapers which get all details from one page - others are scraped in this thread)
+        the fetching, fall backs and post processing are all as update_application """
+        try:
+            scraper, lock = self._scraper(applic.get('authority'))
+        except Exception:
+            logger.exception("Error getting scraper for %s" % applic.get('authority'))
+            return { 'scrape_error': BaseScraper.errors[BaseScraper.GET_ERROR] }, None
+        with lock:
+            if type(scraper)._get_details.__func__ is BaseScraper._get_details.__func__:
+                scraper._detail_parser = lambda html, url: parse_pool.submit(scraper, html, url).get()
+            requests = scraper.metrics.requests
+            try:
+                result = scraper.update_application(applic, listing_only, diff)
+                return result, scraper.metrics.requests - requests
+            except Exception:
+                logger.exception("Error running %s update_application" % applic.get('authority'))
+                return { 'scrape_error': BaseScraper.errors[BaseScraper.GET_ERROR] }, None
+            finally:
+                scraper._detail_parser = None
+
+    def fetch_applications(self, applics, parse_pool, sink=None, listing_only=False, diff=False, costs=None):
+        """ as update_applications, but the CPU bound scraping of each page is done by a ParsePool
+        so the worker threads here are free to keep fetching pages """
+        pending = [ self._queue(a.get('authority'), self._fetch_application, (a, parse_pool, listing_only, diff)) for a in applics ]
+        return self._collect(pending, sink, costs)
+
+    def export_metrics(self, format='prometheus'):
+        ' combined metrics of all the scrapers used so far (see metrics.py) as Prometheus text or JSON '
+        with self._lock:
+            scrapers = self._scrapers.values()
+        if format == 'json':
+            return json.dumps([ s.metrics.snapshot() for s in scrapers ])
+        return metrics.to_prometheus([ s.metrics for s in scrapers ])
+
+    def close(self):
+        with self._lock:
+            while self._queues: # queued calls still to run
+                self._idle.wait()
+        self._pool.close()
+        self._pool.join()
+        with self._lock:
+            for scraper in self._scrapers.values():
+                scraper.destroy()
+            self._scrapers = {}
+            self._locks = {}
+        if self._checkpoints:
+            self._checkpoints.close()
+            self._checkpoints = None
+        if self._seen is not None:
+            if self._seen_path:
+                self._seen.close()
+            else:
+                self._seen.flush()
+            self._seen = None
+
+if __name__ == "__main__":
+    import argparse
+
+    log_choices = [ c for c in logging._levelNames.keys() if not isinstance(c, int) ]
+
+    parser = argparse.ArgumentParser(description='Gather ids from many planning scrapers concurrently')
+    parser.add_argument("scrapers", help="names of the scrapers", nargs='+')
+    parser.add_argument("-w", "--workers", help="number of concurrent workers", type=int, default=100)
+    parser.add_argument("-l", "--level", help="log level", default='INFO', choices=log_choices)
+    parser.add_argument("-g", "--logdir", help="log directory")
+    parser.add_argument("-o", "--output", help="output file for the gathered ids (.jsonl, .jsonl.gz, .csv or .db)")
+    parser.add_argument("-c", "--checkpoints", help="checkpoint database file - resumes any interrupted gathers")
+    parser.add_argument("-p", "--postcodes", help="postcode index file for locating applications (see geo/postcodes.py)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(name)s-%(levelname)s[%(asctime)s]: %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
+
+    if args.postcodes:
+        BaseScraper.postcode_index = run.geo.PostcodeIndex(args.postcodes)
+    with ScraperPool(args.workers, args.checkpoints, log_level=args.level, log_directory=args.logdir) as pool:
+        if args.output:
+            with sinks.open_sink(args.output) as sink:
+                results = pool.gather_ids(args.scrapers, sink=sink)
+            for name, result in results.items():
+                print name, result.get('scrape_error') or '%d ids from %s to %s' % (len(result['result']), result['from'], result['to'])
+        else:
+            results = pool.gather_ids(args.scrapers)
+            print json.dumps(results, default=str, indent=4)
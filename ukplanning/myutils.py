@@ -18,11 +18,15 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 import re
 from datetime import datetime, date
+from collections import OrderedDict
+import threading
 import urllib, urllib2, urlparse
 import logging, logging.handlers
 import dateutil.parser
 import os
 import json
+import Queue
+import atexit
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +57,120 @@ def get_dt(supplied_date, date_format=None):
     except (ValueError, TypeError):
         return None
         
+class LRUCache(object):
+    """ bounded dict like cache which discards the least recently used entries, with hit/miss counts """
+    
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self._data)
+        
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value # re-insert as most recently used
+            self.hits += 1
+            return value
+            
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            
+    def stats(self):
+        return { 'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses }
+        
+_NO_DATE = object() # cached marker for a string which is not a date
+
+class DateParser(object):
+    """ memoised version of get_dt() for parsing many scraped date strings - results are always the same as get_dt()
+    strings are cached, and the concrete formats which agree with successful (but slow) dateutil parses
+    are learned and tried first, the most successful first """
+    
+    # candidate formats to learn - all have 4 digit years or month names so cannot be read ambiguously
+    formats = [ '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%Y/%m/%d', 
+        '%d %b %Y', '%d %B %Y', '%d-%b-%Y', '%a %d %b %Y', '%A %d %B %Y', '%b %d, %Y', '%B %d, %Y',
+        '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S' ]
+    max_learned = 3 # number of learned formats tried before dateutil
+    
+    def __init__(self, cache_size=10000):
+        self.cache = LRUCache(cache_size)
+        self.format_hits = {} # successful parses using each learned format
+        self.learned = {} # dateutil parses agreeing with each candidate format
+        self.dateutil_parses = 0
+        self.failures = 0
+        self._order = []
+        
+    def get_dt(self, supplied_date, date_format=None):
+        ' as get_dt() - returns None if the string cannot be parsed '
+        if not supplied_date or not isinstance(supplied_date, basestring):
+            return get_dt(supplied_date, date_format)
+        key = (supplied_date, date_format)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._parse(supplied_date, date_format)
+            self.cache.put(key, _NO_DATE if result is None else result)
+        elif result is _NO_DATE:
+            result = None
+        return result
+        
+    def _parse(self, supplied_date, date_format):
+        if date_format:
+            try:
+                return datetime.strptime(supplied_date, date_format).date()
+            except (ValueError, TypeError):
+                pass
+        norm_dt = GAPS_REGEX.sub(' ', supplied_date)
+        if not norm_dt or norm_dt == ' ' or norm_dt == "''":
+            return None
+        for fmt in self._order:
+            try:
+                result = datetime.strptime(norm_dt, fmt).date()
+            except ValueError:
+                continue
+            self.format_hits[fmt] = self.format_hits.get(fmt, 0) + 1
+            return result
+        try:
+            result = dateutil.parser.parse(norm_dt, dayfirst=True, yearfirst=True).date()
+        except (ValueError, TypeError):
+            self.failures += 1
+            return None
+        self.dateutil_parses += 1
+        self._learn(norm_dt, result)
+        return result
+        
+    def _learn(self, norm_dt, result):
+        ' record which candidate formats give the same result as dateutil '
+        for fmt in self.formats:
+            try:
+                if datetime.strptime(norm_dt, fmt).date() == result:
+                    self.learned[fmt] = self.learned.get(fmt, 0) + 1
+            except ValueError:
+                pass
+        ranked = sorted(self.learned.items(), key=lambda x: x[1], reverse=True)
+        self._order = [ fmt for fmt, count in ranked[:self.max_learned] ]
+        
+    def stats(self):
+        return { 'cache': self.cache.stats(), 'format_hits': dict(self.format_hits), 'learned': dict(self.learned),
+            'dateutil_parses': self.dateutil_parses, 'failures': self.failures }
+        
 def get_dttm(supplied_datetime, datetime_format=None):
     ' get a datetime using the format, if supplied - returns None if the string cannot be parsed '
     if not supplied_datetime:
@@ -140,6 +258,133 @@ def frotate_handler(log_path, maxBytes=1000000, backupCount=2):
 def file_handler(log_path):
     return logging.FileHandler(log_path, mode='w')
     
+# non-blocking logging - see BaseScraper.shared_log
+# the loggers of all scrapers put their records on one queue, and one writer thread per log file formats them as
+# JSON lines and writes them out, so a scraper never waits on disk I/O and there is one log file instead of one per authority
+# calls should pass any args separately - logger.debug("%d ids", n) - so nothing is formatted for disabled levels
+# if the queue is full (the disk cannot keep up) new records are dropped and counted, rather than blocking the scrapers
+
+_log_writers = {} # path -> LogWriter
+_log_writers_lock = threading.Lock()
+
+class JSONFormatter(logging.Formatter):
+    """ formats each record as one line of JSON with 'time', 'level', 'logger' and 'message' keys,
+    plus 'exception' if there is one and any 'extra' fields passed to the logging call """
+
+    _standard = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__.keys()) | set([ 'message', 'asctime' ])
+
+    def format(self, record):
+        data = { 'time': datetime.fromtimestamp(record.created).isoformat(), 'level': record.levelname,
+            'logger': record.name, 'message': record.getMessage() }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        for k, v in record.__dict__.items():
+            if k not in self._standard:
+                data[k] = v
+        return json.dumps(data, default=unicode)
+
+class QueueHandler(logging.Handler):
+    """ passes records to a LogWriter without waiting - the message and any exception traceback are formatted here,
+    as the args may change (and the traceback frames go) once the logging call returns """
+
+    def __init__(self, writer):
+        logging.Handler.__init__(self)
+        self.writer = writer
+        self.formatter = logging.Formatter()
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = self.formatter.formatException(record.exc_info)
+                record.exc_info = None
+            self.writer.put(record)
+        except Exception:
+            self.handleError(record)
+
+class LogWriter(object):
+    """ background thread which writes queued records to a handler (by default a rotating JSON lines file)
+    in batches of whatever is waiting - 'maxsize' is the number of records that can wait before new ones are dropped """
+
+    def __init__(self, handler, maxsize=100000):
+        self.handler = handler
+        self._flush = getattr(handler, 'flush_batch', handler.flush) # once per batch of records
+        self.dropped = 0 # records lost because the queue was full
+        self._queue = Queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='LogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [ self._queue.get() ]
+            try:
+                while len(batch) < 1000:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            for record in batch:
+                if record is None:
+                    self._flush()
+                    return
+                try:
+                    self.handler.handle(record)
+                except Exception:
+                    self.handler.handleError(record)
+            self._flush()
+
+    def close(self, timeout=10):
+        ' writes out any waiting records and stops the thread '
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self.handler.close()
+
+class BatchRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    ' rotating file handler which is only flushed after each batch of records from a LogWriter, not after every record '
+
+    def shouldRollover(self, record):
+        ' rolls over once the file has reached maxBytes - the base class formats every record twice to decide '
+        if self.stream is None:
+            self.stream = self._open()
+        return self.maxBytes > 0 and self.stream.tell() >= self.maxBytes
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        logging.handlers.RotatingFileHandler.flush(self)
+
+def log_writer(path, maxBytes=10000000, backupCount=5):
+    ' the shared LogWriter for a JSON lines log file, started if necessary '
+    path = os.path.abspath(path)
+    with _log_writers_lock:
+        writer = _log_writers.get(path)
+        if writer is None:
+            handler = BatchRotatingFileHandler(path, mode='a', maxBytes=maxBytes, backupCount=backupCount)
+            handler.setFormatter(JSONFormatter())
+            writer = _log_writers[path] = LogWriter(handler)
+    return writer
+
+def setup_queue_logger(log_name, path, level = None):
+    ' set up a logger which writes JSON records to the shared log file at path, through its LogWriter thread '
+    logger = logging.getLogger(log_name)
+    logger.setLevel(level or logging.INFO)
+    for h in list(logger.handlers): # loggers are global, so this one might have been set up before
+        logger.removeHandler(h)
+    logger.addHandler(QueueHandler(log_writer(path)))
+    return logger
+    
 def extract_postcode(text):
     if not text: return None
     postcode_match = EXTRACT_FULL_REGEX.search(text)
@@ -147,6 +392,21 @@ def extract_postcode(text):
         return postcode_match.group(1).upper() + ' ' + postcode_match.group(2).upper()
     return None
     
+def diff_records(old, new, ignore=()):
+    # field level differences between an existing record and a freshly scraped one
+    # 'added' and 'changed' fields are those the new record would add or alter when merged into the old one (see update_application)
+    # 'removed' fields are in the old record but no longer returned (note merging preserves them)
+    added = {}; changed = {}
+    for k, v in new.iteritems():
+        if k in ignore:
+            continue
+        if k not in old:
+            added[k] = v
+        elif old[k] != v:
+            changed[k] = [ old[k], v ]
+    removed = sorted(k for k in old if k not in new and k not in ignore)
+    return { 'added': added, 'removed': removed, 'changed': changed }
+    
 def dict_lookup(dic, key, *keys):
     # lookup a value in a dict
     # the key/keys parameter is either a single key which means a direct lookup at current level
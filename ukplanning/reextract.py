@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import run
+from scrapers import base
+import archive
+import sinks
+import multiprocessing
+import requests
+import mechanize
+import logging
+
+# offline re-extraction of application records from an archive of raw pages (see archive.py and BaseScraper.use_archive())
+# for each archived application, the latest fetch is parsed again by the current scraper class (_get_details,
+# _get_detail, _clean_record, _process_applic) - so after a scrapemark pattern is fixed, every affected record
+# can be rebuilt without fetching anything
+# pages are archived as fetched, so any scraper fix to a page before it is parsed belongs in _adjust_html (not _get_html)
+# the work is spread over a pool of processes, one chunk of uids for one authority per task
+# any linked pages (eg Idox dates and info pages) are replayed from the same fetch by URL - a page which was not
+# archived fails as if the site were down, so there is never any network access
+
+logger = logging.getLogger(__name__)
+
+class ArchiveCassette(base.cassette.Cassette):
+    """ replay only cassette holding the pages of one archived fetch - requests are matched on URL alone
+    (whatever the method or form data), repeats of the same URL are served in the order they were fetched """
+
+    def __init__(self):
+        super(ArchiveCassette, self).__init__(None, base.cassette.REPLAY)
+
+    def key(self, method, url, body):
+        return url
+
+    def add_page(self, url, body):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.record('GET', url, None, 200, 'OK', [ ('Content-Type', 'text/html; charset=utf-8') ], body)
+
+def latest_fetch(pages):
+    """ the pages of the most recent fetch of an application, from the archive.pages() list for its uid
+    - the last 'detail' page followed by any 'linked' pages - or an empty list """
+    starts = [ i for i, p in enumerate(pages) if p['kind'] == 'detail' ]
+    if not starts:
+        return []
+    return [ pages[starts[-1]] ] + [ p for p in pages[starts[-1] + 1:] if p['kind'] == 'linked' ]
+
+_archives = {} # directory -> read only PageArchive in this (worker) process
+_parsers = {} # scraper name -> offline scraper instance in this (worker) process
+
+def offline_parser(this_class):
+    """ a parse only instance of a scraper class (see BaseScraper.create_parser) with a browser and session
+    which can only replay archived pages (see extract_application) """
+    parser = this_class.create_parser()
+    parser.br, parser.cj = base.scrapeutils.get_browser(this_class._headers, None, None, parser._timeout) # note no _handler - archived pages are already massaged
+    parser.br.track_hosts = False
+    parser.rs = requests.Session() # only used by the requests based scrapers (see basereq.py)
+    parser.rs.cookies = parser.cj
+    if this_class._headers:
+        parser.rs.headers.update(this_class._headers)
+    return parser
+
+def _parser(scraper_name):
+    parser = _parsers.get(scraper_name)
+    if not parser:
+        this_class = run.get_scraper_class(scraper_name)
+        if not this_class:
+            raise AttributeError('cannot find class for: %s' % scraper_name)
+        parser = _parsers[scraper_name] = offline_parser(this_class)
+    return parser
+
+def _archive(directory):
+    store = _archives.get(directory)
+    if not store:
+        store = _archives[directory] = archive.PageArchive(directory, readonly=True)
+    return store
+
+def extract_application(parser, store, authority, uid):
+    """ parses the latest archived fetch of one application with an offline_parser() instance
+    result is a dict with a non-empty 'record' if successful otherwise with a 'scrape_error' """
+    pages = latest_fetch(store.pages(authority, uid))
+    if not pages:
+        return { 'scrape_error': 'No archived detail page' }
+    replay = ArchiveCassette()
+    for page in pages[1:]:
+        replay.add_page(page['url'], store.get(page['hash']))
+    parser.use_cassette(replay)
+    html = store.get(pages[0]['hash'], pages[0]['text'])
+    page = html.encode('utf-8') if pages[0]['text'] else html
+    parser.br.set_response(mechanize.make_response(page, [ ('Content-Type', 'text/html; charset=utf-8') ], pages[0]['url'], 200, 'OK')) # so relative links resolve as they did
+    result = parser._get_full_details(html, pages[0]['url'], not parser._uid_only)
+    if not result:
+        return { 'scrape_error': parser.errors[parser.EMPTY] }
+    elif 'scrape_error' in result:
+        return { 'scrape_error': result['scrape_error'] }
+    parser._process_applic(result)
+    result['date_scraped'] = pages[0]['fetched_at'] # the record is as of the fetch, not now
+    if not result.get('uid'):
+        result['uid'] = uid
+    return { 'record': result }
+
+def _extract_chunk(directory, scraper_name, uids):
+    """ worker function - re-extracts a list of uids for one authority
+    returns (scraper name, list of records, dict of uid -> scrape error) """
+    records = []; errors = {}
+    try:
+        parser = _parser(scraper_name)
+        store = _archive(directory)
+    except Exception:
+        logger.exception("Error opening %s for re-extraction" % scraper_name)
+        return scraper_name, records, dict((uid, base.BaseScraper.errors[base.BaseScraper.GET_ERROR]) for uid in uids)
+    for uid in uids:
+        try:
+            result = extract_application(parser, store, scraper_name, uid)
+        except Exception:
+            logger.exception("Error re-extracting %s %s" % (scraper_name, uid))
+            result = { 'scrape_error': base.BaseScraper.errors[base.BaseScraper.GET_ERROR] }
+        if 'scrape_error' in result:
+            errors[uid] = result['scrape_error']
+        else:
+            records.append(result['record'])
+    return scraper_name, records, errors
+
+def reextract(directory, scraper_names=None, uids=None, sink=None, processes=None, chunk_size=50):
+    """ re-extracts archived applications for the named scrapers (default all authorities in the archive)
+    using a pool of 'processes' (default the number of CPUs) - 'uids' limits it to those applications
+    records are written to 'sink' (see sinks.py) as each chunk completes
+    returns a dict of authority -> { 'records': number extracted, 'errors': dict of uid -> scrape error } """
+    store = archive.PageArchive(directory, readonly=True)
+    try:
+        tasks = []
+        for name in scraper_names or store.authorities():
+            names = store.uids(name)
+            if uids:
+                wanted = set(uids)
+                names = [ u for u in names if u in wanted ]
+            for i in range(0, len(names), chunk_size):
+                tasks.append((directory, name, names[i:i+chunk_size]))
+    finally:
+        store.close()
+    summary = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = [ pool.apply_async(_extract_chunk, task) for task in tasks ]
+        for result in pending:
+            name, records, errors = result.get()
+            counts = summary.setdefault(name, { 'records': 0, 'errors': {} })
+            counts['records'] += len(records)
+            counts['errors'].update(errors)
+            if sink is not None:
+                sink.write_many(records)
+            for uid, error in errors.items():
+                logger.warning("Error re-extracting %s %s: %s" % (name, uid, error))
+    finally:
+        pool.close()
+        pool.join()
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Re-extract application records from archived pages')
+    parser.add_argument("archive", help="directory of the page archive")
+    parser.add_argument("output", help="output file for the records (.jsonl, .jsonl.gz, .csv or .db/.sqlite)")
+    parser.add_argument("-s", "--scraper", help="name of a scraper or comma separated scrapers (default all in the archive)")
+    parser.add_argument("-u", "--uids", help="only these application uids", nargs="+")
+    parser.add_argument("-p", "--processes", help="number of processes (default the number of CPUs)", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(name)s-%(levelname)s[%(asctime)s]: %(message)s', 
+        datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
+    names = args.scraper.split(',') if args.scraper else None
+    start = time.time()
+    with sinks.open_sink(args.output) as sink:
+        summary = reextract(args.archive, names, args.uids, sink, args.processes)
+    for name in sorted(summary.keys()):
+        print '%-24s %6d records %6d errors' % (name, summary[name]['records'], len(summary[name]['errors']))
+    print 'Total %d records in %.1f s' % (sum(c['records'] for c in summary.values()), time.time() - start)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from datetime import date, datetime
+import threading
+import sqlite3
+import math
+
+# plans which stored applications to refresh with update_application(), within a fixed request budget
+# each record is scored by its chance of having changed since it was last checked, per request spent:
+# - decided applications change rarely, pending ones often - and most around their target decision and consultation end dates
+# - the observed change history of each record (and its authority) refines the status based rate
+# - the chance of a change grows with the time since the record was last checked (or scraped)
+# the records with the best scores are planned first, until the budget (in HTTP requests) is used up
+
+DECIDED_RATE = 0.005 # expected changes per day for a decided application
+PENDING_RATE = 0.05 # expected changes per day for a pending application
+APPEAL_RATE = 0.05 # expected changes per day for a decided application with an appeal pending
+DUE_FACTOR = 4.0 # multiplier for the rate when close to a target decision or consultation end date
+OVERDUE_FACTOR = 2.0 # multiplier for the rate for a pending application past its target decision date
+DUE_DAYS = 7 # days either side of a key date when an application is 'due'
+HISTORY_WEIGHT = 4.0 # number of checks worth of weight given to the status based rate against the observed history
+
+def _to_date(value):
+    ' date from a cleaned ISO date or datetime string (or date object) - None if there is none '
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def record_key(record):
+    return (record.get('authority'), record.get('uid'))
+
+class RefreshPlanner(object):
+
+    def __init__(self, path=':memory:', budget=1000, default_cost=3.0):
+        """ 'path' is an SQLite database file holding the refresh history of each record (one can be shared by many threads)
+        'budget' is the default number of HTTP requests to spend in each plan
+        'default_cost' is the assumed number of requests for one update_application() until the authority's cost is known """
+        self.budget = budget
+        self.default_cost = default_cost
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS history (authority TEXT, uid TEXT, checks INTEGER, changes INTEGER,
+                last_checked TEXT, last_changed TEXT, PRIMARY KEY (authority, uid))""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS costs (authority TEXT PRIMARY KEY, updates INTEGER, requests INTEGER)""")
+
+    def history(self, record):
+        """ returns a dict with the 'checks', 'changes', 'last_checked' and 'last_changed' history of a record
+        or None if it has never been checked """
+        with self._lock:
+            row = self._db.execute("SELECT checks, changes, last_checked, last_changed FROM history WHERE authority=? AND uid=?",
+                record_key(record)).fetchone()
+        return self._history(row)
+
+    def _history(self, row):
+        if not row:
+            return None
+        return { 'checks': row[0], 'changes': row[1], 'last_checked': _to_date(row[2]), 'last_changed': _to_date(row[3]) }
+
+    def cost(self, authority):
+        ' mean number of HTTP requests for one update_application() for this authority '
+        with self._lock:
+            row = self._db.execute("SELECT updates, requests FROM costs WHERE authority=?", (authority,)).fetchone()
+        return self._cost(row)
+
+    def _cost(self, row):
+        if not row or not row[0]:
+            return self.default_cost
+        return max(1.0, row[1] / float(row[0]))
+
+    def base_rate(self, record, today=None):
+        ' expected number of changes per day based on the status and key dates of a record '
+        today = today or date.today()
+        decided = record.get('decision') or record.get('decision_date')
+        if decided:
+            if record.get('appeal_date') and not (record.get('appeal_result') or record.get('appeal_decision_date')):
+                return APPEAL_RATE
+            decision_date = _to_date(record.get('decision_date'))
+            if decision_date and abs((today - decision_date).days) <= DUE_DAYS: # decision notice, status etc still settling
+                return PENDING_RATE
+            return DECIDED_RATE
+        rate = PENDING_RATE
+        for field in ('target_decision_date', 'consultation_end_date', 'meeting_date'):
+            key_date = _to_date(record.get(field))
+            if key_date and abs((today - key_date).days) <= DUE_DAYS:
+                return rate * DUE_FACTOR
+        target = _to_date(record.get('target_decision_date'))
+        if target and target < today:
+            rate *= OVERDUE_FACTOR
+        return rate
+
+    def score(self, record, today=None, history=None, cost=None):
+        """ chance the record has changed since it was last checked, per HTTP request needed to refresh it
+        'history' and 'cost' are the history() of the record and cost() of its authority, if already known """
+        today = today or date.today()
+        if history is None:
+            history = self.history(record)
+        if cost is None:
+            cost = self.cost(record.get('authority'))
+        rate = self.base_rate(record, today)
+        last_checked = _to_date(record.get('date_scraped'))
+        if history:
+            if history['last_checked'] and (not last_checked or history['last_checked'] > last_checked):
+                last_checked = history['last_checked']
+            first = _to_date(record.get('start_date')) or _to_date(record.get('date_scraped'))
+            if first and history['last_checked'] and history['last_checked'] > first:
+                observed = history['changes'] / float((history['last_checked'] - first).days)
+                rate = ((rate * HISTORY_WEIGHT) + (observed * history['checks'])) / (HISTORY_WEIGHT + history['checks'])
+        elapsed = (today - last_checked).days if last_checked else 365
+        chance = 1.0 - math.exp(-rate * max(0, elapsed))
+        return chance / cost
+
+    def plan(self, records, budget=None, today=None):
+        """ the records to refresh now, most likely changed first, within the 'budget' of HTTP requests
+        returns a list of (score, record) tuples """
+        budget = self.budget if budget is None else budget
+        today = today or date.today()
+        with self._lock: # all the history and costs in one go, rather than a query for each record
+            histories = dict(((r[0], r[1]), r[2:]) for r in self._db.execute("SELECT * FROM history"))
+            costs = dict((r[0], r[1:]) for r in self._db.execute("SELECT * FROM costs"))
+        scored = []
+        for r in records:
+            if r.get('uid'):
+                cost = self._cost(costs.get(r.get('authority')))
+                score = self.score(r, today, self._history(histories.get(record_key(r))) or {}, cost)
+                scored.append((score, cost, r))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        planned = []
+        spent = 0.0
+        for score, cost, record in scored:
+            if score <= 0.0:
+                break
+            if spent + cost > budget:
+                continue # a cheaper record may still fit
+            planned.append((score, record))
+            spent += cost
+        return planned
+
+    def record_result(self, record, changed, requests=None, today=None):
+        """ record the outcome of refreshing one record - 'changed' is True if any field changed
+        'requests' is the number of HTTP requests used, if known, to learn the cost for the authority """
+        today = (today or date.today()).isoformat()
+        authority, uid = record_key(record)
+        with self._lock:
+            with self._db:
+                row = self._db.execute("SELECT checks, changes, last_changed FROM history WHERE authority=? AND uid=?",
+                    (authority, uid)).fetchone()
+                checks, changes, last_changed = row if row else (0, 0, None)
+                if changed:
+                    changes += 1
+                    last_changed = today
+                self._db.execute("INSERT OR REPLACE INTO history VALUES (?,?,?,?,?,?)",
+                    (authority, uid, checks + 1, changes, today, last_changed))
+                if requests:
+                    self._db.execute("INSERT OR IGNORE INTO costs VALUES (?,0,0)", (authority,))
+                    self._db.execute("UPDATE costs SET updates=updates+1, requests=requests+? WHERE authority=?",
+                        (requests, authority))
+
+    def refresh(self, pool, records, budget=None, sink=None, today=None):
+        """ plan and run one round of refreshes using a multirun.ScraperPool - returns the update_application() results
+        records are updated in place, and the outcome of each is recorded in the history """
+        planned = [ r for s, r in self.plan(records, budget, today) ]
+        costs = []
+        results = pool.update_applications(planned, sink, diff=True, costs=costs)
+        for record, result, requests in zip(planned, results, costs):
+            if result and 'scrape_error' not in result:
+                self.record_result(record, result['changed'], requests, today=today)
+        return results
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -22,6 +22,10 @@ import types
 import importlib
 import logging
 import pkgutil
+try:
+    from ukplanning import geo
+except ImportError:
+    import geo
 
 # note this module finds named scraper classes based on their internal '_authority_name' attribute
 
@@ -214,6 +218,9 @@ if __name__ == "__main__":
     parser.add_argument("scraper", help="name of the scraper")
     parser.add_argument("-l", "--level", help="log level", default='INFO', choices=log_choices)
     parser.add_argument("-g", "--logdir", help="log directory")
+    parser.add_argument("-p", "--postcodes", help="postcode index file for locating applications (see geo/postcodes.py)")
+    parser.add_argument("-a", "--archive", help="directory of an archive which keeps the raw pages fetched (see archive.py)")
+    parser.add_argument("-j", "--jsonlog", help="log JSON records to this one file through a background thread, instead of one log file per scraper")
     parser.add_argument("action", help="action for the scraper", nargs=argparse.REMAINDER, choices=actions)
     args = parser.parse_args()
     # note the optional parameters all refer to the scrapers which each have their own store / log files at default INFO level
@@ -227,6 +234,12 @@ if __name__ == "__main__":
 	    for h in handlers:
 	        h.setLevel(logging.WARNING)
 	
+	    if args.postcodes:
+	        BaseScraper.postcode_index = geo.PostcodeIndex(args.postcodes)
+	    if args.archive:
+	        BaseScraper.archive_directory = args.archive
+	    if args.jsonlog:
+	        BaseScraper.shared_log = args.jsonlog
 	    kwargs = { 'log_level': args.level, 'log_directory': args.logdir  }
 	    aargs = args.action[1:]
 	    print run_scraper(args.scraper, args.action[0], *aargs, **kwargs)
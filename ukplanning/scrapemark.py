@@ -10,10 +10,20 @@ import urlparse
 import cgi
 import cookielib
 from htmlentitydefs import name2codepoint
+import threading
+import time
 
 verbose = False
 user_agent = 'Mozilla/5.0 (Windows; U; Windows NT 6.0; en-US; rv:1.8.1.3) Gecko/20070309 Firefox/2.0.0.3'
 
+# local additions - compiled patterns are cached, and optional per pattern profiling
+profiling = False # if True records match time, bytes scanned and hit/miss counts for each pattern - see profile_report()
+max_compiled = 5000 # max patterns held in the compile cache
+_compiled = {} # pattern string -> compiled pattern
+_tags = {} # pattern string -> (group, name) to identify patterns in profiles eg ('Idox', 'IdoxScraper._scrape_min_data')
+_profile = {} # pattern string -> [ calls, hits, seconds, bytes ]
+_profile_lock = threading.Lock()
+
 # todo: throw invalid arguments error if neither html nor url ar given
 
 # todo: better support for comment stuff (js in javascript)?
@@ -35,7 +45,7 @@ def scrape(pattern, html=None, url=None, get=None, post=None, headers=None, cook
     instead. Also, if *cookie_jar* is not specified, an empty :class:`cookielib.CookieJar`
     is instantiated and used in the http transaction.
     """
-    if type(pattern) == str:
+    if isinstance(pattern, basestring):
         pattern = compile(pattern)
     return pattern.scrape(html, url, get, post, headers, cookie_jar)
     
@@ -44,8 +54,61 @@ def compile(pattern):
     Compiles a pattern into a :class:`ScrapeMarkPattern` object.
     Using this object is optimal if you want to apply a single pattern multiple
     times.
+    Note compiled patterns are cached (see max_compiled), so repeat compiles are cheap.
+    """
+    compiled = _compiled.get(pattern)
+    if compiled is None:
+        compiled = _Pattern(_compile(pattern, True), pattern)
+        if len(_compiled) >= max_compiled:
+            _compiled.clear()
+        _compiled[pattern] = compiled
+    return compiled
+    
+def tag_pattern(pattern, group, name):
+    """
+    Labels a pattern string for profiling - *group* is eg a scraper type and *name* where
+    the pattern comes from. The first label for a pattern is kept.
+    """
+    if isinstance(pattern, basestring) and pattern not in _tags:
+        _tags[pattern] = (group, name)
+        
+def profile_stats():
+    """
+    Returns a list of dicts with the profile of each pattern used while *profiling* was on
+    (group, name, calls, hits, misses, seconds, bytes), slowest first.
     """
-    return _Pattern(_compile(pattern, True))
+    with _profile_lock:
+        items = [ (p, list(v)) for p, v in _profile.items() ]
+    stats = []
+    for pattern, (calls, hits, seconds, nbytes) in items:
+        group, name = _tags.get(pattern, (None, None))
+        stats.append({ 'group': group or 'untagged', 'name': name or _snippet(pattern), 'calls': calls, 'hits': hits,
+            'misses': calls - hits, 'seconds': seconds, 'bytes': nbytes })
+    stats.sort(key=lambda x: x['seconds'], reverse=True)
+    return stats
+    
+def profile_report(top=10):
+    """
+    Returns a text report of the *top* slowest patterns in each group.
+    """
+    groups = {}
+    for stat in profile_stats():
+        groups.setdefault(stat['group'], []).append(stat)
+    ranked = sorted(groups.items(), key=lambda x: sum(s['seconds'] for s in x[1]), reverse=True)
+    lines = []
+    for group, stats in ranked:
+        lines.append('%s: %.3fs in %d patterns' % (group, sum(s['seconds'] for s in stats), len(stats)))
+        for s in stats[:top]:
+            lines.append('  %-50s %8.3fs %6d calls %6d hits %6d misses %10.1fKB %8.3fms/call' % (s['name'], s['seconds'], 
+                s['calls'], s['hits'], s['misses'], s['bytes'] / 1024.0, 1000.0 * s['seconds'] / s['calls']))
+    return '\n'.join(lines)
+    
+def reset_profile():
+    with _profile_lock:
+        _profile.clear()
+        
+def _snippet(pattern):
+    return _space_re.sub(' ', pattern).strip()[:50]
     
 def fetch_html(url, get=None, post=None, headers=None, cookie_jar=None):
     """
@@ -85,12 +148,40 @@ def fetch_html(url, get=None, post=None, headers=None, cookie_jar=None):
 # INTERNALS
 # ----------------------------------------------------------------------
 
+def _has_value(result):
+    ' True if a scrape result captured anything - an empty string, list or dict of them is a miss '
+    if isinstance(result, dict):
+        return any(_has_value(v) for v in result.values())
+    if isinstance(result, (list, tuple)):
+        return any(_has_value(v) for v in result)
+    if isinstance(result, basestring):
+        return bool(result)
+    return result is not None
+
 class _Pattern:
 
-    def __init__(self, nodes):
+    def __init__(self, nodes, source=None):
         self._nodes = nodes
+        self._source = source # original pattern string
     
     def scrape(self, html=None, url=None, get=None, post=None, headers=None, cookie_jar=None):
+        if not profiling or html == None:
+            return self._scrape(html, url, get, post, headers, cookie_jar)
+        start = time.time()
+        result = self._scrape(html, url, get, post, headers, cookie_jar)
+        elapsed = time.time() - start
+        with _profile_lock:
+            stats = _profile.get(self._source)
+            if not stats:
+                stats = _profile[self._source] = [ 0, 0, 0.0, 0 ]
+            stats[0] += 1
+            if _has_value(result): # eg not a {* *} list pattern which matched no rows
+                stats[1] += 1
+            stats[2] += elapsed
+            stats[3] += len(html)
+        return result
+        
+    def _scrape(self, html=None, url=None, get=None, post=None, headers=None, cookie_jar=None):
         if cookie_jar == None:
             cookie_jar = cookielib.CookieJar()
         if html == None:
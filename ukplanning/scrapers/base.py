@@ -18,7 +18,6 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 from datetime import timedelta, date, datetime
 import weakref
-from BeautifulSoup import BeautifulSoup
 import lxml
 try:
     from ukplanning import scrapeutils
@@ -40,7 +39,29 @@ try:
     from ukplanning import geo
 except ImportError:
     import geo
+try:
+    from ukplanning import checkpoint
+except ImportError:
+    import checkpoint
+try:
+    from ukplanning import cassette
+except ImportError:
+    import cassette
+try:
+    from ukplanning import seen
+except ImportError:
+    import seen
+try:
+    from ukplanning import archive as page_archive
+except ImportError:
+    import archive as page_archive
+try:
+    from ukplanning.metrics import Metrics, measure
+except ImportError:
+    from metrics import Metrics, measure
 import urlparse
+import urllib
+import time
 
 class BaseScraper(object): # scraper template class to be subclassed by all children
 
@@ -59,7 +80,10 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
     _scrape_min_data = None # scrapemark config to get the minimum acceptable valid dataset on an application page
     _scrape_optional_data = [] # list of scrapemark configs to get other optional parameters that can appear on an application page
     _scrape_invalid_format = None # scrapemark config to signal the returned page is not a valid application record
-    _min_fields = [ 'reference', 'address', 'description' ] # min fields list used in testing only
+    _scrape_listing = None # scrapemark config to get records from a results page including any other fields shown next to each uid (see _scrape_id_list)
+    _min_fields = [ 'reference', 'address', 'description' ] # min fields list used in testing
+    _listing_fields = None # fields in a _scrape_listing record which make the detail pages unnecessary (see needs_detail) - None if it never has enough
+    _diff_ignore = [ 'date_scraped', 'authority' ] # fields not compared when finding the changes in update_application
     _logfile = None
     _search_url = None
     _detail_page = None
@@ -71,6 +95,23 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
     _cookies = None
     _uid_only = False # by default assume applications can be accessed via uid AND url (but some can only go via uid)
     _uid_num_sequence = False # uid by default is the local authority reference (but some can use a numeric sequence value)
+    _page_size = 10 # default number of results on each page of a search
+    _page_size_field = None # form field or query parameter which sets the number of results per page (if the site has one)
+    _page_size_max = None # the largest number of results per page the site accepts via _page_size_field
+    _page_size_refused = False # set if the site fails when _page_size_field is used, so it is not tried again
+    _page_size_trial = False # set on a scraper while it retries without the page size - see _with_page_size()
+    _clean_memo = None # text values already cleaned - only used within clean_records()
+    _date_parser = None
+    _checkpoints = None # CheckpointStore which makes gather_ids() resumable - see use_checkpoints()
+    _metrics = None
+    _stage_names = None # scrapemark config -> class attribute name, to label the parse stages in metrics
+    _cassette = None # cassette.Cassette which records or replays all HTTP traffic - see use_cassette()
+    _archive = None # archive.PageArchive which keeps every page body read by _get_html() - see use_archive()
+    _archive_uid = None # uid of the application being fetched, if any - to label archived pages
+    _archive_kind = None # 'detail' for the first page read in _get_detail_wrapper(), then 'linked' for the rest
+    _seen = None # seen.SeenIndex of the uids gathered in earlier runs - see use_seen_index()
+    _detail_parser = None # optional function(html, url) which scrapes a detail page in place of _get_details() - see multirun.ScraperPool
+    _patterns_tagged = False # True once the scrapemark configs of a class are labelled for profiling
     
     # default public class variables for all scrapers
     data_start_target = None # the earliest sequence value to work back to (date string or integer)
@@ -79,6 +120,14 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
     batch_size = None # number of dates/sequences to ask for in successive requests to target web site
     current_span = None # overall number of dates/sequences requested if gathering the most recent or highest sequence
     url_first = True # by default tries to access applications from url if exists - then uid
+    adaptive_timeout = False # if True the request timeout is derived from observed host response times, not the fixed 'timeout'
+    postcode_index = None # optional geo.PostcodeIndex - locates applications which only have a postcode (shared by all scrapers)
+    cassette_directory = None # if set, every new scraper records to or replays from '<authority name>.cassette' in this directory
+    cassette_mode = cassette.REPLAY # 'record' or 'replay'
+    archive_directory = None # if set, every new scraper keeps the raw pages it reads in a shared archive in this directory
+    shared_log = None # if set, every new scraper logs JSON records to this one file through a background writer thread (see myutils.LogWriter)
+    filter_seen = False # if True gather_ids() leaves out uids already in the seen index, otherwise they are marked 'seen': True
+    stop_when_seen = False # if True paging through search results stops after a page of uids which are all in the seen index
     
     # scrape error codes when retrieving application details
     FETCH_FAIL = 'FETCH_FAIL'
@@ -129,6 +178,37 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         if verbose: print "Error: no instance of %s already exists" % cls.__name__
         return None 
         
+    @classmethod
+    def create_parser(cls):
+        """ returns an instance which can scrape and clean the pages it is given, but which has
+        no browser, session or log file - for use in other processes or offline
+        note this is not registered as the singleton instance of the class """
+        obj = object.__new__(cls)
+        obj.logger = logging.getLogger(cls._authority_name or cls.__name__)
+        obj.br = None
+        obj.cj = None
+        obj._timeout = cls._default_timeout
+        cls._tag_patterns()
+        return obj
+        
+    @classmethod
+    def _tag_patterns(cls):
+        """ labels the scrapemark configs of this class (all '_scrape_' class attributes) so a scrapemark profile 
+        shows the attribute each pattern came from eg 'IdoxScraper._scrape_min_data' - see scrapemark.profile_report() """
+        if cls.__dict__.get('_patterns_tagged'):
+            return
+        for klass in cls.__mro__: # most derived first, so the first label is the definition in use
+            group = getattr(klass, '_scraper_type', None) or klass.__name__ # patterns are grouped by the scraper type which defines them
+            for attr, value in klass.__dict__.items():
+                if attr.startswith('_scrape_'):
+                    name = klass.__name__ + '.' + attr
+                    if isinstance(value, (list, tuple)):
+                        for i, v in enumerate(value):
+                            scrapemark.tag_pattern(v, group, '%s[%d]' % (name, i))
+                    else:
+                        scrapemark.tag_pattern(value, group, name)
+        cls._patterns_tagged = True
+        
     """ alternative to the class methods defined above - enforces singleton via normal __init__
     def __new__(cls, *args, **kwargs): 
         # Check to see if a __instance exists already for this class
@@ -152,21 +232,32 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         else:
             if not log_level:
                 log_level = self._default_log_level
-            if not log_name:
-                log_name = self._authority_name
-            if not log_directory:
-                log_directory = self._log_directory
-            self._logfile = myutils.log_path(log_name, directory=log_directory)
-            fh = myutils.frotate_handler(self._logfile)
-            self.logger = myutils.setup_logger(self._authority_name, fh, level=log_level)
-        self.logger.info("Instance of %s %s %s started" % (self._authority_name, ( self._scraper_type if self._scraper_type else 'Custom' ), self._base_type))
+            if self.shared_log:
+                self._logfile = self.shared_log
+                self.logger = myutils.setup_queue_logger(self._authority_name, self.shared_log, level=log_level)
+            else:
+                if not log_name:
+                    log_name = self._authority_name
+                if not log_directory:
+                    log_directory = self._log_directory
+                self._logfile = myutils.log_path(log_name, directory=log_directory)
+                fh = myutils.frotate_handler(self._logfile)
+                self.logger = myutils.setup_logger(self._authority_name, fh, level=log_level)
+        self.logger.info("Instance of %s %s %s started", self._authority_name, ( self._scraper_type if self._scraper_type else 'Custom' ), self._base_type)
         if not timeout:
             timeout = self._default_timeout
         self.br, self.cj = scrapeutils.get_browser(self._headers, self._handler, self._proxy, float(timeout))
+        self.br.adaptive_timeout = self.adaptive_timeout
+        self.br.observers.append(self.metrics.record_request)
         if self._cookies:
             for ck in self._cookies:
                 scrapeutils.set_cookie(self.cj, ck.get('name', ''), ck.get('value', ''), ck.get('domain'), ck.get('path', '/'))   
         self._timeout = self.br._timeout
+        self._tag_patterns()
+        if self.cassette_directory:
+            self.use_cassette(os.path.join(self.cassette_directory, self._authority_name + '.cassette'), self.cassette_mode)
+        if self.archive_directory:
+            self.use_archive(self.archive_directory)
         
     #def __del__(self):
     #    self.logger.info("Scraper dead") 
@@ -203,6 +294,25 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         ' Path to the log file for this scraper '
         return self._logfile
         
+    @property
+    def date_parser(self):
+        ' Memoised date parser used when cleaning records - see date_parser.stats() for hit statistics '
+        if self._date_parser is None:
+            self._date_parser = myutils.DateParser()
+        return self._date_parser
+        
+    @property
+    def metrics(self):
+        ' Counters and timings of the requests, id batches, detail pages and parse stages of this scraper (see metrics.Metrics) '
+        if self._metrics is None:
+            self._metrics = Metrics(authority=self._authority_name)
+        return self._metrics
+        
+    @property
+    def host_health(self):
+        ' Health tracker for the host of the search URL (see scrapeutils.HostHealth) '
+        return scrapeutils.host_health(self._search_url or '')
+        
     @property
     def max_sequence(self): # current max record sequence number = date/number
         return None
@@ -248,7 +358,7 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
             if (not page or 'scrape_error' in page) and url:
                 page = self._get_html_wrapper(url, 'url')
         if not page:
-            self.logger.warning("Error getting html page from application: %s" % (self.EMPTY))
+            self.logger.warning("Error getting html page from application: %s", self.EMPTY)
             return { 'scrape_error': self.errors[self.EMPTY] }
         elif 'scrape_error' in page: 
             return { 'scrape_error': page['scrape_error'] }
@@ -265,21 +375,21 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         try:
             if param_type not in ['uid', 'url']:
                 param_type = 'url'
-            self.logger.debug("Trying to get html using %s %s" % (uidurl, param_type))
+            self.logger.debug("Trying to get html using %s %s", uidurl, param_type)
             if param_type == 'uid':
                 html, url = self.get_html_from_uid(uidurl)
             else:
                 html, url = self.get_html_from_url(uidurl)
             if not html:
-                self.logger.warning("Error getting html using %s %s: %s" % (uidurl, param_type, self.errors[self.EMPTY]))
+                self.logger.warning("Error getting html using %s %s: %s", uidurl, param_type, self.errors[self.EMPTY])
                 return { 'scrape_error': self.errors[self.EMPTY] }
             else:
                 return { 'html': html, 'url': url } 
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting html using %s %s: %s: %s" % (uidurl, param_type, self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting html using %s %s: %s: %s", uidurl, param_type, self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting html using %s %s: %s" % (uidurl, param_type, self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting html using %s %s: %s", uidurl, param_type, self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] } 
         
     def fetch_application(self, uid, url=None):
@@ -287,17 +397,21 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         result is always a dict with a non-empty 'record' if successful 
         otherwise with a 'scrape_error' code  """
         applic = None
-        if self.url_first and not self._uid_only:
-            if url:
-                applic = self._get_detail_wrapper(url, 'url')
-            if not applic or 'scrape_error' in applic:
+        self._archive_uid = uid # labels any pages archived during the fetch
+        try:
+            if self.url_first and not self._uid_only:
+                if url:
+                    applic = self._get_detail_wrapper(url, 'url')
+                if not applic or ('scrape_error' in applic and not self._host_down(applic)):
+                    applic = self._get_detail_wrapper(uid, 'uid')
+            else:
                 applic = self._get_detail_wrapper(uid, 'uid')
-        else:
-            applic = self._get_detail_wrapper(uid, 'uid')
-            if (not applic or 'scrape_error' in applic) and url:
-                applic = self._get_detail_wrapper(url, 'url')
+                if (not applic or ('scrape_error' in applic and not self._host_down(applic))) and url:
+                    applic = self._get_detail_wrapper(url, 'url')
+        finally:
+            self._archive_uid = None
         if not applic:
-            self.logger.warning("Error fetching application: %s" % (self.EMPTY))
+            self.logger.warning("Error fetching application: %s", self.EMPTY)
             return { 'scrape_error': self.errors[self.EMPTY] }
         elif 'scrape_error' in applic: 
             return { 'scrape_error': applic['scrape_error'] }
@@ -305,6 +419,193 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
             self._process_applic(applic)
             return { 'record': applic }
             
+    def _host_down(self, result):
+        """ True if a result failed to fetch and the circuit of the host it failed on is now open - so no point trying again
+        (the detail pages are not always on the same host as the search pages) """
+        if result.get('scrape_error') != self.errors[self.FETCH_FAIL]:
+            return False
+        url = self._last_url() # the request which failed is the last one made
+        return bool(url) and scrapeutils.host_health(url).is_open
+        
+    def _last_url(self):
+        ' URL of the latest request made by this scraper '
+        return getattr(self.br, 'last_url', None)
+            
+    @property
+    def page_size(self):
+        ' number of results per page requested from the site '
+        return self._page_size_max if self._use_page_size else self._page_size
+        
+    @property
+    def _use_page_size(self):
+        return bool(self._page_size_field and self._page_size_max and not self._page_size_refused and not self._page_size_trial)
+        
+    def _page_size_fields(self):
+        """ search form fields to request the largest page of results the site allows - to be added
+        to the search fields in get_id_batch() etc, empty if the site has no page size control (or refuses it) """
+        if self._use_page_size:
+            return { self._page_size_field: str(self._page_size_max) }
+        return {}
+        
+    def _page_size_url(self, url):
+        ' search results URL with any page size query parameter set to the largest page size the site allows '
+        if not self._use_page_size:
+            return url
+        parts = urlparse.urlsplit(url)
+        query = [ (k, v) for k, v in urlparse.parse_qsl(parts.query, keep_blank_values=True) if k != self._page_size_field ]
+        query.append((self._page_size_field, str(self._page_size_max)))
+        return urlparse.urlunsplit(parts[:3] + (urllib.urlencode(query),) + parts[4:])
+        
+    def _max_pages(self):
+        ' guard against infinite paging loops - twice the pages needed to reach min_id_goal at the default page size, plus 20 '
+        return (2 * self.min_id_goal / self._page_size) + 20
+        
+    def _with_page_size(self, func, *args):
+        """ calls one of the get_id_ methods - if it raises an error (other than a network one) while a larger page size
+        is being requested, it is tried again without, and only if that succeeds is the site taken to refuse the page size
+        control, which is then not used again by any scraper of this class
+        note an empty result is not a failure (there may be no applications), so a scraper signals a results page it
+        cannot parse by raising an error """
+        if not self._use_page_size:
+            return func(*args)
+        try:
+            return func(*args)
+        except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError):
+            raise # network errors are not the fault of the page size
+        except Exception:
+            self.logger.debug("Error with page size %d - trying the default page size", self._page_size_max)
+        self._page_size_trial = True # this scraper only, until the default page size is seen to work
+        try:
+            result = func(*args)
+        finally:
+            self._page_size_trial = False
+        type(self)._page_size_refused = True
+        self.logger.warning("Page size %d refused by the site - using the default page size", self._page_size_max)
+        return result
+        
+    def use_checkpoints(self, store):
+        """ record the progress of each gather_ids() call in 'store' (a checkpoint.CheckpointStore or the path of its database)
+        after every successful batch, so if a run fails a repeat of the same gather_ids() call later that day carries on
+        from the last completed batch - None turns checkpoints off """
+        if store and isinstance(store, basestring):
+            store = checkpoint.CheckpointStore(store)
+        self._checkpoints = store
+        return store
+        
+    def use_seen_index(self, index, filter_seen=None, stop_when_seen=None):
+        """ check the uids returned by gather_ids() against 'index' (a seen.SeenIndex or the path of its database),
+        so known uids are marked 'seen': True or if 'filter_seen' left out - if 'stop_when_seen' the results pages of a batch are
+        not followed beyond one with only known uids (only for sites which list the newest first) - None turns it off
+        NOTE uids are only added to the index by mark_stored(), which must be called once the gathered records are safely
+        stored - otherwise with 'filter_seen' any records not stored are never returned again """
+        if index and isinstance(index, basestring):
+            index = seen.SeenIndex(index)
+        self._seen = index
+        if filter_seen is not None:
+            self.filter_seen = filter_seen
+        if stop_when_seen is not None:
+            self.stop_when_seen = stop_when_seen
+        return index
+        
+    def mark_stored(self, uids):
+        ' adds the uids of stored records to the seen index, so later gather_ids() calls treat them as known '
+        if self._seen is not None and uids:
+            self._seen.add(self._authority_name, uids)
+        
+    def _mark_seen(self, records):
+        """ marks (or with filter_seen removes) the records of a gathered batch whose uids are in the seen index
+        - returns the records (note the index itself is not changed, see mark_stored) """
+        if self._seen is None or not records:
+            return records
+        known = self._seen.known(self._authority_name, [ r.get('uid') for r in records ])
+        if known:
+            self.metrics.inc('ids_seen_total', len(known))
+        if self.filter_seen:
+            return [ r for r in records if r.get('uid') not in known ]
+        for r in records:
+            if r.get('uid') in known:
+                r['seen'] = True
+        return records
+        
+    def _page_seen(self, records):
+        """ True if stop_when_seen is set and every uid on a page of search results is already in the seen index
+        - for get_id_batch() paging loops, so no more pages are fetched """
+        if not self.stop_when_seen or self._seen is None or not records:
+            return False
+        uids = set(r.get('uid') for r in records)
+        if len(self._seen.known(self._authority_name, uids)) < len(uids):
+            return False
+        self.logger.debug("All %d ids on the page already seen - no more pages", len(uids))
+        self.metrics.inc('pages_stopped_seen_total')
+        return True
+        
+    def use_cassette(self, path, mode=cassette.REPLAY, ignore=()):
+        """ record all HTTP traffic of this scraper to the cassette file at 'path' ('record' mode) or serve it
+        from the cassette without any network access ('replay' mode) - so whole gather_ids()/update_application()
+        flows can be run offline and repeatably - 'ignore' are any query/form parameters that vary between runs
+        a recording cassette is saved at exit or on cassette.save() - None turns the cassette off """
+        if path and isinstance(path, basestring):
+            path = cassette.open_cassette(path, mode, ignore)
+        self._cassette = path
+        self._attach_cassette()
+        return path
+        
+    def use_archive(self, archive):
+        """ keep the raw body of every page read through _get_html() in 'archive' (an archive.PageArchive
+        or the directory of one) - pages fetched for an application are labelled with its uid, and kind 'detail' for the
+        page its record is scraped from or 'linked' for any other pages of the fetch (eg dates, info) - others are labelled
+        kind 'page' - so records can be parsed again later without the network (see reextract.py) - None turns it off """
+        if archive and isinstance(archive, basestring):
+            archive = page_archive.open_archive(archive)
+        self._archive = archive
+        return archive
+        
+    def _archive_page(self, html, url):
+        ' adds a page read by _get_html() to the archive - never fails the scrape '
+        if self._archive is None:
+            return
+        try:
+            kind = self._archive_kind or 'page'
+            self._archive.store(self._authority_name, self._archive_uid, kind, url, html)
+            if kind == 'detail':
+                self._archive_kind = 'linked' # any later pages of the same fetch
+        except Exception:
+            self.logger.exception("Error archiving page %s", url)
+        
+    def _attach_cassette(self):
+        if self.br:
+            self.br.handlers = [ h for h in self.br.handlers if not isinstance(h, cassette.CassetteHandler) ]
+            if self._cassette is not None:
+                self.br.add_handler(cassette.CassetteHandler(self._cassette))
+                
+    def _checkpoint_request(self, start, target):
+        """ checkpoint key for one gather_ids() call - from the sequence values it actually starts at and works towards,
+        so a later call with the same arguments (eg a default forward run on another day) does not resume it """
+        return 'gather_ids(%s, %s)' % (start, target)
+        
+    def _checkpoint_resume(self, request):
+        ' returns (start, current, ok_current, full_result) from the last completed batch of a failed run, or None '
+        if not self._checkpoints:
+            return None
+        state = self._checkpoints.load(self._authority_name, request)
+        if not state:
+            return None
+        self.logger.info("Resuming %s from checkpoint at %s with %d ids", request, state['ok_current'], len(state['result']))
+        return (self._sequence_value(state['start']), self._sequence_value(state['current']), 
+            self._sequence_value(state['ok_current']), state['result'])
+        
+    def _checkpoint_save(self, request, start, current, ok_current, result):
+        if self._checkpoints:
+            self._checkpoints.save(self._authority_name, request, str(start), str(current), str(ok_current), result)
+            
+    def _checkpoint_done(self, request):
+        if self._checkpoints:
+            self._checkpoints.delete(self._authority_name, request)
+            
+    def _sequence_value(self, text):
+        ' converts a stored sequence string back to a sequence value '
+        return myutils.get_dt(text)
+        
     def _process_applic(self, applic):
         """ post process an applic: set start_date, extract postcode/location (without external lookup)
         , add extra info inc datestamp, source details etc """
@@ -318,11 +619,13 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         if pc:
             applic['postcode'] = pc
         lnglat = geo.lnglat_from_applic(applic)
+        if not lnglat and pc and self.postcode_index:
+            lnglat = self.postcode_index.lookup(pc) # postcode centroid from the local index (no network geocoding)
         if lnglat:
             applic['lat'] = lnglat[1]
             applic['lng'] = lnglat[0]
         else:
-            applic.pop('lat', '') # float lat/lng values only present if valid and derived from easting/northing or latitude/longitude fields
+            applic.pop('lat', '') # float lat/lng values only present if valid and derived from easting/northing, latitude/longitude or postcode fields
             applic.pop('lng', '')
         if applic.get('date_received') and applic.get('date_validated'):
             if applic['date_received'] < applic['date_validated']:
@@ -337,44 +640,67 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         applic['authority'] = self.authority_name
         applic['source_url'] = self.search_url
 
-    def update_application(self, applic):
+    def update_application(self, applic, listing_only=False, diff=False):
         """updates an application record in place, preserving any existing fields which are not 
         returned from the remote source this time around
+        if 'listing_only' is set, the detail pages are not fetched for a record which already has all
+        the _listing_fields (ie from the results listing - see _scrape_listing and needs_detail)
+        if 'diff' is set, the result also has the field level 'changes' (see myutils.diff_records) and a 'changed' flag
+        which is False if the update added or altered nothing (other than the _diff_ignore fields)
         result is always a dict with a non-empty 'record' if successful 
         otherwise with a 'scrape_error' code  """
         if not applic.get('uid'):
             return { 'scrape_error': self.errors[self.NO_UID] }
+        if listing_only and not self.needs_detail(applic):
+            self.metrics.inc('detail_skipped_total')
+            if diff:
+                before = dict(applic)
+            self._process_applic(applic) # as a fetched record - start_date, postcode, location, date_scraped etc
+            if diff:
+                changes = myutils.diff_records(before, applic, self._diff_ignore)
+                return { 'record': applic, 'changes': changes, 'changed': bool(changes['added'] or changes['changed']) }
+            return { 'record': applic }
         result = self.fetch_application(applic['uid'], applic.get('url'))
         if result.get('record'):
+            if diff:
+                changes = myutils.diff_records(applic, result['record'], self._diff_ignore)
             applic.update(result['record']) # this bit ensures any old data is preserved if there is nothing new
+            if diff:
+                changed = bool(changes['added'] or changes['changed'])
+                self.metrics.inc('records_changed_total' if changed else 'records_unchanged_total')
+                return { 'record': applic, 'changes': changes, 'changed': changed }
             return { 'record': applic }
         else:
             return result
             
+    @measure('detail')
     def _get_detail_wrapper(self, uidurl, param_type=None):
         ' wrapper to catch all errors related to scrape request failure '
+        self._archive_kind = 'detail'
         try:
             if param_type not in ['uid', 'url']:
                 param_type = 'url'
-            self.logger.debug("Trying to get detail using %s %s" % (uidurl, param_type))
+            self.logger.debug("Trying to get detail using %s %s", uidurl, param_type)
             if param_type == 'uid':
                 result = self.get_detail_from_uid(uidurl)
             else:
                 result = self.get_detail_from_url(uidurl)
             if not result:
-                self.logger.warning("Error getting detail using %s %s: %s" % (uidurl, param_type, self.errors[self.EMPTY]))
+                self.logger.warning("Error getting detail using %s %s: %s", uidurl, param_type, self.errors[self.EMPTY])
                 return { 'scrape_error': self.errors[self.EMPTY] }
             elif 'scrape_error' in result: 
-                self.logger.warning("Error getting detail using %s %s: %s" % (uidurl, param_type, result['scrape_error']))
+                self.logger.warning("Error getting detail using %s %s: %s", uidurl, param_type, result['scrape_error'])
                 return { 'scrape_error': result['scrape_error'] }
             else:
                 return result
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting detail using %s %s: %s: %s" % (uidurl, param_type, self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting detail using %s %s: %s: %s", uidurl, param_type, self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting detail using %s %s: %s" % (uidurl, param_type, self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting detail using %s %s: %s", uidurl, param_type, self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] } 
+        finally:
+            self._archive_kind = None
             
     def get_detail_from_uid(self, uid):
         """ Scrapes detailed information for one record given its UID
@@ -429,7 +755,10 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
     def _get_full_details(self, html, real_url, update_url=False):
         """ Return scraped record with optional update of base url using the website response """
         self.logger.debug("Real url: %s", real_url)
-        result = self._get_details(html, real_url)
+        if self._detail_parser:
+            result = self._detail_parser(html, real_url)
+        else:
+            result = self._get_details(html, real_url)
         if not update_url or not real_url or 'scrape_error' in result or result.get('url'):
             return result
         result['url'] = real_url # this is where the 'url' field is updated from page source - ie only if if successful
@@ -442,14 +771,42 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
         return self._get_detail(html, this_url)
         
     def _get_html(self, response):
-        """ Return HTML and URL given the website response """
-        return response.read(), response.geturl()
+        """ Return HTML and URL given the website response - the page is archived as fetched (so any fix to
+        the html before it is parsed should be in _adjust_html, which is also applied when it is re-extracted) """
+        html, url = response.read(), response.geturl()
+        self._archive_page(html, url)
+        return html, url
 
     def _get_detail(self, html, url, data_block = None, min_data = None, optional_data = [], invalid_format = None):
         """ Scrapes detailed information for one record given its HTML and URL and scrapemark config strings
         returns a cleaned dict with application information if finds correctly configured data
         otherwise a dict with a 'scrape_error' key if there is a problem
         """
+        start = time.time()
+        try:
+            return self._parse_detail(html, url, data_block, min_data, optional_data, invalid_format)
+        finally:
+            self.metrics.observe('parse_seconds', time.time() - start, stage=self._stage_name(min_data))
+            
+    def _stage_name(self, min_data):
+        """ metrics label for a detail page parse stage - the class attribute name of its min data config
+        eg 'min_data' for the default _scrape_min_data, 'min_dates' for _scrape_min_dates """
+        if not min_data:
+            return 'min_data'
+        cls = type(self)
+        names = cls.__dict__.get('_stage_names')
+        if names is None:
+            names = {}
+            for attr in dir(cls):
+                if attr.startswith('_scrape_'):
+                    value = getattr(cls, attr)
+                    if isinstance(value, basestring):
+                        names.setdefault(value, attr[len('_scrape_'):])
+            cls._stage_names = names
+        return names.get(min_data, 'other') if isinstance(min_data, basestring) else 'other'
+        
+    def _parse_detail(self, html, url, data_block, min_data, optional_data, invalid_format):
+        ' the scraping and cleaning for _get_detail() '
         scrape_data_block = data_block or self._scrape_data_block # use class defaults if none supplied
         scrape_min_data = min_data or self._scrape_min_data
         scrape_optional_data = optional_data or self._scrape_optional_data
@@ -562,30 +919,66 @@ class BaseScraper(object): # scraper template class to be subclassed by all chil
                     text = myutils.GAPS_REGEX.sub('', v) # strip any spaces in urls
                     v = scrapeutils.JSESS_REGEX.sub('', text) # strip any jsessionid parameter
                 elif k.endswith('_date') or k.startswith('date_'):
-                    dt = myutils.get_dt(v, self._response_date_format)
+                    dt = self.date_parser.get_dt(v, self._response_date_format)
                     if not dt:
                         v = None
                     else:
                         v = dt.isoformat()
                 else:
-                    text = scrapeutils.TAGS_REGEX.sub(' ', v) # replace any html tag content with spaces
-                    #try:
-                    text = BeautifulSoup(text, convertEntities="html").contents[0].string
-                    # use beautiful soup to convert html entities to unicode strings
-                    #except:
-                    #    pass
-                    text = myutils.GAPS_REGEX.sub(' ', text) # normalise any internal space
-                    v = text.strip() # strip leading and trailing space
+                    v = self._clean_text(v) # replaces tags, converts html entities, normalises space
             if not v: # delete entry if the final value is empty
                 del record[k]
             else:
                 record[k] = v
                 #self.logger.debug("Cleaned record: %s", record)
 
+    def _clean_text(self, text):
+        """ clean one text field - repeated values are only cleaned once within clean_records() """
+        if self._clean_memo is None:
+            return scrapeutils.clean_text(text)
+        cleaned = self._clean_memo.get(text)
+        if cleaned is None:
+            cleaned = scrapeutils.clean_text(text)
+            self._clean_memo[text] = cleaned
+        return cleaned
+        
+    def clean_records(self, records):
+        """ clean up a list of scraped records - as _clean_record() for each one
+        but text values which repeat across the list are only cleaned once """
+        self._clean_memo = {}
+        try:
+            for record in records:
+                self._clean_record(record)
+        finally:
+            self._clean_memo = None
+
+    def needs_detail(self, record, fields=None):
+        """ True if a record (eg from gather_ids) is missing any of the _listing_fields (or other listed fields)
+        always True for a scraper with no _listing_fields, as its listing records never have enough """
+        fields = fields or self._listing_fields
+        if not fields:
+            return True
+        for f in fields:
+            if not record.get(f):
+                return True
+        return False
+        
+    def _scrape_id_list(self, html, url):
+        """ scrapes the uid/url records on a page of search results using the _scrape_ids config - if there is a _scrape_listing
+        config, any other fields shown next to each uid are merged in by uid (rows it does not match, eg with a field missing, are still returned) """
+        result = scrapemark.scrape(self._scrape_ids, html, url)
+        if self._scrape_listing and result and result.get('records'):
+            listing = scrapemark.scrape(self._scrape_listing, html, url)
+            if listing and listing.get('records'):
+                rows = dict((r['uid'], r) for r in listing['records'] if r.get('uid'))
+                for record in result['records']:
+                    for k, v in rows.get(record.get('uid'), {}).items():
+                        record.setdefault(k, v)
+        return result
+        
     def _clean_ids(self, records):
-        """ post process a batch of uid/url records: strips spaces in the uid etc - now uses _clean_record() """
-        for record in records:
-            self._clean_record(record)
+        """ post process a batch of uid/url records: strips spaces in the uid etc - now uses clean_records() """
+        self.clean_records(records)
 
 class DateScraper(BaseScraper): # for those sites that can return applications between two arbitrary search dates 
 
@@ -647,6 +1040,10 @@ class DateScraper(BaseScraper): # for those sites that can return applications b
         current = start
         ok_current = start
         full_result = []
+        request = self._checkpoint_request(start, target)
+        resume = self._checkpoint_resume(request)
+        if resume:
+            start, current, ok_current, full_result = resume
         while len(full_result) < self.min_id_goal and ((not move_forward and current >= target) or (move_forward and current <= target)): 
             if not move_forward:
                 next = current - timedelta(days=self.batch_size-1)
@@ -673,13 +1070,15 @@ class DateScraper(BaseScraper): # for those sites that can return applications b
                     output ['scrape_error'] = result ['scrape_error']
                 break
             else:
-                self.logger.debug("%d ids gathered from %s to %s" % (len(result['result']), result['from'], result['to']))
+                self.logger.debug("%d ids gathered from %s to %s", len(result['result']), result['from'], result['to'])
                 full_result.extend(result['result'])
                 ok_current = next
                 if not move_forward:
                     current = next - timedelta(days=1)
                 else:
                     current = next + timedelta(days=1)
+                self._checkpoint_save(request, start, current, ok_current, result['result'])
+        full_result = self._mark_seen(full_result) # only once the loop is done, so known ids still count towards min_id_goal
         for res in full_result:
             res['authority'] = self._authority_name
         output ['result'] = full_result
@@ -691,27 +1090,29 @@ class DateScraper(BaseScraper): # for those sites that can return applications b
                 ok_current = self.max_sequence
             output ['from'] = start
             output ['to'] = ok_current
+        self._checkpoint_done(request)
         return output
 
     # wrapper to catch all errors from requests or mechanize related to http request failure
     # note dates here are real objects - so may need formatting
+    @measure('id_batch')
     def _get_id_batch_wrapper(self, date_from, date_to):
         try:
-            result = self.get_id_batch(date_from, date_to)
+            result = self._with_page_size(self.get_id_batch, date_from, date_to)
             if result:
                 for res in result:
                     if not res.get('uid'):
-                        self.logger.warning("Error getting ids from %s to %s: %s" % (date_from, date_to, self.errors[self.NO_UID]))
+                        self.logger.warning("Error getting ids from %s to %s: %s", date_from, date_to, self.errors[self.NO_UID])
                         return { 'scrape_error': self.errors[self.NO_UID] }
                 return { 'result': result, 'from': date_from, 'to': date_to }
             else:
-                self.logger.warning("Error getting ids from %s to %s: %s" % (date_from, date_to, self.errors[self.NO_DATA]))
+                self.logger.warning("Error getting ids from %s to %s: %s", date_from, date_to, self.errors[self.NO_DATA])
                 return { 'scrape_error': self.errors[self.NO_DATA] }
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting ids from %s to %s: %s: %s" % (date_from, date_to, self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting ids from %s to %s: %s: %s", date_from, date_to, self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting ids from %s to %s: %s" % (date_from, date_to, self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting ids from %s to %s: %s", date_from, date_to, self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] }
             
     # retrieves a batch of IDs betwen two sequence dates, to be implemented in the children
@@ -786,6 +1187,10 @@ class PeriodScraper(BaseScraper): # for those sites that return a fixed period o
         current = start
         ok_current = start
         full_result = []
+        request = self._checkpoint_request(start, target)
+        resume = self._checkpoint_resume(request)
+        if resume:
+            start, current, ok_current, full_result = resume
         while len(full_result) < self.min_id_goal and ((not move_forward and current > target) or (move_forward and current < target)): 
             result = self._get_id_period_wrapper(current)
             if 'scrape_error' in result:
@@ -794,16 +1199,18 @@ class PeriodScraper(BaseScraper): # for those sites that return a fixed period o
                 break	   
             else:
                 if result.get('result'):
-                    self.logger.debug("%d ids gathered from %s to %s" % (len(result['result']), result['from'], result['to']))
+                    self.logger.debug("%d ids gathered from %s to %s", len(result['result']), result['from'], result['to'])
                     full_result.extend(result['result'])
                 else:
-                    self.logger.warning("0 ids gathered from %s to %s" % (result['from'], result['to']))
+                    self.logger.warning("0 ids gathered from %s to %s", result['from'], result['to'])
                 if not move_forward: 
                     ok_current = result['from']
                     current = result['from'] - timedelta(days=1)
                 else:
                     ok_current = result['to']
                     current = result['to'] + timedelta(days=1)
+                self._checkpoint_save(request, start, current, ok_current, result.get('result', []))
+        full_result = self._mark_seen(full_result) # only once the loop is done, so known ids still count towards min_id_goal
         for res in full_result:
             res['authority'] = self._authority_name
         output ['result'] = full_result
@@ -815,27 +1222,29 @@ class PeriodScraper(BaseScraper): # for those sites that return a fixed period o
                 ok_current = self.max_sequence
             output ['from'] = start
             output ['to'] = ok_current
+        self._checkpoint_done(request)
         return output
         
     # wrapper to catch all errors from requests or mechanize related to http request failure
     # note dates here are real objects - so may need formatting
+    @measure('id_period')
     def _get_id_period_wrapper(self, date):
         try:
-            result, from_dt, to_dt = self.get_id_period(date)
+            result, from_dt, to_dt = self._with_page_size(self.get_id_period, date)
             if from_dt and to_dt:
                 for res in result:
                     if not res.get('uid'):
-                        self.logger.warning("Error getting ids from period around %s: %s" % (date, self.errors[self.NO_UID]))
+                        self.logger.warning("Error getting ids from period around %s: %s", date, self.errors[self.NO_UID])
                         return { 'scrape_error': self.errors[self.NO_UID] }
                 return { 'result': result, 'from': from_dt, 'to': to_dt } # note result can be legitimately empty (if return dates are set)
             else:
-                self.logger.warning("Error getting ids from period around %s: %s" % (date, self.errors[self.NO_DATA]))
+                self.logger.warning("Error getting ids from period around %s: %s", date, self.errors[self.NO_DATA])
                 return { 'scrape_error': self.errors[self.NO_DATA] }
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting ids from period around %s: %s: %s" % (date, self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting ids from period around %s: %s: %s", date, self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting ids from period around %s: %s" % (date, self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting ids from period around %s: %s", date, self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] }
             
     # retrieves a batch of IDs around one date, to be implemented in the children
@@ -861,6 +1270,9 @@ class ListScraper(BaseScraper): # for those sites that return a full paged list
     def min_sequence(self):
         """ returns current min record sequence number = 'data_start_target' as an integer in this case """
         return int(self.data_start_target)
+        
+    def _sequence_value(self, text):
+        return int(text)
 
     def gather_ids(self, sequence_from = None, sequence_to = None):
         """process id batches working through a numeric sequence (where the earliest record is nominally record number 1)
@@ -917,6 +1329,10 @@ class ListScraper(BaseScraper): # for those sites that return a full paged list
         current = start
         ok_current = start
         full_result = []
+        request = self._checkpoint_request(start, target)
+        resume = self._checkpoint_resume(request)
+        if resume:
+            start, current, ok_current, full_result = resume
         while len(full_result) < self.min_id_goal and ((not move_forward and current >= target) or (move_forward and current <= target)): 
             if not move_forward:
                 next = current - self.batch_size + 1
@@ -952,16 +1368,18 @@ class ListScraper(BaseScraper): # for those sites that return a full paged list
                 break 
             else:
                 if result.get('result'):
-                    self.logger.debug("%d ids gathered from %s to %s" % (len(result['result']), result['from'], result['to']))
+                    self.logger.debug("%d ids gathered from %s to %s", len(result['result']), result['from'], result['to'])
                     full_result.extend(result['result'])
                 else:
-                    self.logger.warning("0 ids gathered from %s to %s" % (result['from'], result['to']))
+                    self.logger.warning("0 ids gathered from %s to %s", result['from'], result['to'])
                 if not move_forward:
                     ok_current = result['from']
                     current = result['from'] - 1
                 else:
                     ok_current = result['to']
                     current = result['to'] + 1
+                self._checkpoint_save(request, start, current, ok_current, result.get('result', []))
+        full_result = self._mark_seen(full_result) # only once the loop is done, so known ids still count towards min_id_goal
         for res in full_result:
             res['authority'] = self._authority_name
         output ['result'] = full_result
@@ -973,26 +1391,28 @@ class ListScraper(BaseScraper): # for those sites that return a full paged list
                 ok_current = max_sequence
             output ['from'] = start
             output ['to'] = ok_current
+        self._checkpoint_done(request)
         return output
         
     # wrapper to catch all errors from requests or mechanize related to http request failure
+    @measure('id_records')
     def _get_id_records_wrapper(self, from_rec, to_rec, max_recs):
         try:
-            result, found_from, found_to = self.get_id_records(from_rec, to_rec, max_recs)
+            result, found_from, found_to = self._with_page_size(self.get_id_records, from_rec, to_rec, max_recs)
             if found_from and found_to:
                 for res in result:
                     if not res.get('uid'):
-                        self.logger.warning("Error getting ids from %d to %d: %s" % (from_rec, to_rec, self.errors[self.NO_UID]))
+                        self.logger.warning("Error getting ids from %d to %d: %s", from_rec, to_rec, self.errors[self.NO_UID])
                         return { 'scrape_error': self.errors[self.NO_UID] }
                 return { 'result': result, 'from': found_from, 'to': found_to } # note result can be legitimately empty (if return sequences are set)
             else:
-                self.logger.warning("Error getting ids from %d to %d: %s" % (from_rec, to_rec, self.errors[self.NO_DATA]))
+                self.logger.warning("Error getting ids from %d to %d: %s", from_rec, to_rec, self.errors[self.NO_DATA])
                 return { 'scrape_error': self.errors[self.NO_DATA] }
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting ids from %d to %d: %s: %s" % (from_rec, to_rec, self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting ids from %d to %d: %s: %s", from_rec, to_rec, self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting ids from %d to %d: %s" % (from_rec, to_rec, self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting ids from %d to %d: %s", from_rec, to_rec, self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] }
             
     # wrapper to catch all errors from requests or mechanize related to http request failure
@@ -1002,13 +1422,13 @@ class ListScraper(BaseScraper): # for those sites that return a full paged list
             if max_s:
                 return { 'result': max_s }
             else:
-                self.logger.warning("Error getting max sequence value: %s" % (self.errors[self.NO_DATA]))
+                self.logger.warning("Error getting max sequence value: %s", self.errors[self.NO_DATA])
                 return { 'scrape_error': self.errors[self.NO_DATA] }
         except (requests.exceptions.RequestException, mechanize.HTTPError, mechanize.URLError) as e:
-            self.logger.warning("Error getting max sequence value: %s: %s" % (self.errors[self.FETCH_FAIL], str(e)))
+            self.logger.warning("Error getting max sequence value: %s: %s", self.errors[self.FETCH_FAIL], str(e))
             return { 'scrape_error': self.errors[self.FETCH_FAIL] }
         except Exception:
-            self.logger.exception("Error getting max sequence value: %s" % (self.errors[self.GET_ERROR]))
+            self.logger.exception("Error getting max sequence value: %s", self.errors[self.GET_ERROR])
             return { 'scrape_error': self.errors[self.GET_ERROR] }
 
     # retrieves records between two sequence numbers - to be defined in the children
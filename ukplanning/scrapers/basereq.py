@@ -19,6 +19,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 import base
 import requests
 import urlparse
+import time
+try:
+    from ukplanning import scrapeutils
+except ImportError:
+    import scrapeutils
 
 # note basereq adapts the base class to use the requests/urllib3 libraries (not mechanize/urllib2)
 # so there is no built in html massaging using _handler and etree/beautifulsoup
@@ -28,10 +33,22 @@ class BaseReqScraper(base.BaseScraper):
     def __init__(self, *args, **kwargs):
         super(BaseReqScraper, self).__init__(*args, **kwargs)
         self.br = None
-        self.rs = requests.Session()
+        self.rs = HealthSession()
+        self.rs.adaptive_timeout = self.adaptive_timeout
+        self.rs.observers.append(self.metrics.record_request)
         self.rs.cookies = self.cj
         if self._headers:
             self.rs.headers.update(self._headers)
+        if self._cassette is not None:
+            self._attach_cassette()
+
+    def _last_url(self):
+        return self.rs.last_url
+
+    def _attach_cassette(self):
+        rs = getattr(self, 'rs', None) # note not yet set if called during the base class __init__
+        if rs is not None:
+            rs.use_cassette(self._cassette)
 
     def get_html_from_url(self, url):
         """ Get the html and url for one record given a URL """
@@ -47,8 +64,66 @@ class BaseReqScraper(base.BaseScraper):
 
     def _get_html(self, response):
         """ Return HTML and URL given the website response """
+        self._archive_page(response.text, response.url)
         return response.text, response.url
 
+class HealthSession(requests.Session):
+    # requests session that checks/records the health of each host accessed (see scrapeutils.HostHealth)
+    # and notifies any other observers of each request (see scrapeutils.notify_observers)
+    
+    track_hosts = True # fail fast if the host circuit is open
+    adaptive_timeout = False # use the per host timeout derived from response times
+    cassette = None # cassette.Cassette which records or replays all requests - see use_cassette()
+    last_url = None # URL of the latest request, set before it is sent (so also if it fails)
+    
+    def __init__(self):
+        super(HealthSession, self).__init__()
+        self.observers = []
+        
+    def mount(self, prefix, adapter):
+        """ while there is a cassette, every adapter is wrapped in a CassetteAdapter - including any mounted
+        after the cassette is set (eg by a scraper __init__ for a TLS version or a longer host prefix) """
+        if isinstance(adapter, base.cassette.CassetteAdapter):
+            adapter = adapter.adapter
+        if self.cassette is not None:
+            adapter = base.cassette.CassetteAdapter(self.cassette, adapter)
+        super(HealthSession, self).mount(prefix, adapter)
+        
+    def use_cassette(self, cassette):
+        ' record or replay all requests with the cassette - None turns it off '
+        self.cassette = cassette
+        for prefix, adapter in list(self.adapters.items()):
+            self.mount(prefix, adapter)
+    
+    def request(self, method, url, *args, **kwargs):
+        self.last_url = url
+        observers = [ scrapeutils.record_health ] + self.observers if self.track_hosts else self.observers
+        if not observers:
+            return super(HealthSession, self).request(method, url, *args, **kwargs)
+        if self.track_hosts:
+            health = scrapeutils.host_health(url)
+            if not health.allow():
+                raise requests.exceptions.ConnectionError('circuit open for host %s' % health.host)
+            if self.adaptive_timeout and kwargs.get('timeout'):
+                kwargs['timeout'] = health.timeout(kwargs['timeout'])
+        start = time.time()
+        try:
+            response = super(HealthSession, self).request(method, url, *args, **kwargs)
+        except base.cassette.CassetteMiss: # a request that was not recorded says nothing about the host
+            if self.track_hosts:
+                health.release()
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            scrapeutils.notify_observers(observers, method.upper(), url, None, time.time() - start, 0, e)
+            raise
+        except Exception: # eg TooManyRedirects or ChunkedEncodingError
+            if self.track_hosts:
+                health.release()
+            raise
+        nbytes = 0 if kwargs.get('stream') else len(response.content)
+        scrapeutils.notify_observers(observers, method.upper(), url, response.status_code, time.time() - start, nbytes)
+        return response
+
 class DateReqScraper(BaseReqScraper, base.DateScraper):
     
     _base_type = 'DateReqScraper'
@@ -86,7 +86,7 @@ class AppSearchServScraper(base.DateScraper):
         self._adjust_response(response)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -251,7 +251,7 @@ class RochfordScraper(AstunScraper):
         except:
             max_pages = 1"""
         
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         page_count = 0
         while response and page_count < max_pages:
             html = response.read()
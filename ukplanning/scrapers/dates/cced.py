@@ -128,7 +128,7 @@ class CCEDScraper(base.DateScraper):
         html = response.read()
         #self.logger.debug("ID batch page html: %s", html)
         
-        runaway_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        runaway_pages = self._max_pages() # guard against infinite loop
         try:
             result = scrapemark.scrape(self._scrape_max_pages, html)
             max_pages = int(result['max_pages'])
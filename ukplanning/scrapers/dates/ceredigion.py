@@ -126,7 +126,7 @@ class CeredigionScraper(base.DateScraper):
         response = scrapeutils.submit_form(self.br, self._submit_control)
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             #self.logger.debug("ids html: %s", html)
@@ -130,7 +130,7 @@ class CivicaScraper(base.DateScraper):
         fields [self._date_from_field] = date_from.strftime(self._request_date_format)
         fields [self._date_to_field] = date_to.strftime(self._request_date_format)
         scrapeutils.setup_form(self.br, self._search_form, fields)
-        self.logger.debug("ID batch form: %s" % str(self.br.form))
+        self.logger.debug("ID batch form: %s", self.br.form)
         response = scrapeutils.submit_form(self.br, self._search_submit)
         html = response.read()
 
@@ -144,7 +144,7 @@ class CivicaScraper(base.DateScraper):
             max_pages = int(page_list[-1]) # take the last value
         except:
             max_pages = 1
-        self.logger.debug("max pages: %d" % max_pages)
+        self.logger.debug("max pages: %d", max_pages)
 
         if self._page_limit and max_pages >= self._page_limit: # limit of 10 pages is the max, so if we hit it then split things up
             if not min_window:
@@ -155,7 +155,7 @@ class CivicaScraper(base.DateScraper):
                 result1.extend(result2)
                 return result1
             else:
-                self.logger.warning("Max %d pages returned on %s - probable missed data" % (self._page_limit, date_from.isoformat()))
+                self.logger.warning("Max %d pages returned on %s - probable missed data", self._page_limit, date_from.isoformat())
 
         #self.logger.debug(scrapeutils.list_forms(self.br))
         
@@ -176,7 +176,7 @@ class CivicaScraper(base.DateScraper):
             try:
                 fields = { self._next_field: 'next' }
                 scrapeutils.setup_form(self.br, self._next_form, fields)
-                self.logger.debug("Next page form: %s" % str(self.br.form))
+                self.logger.debug("Next page form: %s", self.br.form)
                 response = scrapeutils.submit_form(self.br)
                 html = response.read()
             except:
@@ -361,7 +361,7 @@ class EastbourneScraper(CivicaScraper):
         fields [self._date_from_field] = date_from.strftime(self._request_date_format)
         fields [self._date_to_field] = date_to.strftime(self._request_date_format)
         scrapeutils.setup_form(self.br, self._search_form, fields)
-        self.logger.debug("ID batch form: %s" % str(self.br.form))
+        self.logger.debug("ID batch form: %s", self.br.form)
         response = scrapeutils.submit_form(self.br, self._search_submit)
         html = response.read()
 
@@ -375,7 +375,7 @@ class EastbourneScraper(CivicaScraper):
             max_pages = int(page_list[-1]) # take the last value
         except:
             max_pages = 1
-        self.logger.debug("max pages: %d" % max_pages)
+        self.logger.debug("max pages: %d", max_pages)
 
         if self._page_limit and max_pages >= self._page_limit: # limit of 10 pages is the max, so if we hit it then split things up
             if not min_window:
@@ -386,7 +386,7 @@ class EastbourneScraper(CivicaScraper):
                 result1.extend(result2)
                 return result1
             else:
-                self.logger.warning("Max %d pages returned on %s - probable missed data" % (self._page_limit, date_from.isoformat()))
+                self.logger.warning("Max %d pages returned on %s - probable missed data", self._page_limit, date_from.isoformat())
 
         #self.logger.debug(scrapeutils.list_forms(self.br))
         
@@ -407,7 +407,7 @@ class EastbourneScraper(CivicaScraper):
             try:
                 fields = { self._next_field: 'next' }
                 scrapeutils.setup_form(self.br, self._next_form, fields)
-                self.logger.debug("Next page form: %s" % str(self.br.form))
+                self.logger.debug("Next page form: %s", self.br.form)
                 response = scrapeutils.submit_form(self.br)
                 html = response.read()
             except:
@@ -474,13 +474,13 @@ class HarrowScraper(CivicaScraper):
             for r in result['records']:
                 if r.get('uid', '') == uid and r.get('submit') and r.get('postcode'):
                     scrapeutils.setup_form(self.br, self._next_form)
-                    self.logger.debug("Multi id page form: %s" % str(self.br.form))
+                    self.logger.debug("Multi id page form: %s", self.br.form)
                     response = scrapeutils.submit_form(self.br, r['submit'])
                     return self._get_html(response)
             r = result['records'][0]
             if r.get('uid', '') == uid and r.get('submit'):
                 scrapeutils.setup_form(self.br, self._next_form)
-                self.logger.debug("Multi id page form: %s" % str(self.br.form))
+                self.logger.debug("Multi id page form: %s", self.br.form)
                 response = scrapeutils.submit_form(self.br, r['submit'])
                 return self._get_html(response)
             return None, None
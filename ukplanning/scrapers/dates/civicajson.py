@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from .. import basereq
+from multiprocessing.pool import ThreadPool
+import Queue
+import json
+
+# shared base for the Civica JSON interface (keyobject/pagedsearch) - see Northampton and SWDevon (Old)
+# the first search request returns 'TotalRows', after which every other page is known in advance, as each
+# is the same JSON request with a different row range - so the remaining pages are fetched concurrently
+# and the 'KeyObjects' are merged in page order
+# a requests session is not thread safe, so each page worker posts with its own session - which shares the cookies,
+# headers and (thread safe) connection pools of the scraper session
+
+class CivicaJSONScraper(basereq.DateReqScraper):
+    
+    _page_size_field = 'toRow' # row range in each pagedsearch request - see page_size
+    _page_size_max = 100
+    _page_workers = 4 # max number of concurrent page requests
+    _search_fields = { "fromRow": 1, "toRow": 10 } # note plus "refType" in children
+    _json_search_url = None
+    _uid_field = 'ref_no' # Items field which holds the uid
+    _key_field = 'KeyNo' # Items field which holds the key used in _applic_url
+    
+    def get_id_batch (self, date_from, date_to):
+    
+        fields = {}
+        fields.update(self._search_fields)
+        search = {}
+        search[self._date_from_field] = date_from.strftime(self._request_date_format)
+        search[self._date_to_field] = date_to.strftime(self._request_date_format)
+        fields["searchFields"] = search
+        self.logger.debug("ID batch fields: %s", str(fields))
+        
+        page_size = self.page_size
+        json_dict = self._get_json_page(fields, 1, page_size)
+        try:
+            max_recs = int(json_dict['TotalRows'])
+        except:
+            max_recs = 0
+        first = len(json_dict.get('KeyObjects') or []) if json_dict else 0
+        if 0 < first < min(page_size, max_recs): # the site caps the rows returned, so page by the cap
+            self.logger.debug("Page size %d capped to %d rows", page_size, first)
+            page_size = first
+        
+        max_pages = self._max_pages() # guard against infinite loop
+        n_pages = (max_recs + page_size - 1) / page_size
+        if n_pages > max_pages:
+            self.logger.warning("Too many payload requests - %d - probable run away loop", n_pages)
+            n_pages = max_pages
+        
+        pages = [ json_dict ]
+        if n_pages > 1:
+            workers = min(self._page_workers, n_pages - 1)
+            sessions = Queue.Queue()
+            for i in range(workers):
+                sessions.put(self._page_session())
+            def get_page(page):
+                rs = sessions.get() # never waits, as there is one session for each worker
+                try:
+                    return self._get_json_page(fields, page, page_size, rs)
+                finally:
+                    sessions.put(rs)
+            pool = ThreadPool(workers)
+            try:
+                pages.extend(pool.map(get_page, range(2, n_pages + 1)))
+            finally:
+                pool.close()
+                pool.join()
+        
+        final_result = []
+        for page_count, json_dict in enumerate(pages):
+            result = json_dict.get('KeyObjects') if json_dict else None
+            if not result:
+                self.logger.debug("Empty payload after %d pages", page_count)
+                break
+            rout = []
+            for r in result:
+                this_rec = self._get_id_record(self._field_dict(r['Items']))
+                if this_rec:
+                    rout.append(this_rec)
+            self._clean_ids(rout)
+            final_result.extend(rout)
+        
+        return final_result
+        
+    def _page_session(self):
+        """ a new session for one page worker, set up as the scraper session - the cookie jar, adapters
+        (so any cassette) and request observers are shared, but not the per request state of the session """
+        rs = basereq.HealthSession()
+        for attr in rs.__attrs__:
+            setattr(rs, attr, getattr(self.rs, attr))
+        rs.headers = self.rs.headers.copy()
+        rs.adapters = self.rs.adapters.copy()
+        rs.cassette = self.rs.cassette
+        rs.track_hosts = self.rs.track_hosts
+        rs.adaptive_timeout = self.rs.adaptive_timeout
+        rs.observers = list(self.rs.observers)
+        return rs
+        
+    def _get_json_page(self, fields, page, page_size, rs=None):
+        """ decoded JSON payload for one (1 based) page of search results, posted with session 'rs' (default the scraper session)
+        an error on any page after the first returns None, so the results stop there but the earlier pages are kept """
+        fields = dict(fields, fromRow=((page - 1) * page_size) + 1, toRow=page * page_size)
+        rs = rs or self.rs
+        try:
+            response = rs.post(self._json_search_url, json=fields, timeout=self._timeout)
+            self._get_html(response) # archives the payload
+            return response.json()
+        except Exception:
+            if page == 1:
+                raise
+            self.logger.debug("No payload for page %d", page)
+            return None
+        
+    def _get_id_record(self, rec_items):
+        """ uid and url of one search result, or None if it should be ignored """
+        if rec_items.get(self._uid_field) and rec_items.get(self._key_field):
+            return { 'uid': rec_items[self._uid_field], 'url': self._applic_url + rec_items[self._key_field] }
+        return None
+        
+    def _field_dict(self, items_list):
+        """ turns the Items array into a dict keyed on FieldName """
+        result = {}
+        for i in items_list:
+            k = i.get('FieldName')
+            v = i.get('Value')
+            if k and v is not None and v <> "":
+                result[k] = v
+        return result
+        
+    def _get_full_details(self, html, real_url, update_url=False):
+        """ Return scraped record but never update base url using the website response """
+        self.logger.debug("Real url: %s", real_url)
+        return self._get_details(html, real_url)
+        
+    def _get_details(self, html, this_url):
+        """ Scrapes detailed information for one record given a JSON string (html) and url 
+        - this is an optional hook to allow e.g. data from multiple linked pages to be merged
+        OR to interpolate a JSON decoder """
+        try:
+            #self.logger.debug("JSON to scrape: %s", html)
+            json_dict = json.loads(html.strip())
+            if isinstance(json_dict, list):
+                json_dict = json_dict[0]
+            elif json_dict['TotalRows'] == 1:
+                json_dict = json_dict['KeyObjects'][0]
+            json_dict['Record'] = self._field_dict(json_dict['Items'])
+        except:
+            json_dict = {}
+        return self._get_detail_json(json_dict, this_url)
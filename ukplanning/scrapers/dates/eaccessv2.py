@@ -172,7 +172,7 @@ class CarmarthenshireScraper(EAccessv2Scraper):
             max_recs = 0
 
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
@@ -193,7 +193,7 @@ class CarmarthenshireScraper(EAccessv2Scraper):
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
        
         return final_result
 
@@ -251,7 +251,7 @@ class CarmarthenshireScraper(EAccessv2Scraper):
         #self.logger.debug("Start html: %s", response.read())
 
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         n_recs = 0
 
         for tab in self._result_tabs:
@@ -315,6 +315,6 @@ class CarmarthenshireScraper(EAccessv2Scraper):
                     break
                     
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
        
         return final_result"""
@@ -106,7 +106,7 @@ class FastwebScraper(base.DateScraper):
         response = scrapeutils.submit_form(self.br)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -251,7 +251,7 @@ class ReadingScraper(FastwebScraper): # note end date is exclusive
         response = scrapeutils.submit_form(self.br)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
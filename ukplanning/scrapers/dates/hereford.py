@@ -111,7 +111,7 @@ class HerefordScraper(base.DateScraper):
             except:
                 max_recs = 0
         
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
@@ -38,6 +38,8 @@ class IdoxScraper(base.DateScraper):
     _date_to_field = 'date(applicationReceivedEnd)'
     _search_form = 'searchCriteriaForm'
     _ref_field = 'searchCriteria.reference'
+    _page_size_field = 'searchCriteria.resultsPerPage' # hidden control is added to the search form if not present
+    _page_size_max = 100
     _detail_page = 'applicationDetails.do'
     _scrape_ids = """
     <ul id="searchresults">
@@ -47,6 +49,16 @@ class IdoxScraper(base.DateScraper):
     </li> *}
     </ul>
     """
+    _scrape_listing = """
+    <ul id="searchresults">
+    {* <li>
+    <a href="{{ [records].url|abs }}"> {{ [records].description }} </a>
+    <p class="address"> {{ [records].address }} </p>
+    <p class="metaInfo"> No: {{ [records].uid }} <span /> Received: {{ [records].date_received }} <span />
+    Validated: {{ [records].date_validated }} <span /> Status: {{ [records].status }} </p>
+    </li> *}
+    </ul>
+    """
     _scrape_one_id = """
     <a id="subtab_summary" href="{{ url|abs }}" />
     <th> Reference </th> <td> {{ uid }} </td> </table>
@@ -73,6 +85,8 @@ class IdoxScraper(base.DateScraper):
     """
     # min field list used in testing only
     _min_fields = [ 'reference', 'address', 'description', 'date_validated', 'application_type' ]
+    # fields from the results listing which are enough for a listing only update
+    _listing_fields = [ 'address', 'description', 'date_validated' ]
     # other optional parameters on a page
     _scrape_optional_data = [
     '<a id="subtab_summary" href="{{ url|abs }}" />',
@@ -140,21 +154,24 @@ class IdoxScraper(base.DateScraper):
         fields = {}
         fields[self._date_from_field] = date_from.strftime(self._request_date_format)
         fields[self._date_to_field] = date_to.strftime(self._request_date_format)
+        fields.update(self._page_size_fields())
         scrapeutils.setup_form(self.br, self._search_form, fields)
         self.logger.debug("ID batch form: %s", str(self.br.form))
         response = scrapeutils.submit_form(self.br)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
-            result = scrapemark.scrape(self._scrape_ids, html, url)
+            result = self._scrape_id_list(html, url)
             if result and result.get('records'):
                 page_count += 1
                 self._clean_ids(result['records'])
                 final_result.extend(result['records'])
+                if self._page_seen(result['records']):
+                    break
             elif not final_result: # is it a single record?
                 single_result = scrapemark.scrape(self._scrape_one_id, html, url)
                 if single_result:
@@ -172,7 +189,7 @@ class IdoxScraper(base.DateScraper):
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
        
         return final_result
 
@@ -109,23 +109,26 @@ class CarlisleScraper(IdoxEndExcScraper):
         fields = {}
         fields[self._date_from_field] = date_from.strftime(self._request_date_format)
         fields[self._date_to_field] = new_date_to.strftime(self._request_date_format)
+        fields.update(self._page_size_fields())
         scrapeutils.setup_form(self.br, self._search_form, fields)
         self.logger.debug("ID batch form: %s", str(self.br.form))
         response = scrapeutils.submit_form(self.br)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
-            result = scrapemark.scrape(self._scrape_ids, html, url)
+            result = self._scrape_id_list(html, url)
             if result and result.get('records'):
                 page_count += 1
                 self._clean_ids(result['records'])
                 for res in result['records']:
                     if res.get('uid'): # one uid on 1 dec 2015 is empty
                         final_result.append(res)
+                if self._page_seen(result['records']):
+                    break
             elif not final_result: # is it a single record?
                 single_result = scrapemark.scrape(self._scrape_one_id, html, url)
                 if single_result:
@@ -143,7 +146,7 @@ class CarlisleScraper(IdoxEndExcScraper):
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
        
         return final_result
         
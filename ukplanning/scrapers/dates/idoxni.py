@@ -46,17 +46,18 @@ class IdoxNIScraper(idox.IdoxScraper):
             fields = { self._ref_field: case }
             fields[self._date_from_field] = date_from.strftime(self._request_date_format)
             fields[self._date_to_field] = date_to.strftime(self._request_date_format)
+            fields.update(self._page_size_fields())
             scrapeutils.setup_form(self.br, self._search_form, fields)
             self.logger.debug("ID batch form: %s", str(self.br.form))
             response = scrapeutils.submit_form(self.br)
             
             page_count = 0
-            max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+            max_pages = self._max_pages() # guard against infinite loop
             while response and page_count < max_pages:
                 html = response.read()
                 url = response.geturl()
                 #self.logger.debug("ID batch page html: %s", html)
-                result = scrapemark.scrape(self._scrape_ids, html, url)
+                result = self._scrape_id_list(html, url)
                 if result and result.get('records'):
                     page_count += 1
                     self._clean_ids(result['records'])
@@ -78,7 +79,7 @@ class IdoxNIScraper(idox.IdoxScraper):
                     break
                     
             if page_count >= max_pages:
-                self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+                self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
                 
             final_result.extend(interim_result)
             
@@ -20,7 +20,7 @@ try:
     from ukplanning import scrapemark
 except ImportError:
     import scrapemark
-from .. import basereq
+from . import civicajson
 try:
     from ukplanning import scrapeutils
 except ImportError:
@@ -30,8 +30,9 @@ import json
 import requests
 
 # for other JSON based scrapers - see AmberValley, Broxtowe, SWDevon (Old), NorthLincs and Eastleigh
+# note id batches are gathered by the shared Civica JSON base - see civicajson.py
 
-class NorthamptonScraper(basereq.DateReqScraper):
+class NorthamptonScraper(civicajson.CivicaJSONScraper):
     
     # note the new version uses the 'requests' library and JSON requests/responses
     
@@ -105,75 +106,6 @@ class NorthamptonScraper(basereq.DateReqScraper):
         { 'from': '13/09/2012', 'to': '19/09/2012', 'len': 29 }, 
         { 'from': '14/08/2012', 'to': '14/08/2012', 'len': 11 } ]
     
-    def get_id_batch (self, date_from, date_to):
-    
-        final_result = []
-        
-        fields = {}
-        fields.update(self._search_fields)
-        search = {}
-        search[self._date_from_field] = date_from.strftime(self._request_date_format)
-        search[self._date_to_field] = date_to.strftime(self._request_date_format)
-        fields["searchFields"] = search
-        self.logger.debug("ID batch fields: %s", str(fields))
-        data = json.dumps(fields)
-        response = self.rs.post(self._json_search_url, data=data, timeout=self._timeout, headers=self._headers)
-        html, url = self._get_html(response)
-        json_dict = response.json()
-        
-        try:
-            max_recs = int(json_dict['TotalRows'])
-        except:
-            max_recs = 0
-        
-        page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
-        while json_dict and len(final_result) < max_recs and page_count < max_pages:
-            #self.logger.debug("JSON payload: %s" % str(json_dict))
-            result = json_dict.get('KeyObjects')
-            if result:
-                page_count += 1
-                rout = []
-                for r in result:
-                    this_rec = {}
-                    rec_items = self._field_dict(r['Items'])
-                    if rec_items.get('ref_no') and rec_items.get('KeyNo'):
-                        this_rec['uid'] = rec_items['ref_no']
-                        this_rec['url'] = self._applic_url + rec_items['KeyNo']
-                        rout.append(this_rec)
-                self._clean_ids(rout)
-                final_result.extend(rout)
-            else:
-                self.logger.debug("Empty payload after %d pages", page_count)
-                break
-            if len(final_result) >= max_recs: break
-            try:
-                fields ['fromRow'] = (page_count * 10) + 1
-                fields ['toRow'] = (page_count * 10) + 10
-                self.logger.debug("ID next fields: %s", str(fields))
-                data = json.dumps(fields)
-                response = self.rs.post(self._json_search_url, data=data, timeout=self._timeout, headers=self._headers)
-                html, url = self._get_html(response)
-                json_dict = response.json()
-            except: # normal failure to find next page form at end of page sequence here
-                self.logger.debug("No next payload after %d pages", page_count)
-                break
-        
-        if page_count >= max_pages:
-            self.logger.warning("Too many payload requests - %d - probable run away loop" % page_count)
-        
-        return final_result
-        
-    def _field_dict(self, items_list):
-        """ turns the Items array into a dict keyed on FieldName """
-        result = {}
-        for i in items_list:
-            k = i.get('FieldName')
-            v = i.get('Value')
-            if k and v is not None and v <> "":
-                result[k] = v
-        return result
-     
     def get_html_from_uid(self, uid):
         """ note returns JSON string not HTML
         in this case the the JSON is a dict payload with TotalRows of 1 and single record in a KeyObjects list
@@ -199,26 +131,3 @@ class NorthamptonScraper(basereq.DateReqScraper):
         else:
             response = self.rs.get(url, timeout=self._timeout)
         return self._get_html(response)
-        
-    def _get_full_details(self, html, real_url, update_url=False):
-        """ Return scraped record but never update base url using the website response """
-        self.logger.debug("Real url: %s", real_url)
-        return self._get_details(html, real_url)
-        
-    def _get_details(self, html, this_url):
-        """ Scrapes detailed information for one record given a JSON string (html) and url 
-        - this is an optional hook to allow e.g. data from multiple linked pages to be merged
-        OR to interpolate a JSON decoder """
-        try:
-            #self.logger.debug("JSON to scrape: %s", html)
-            json_dict = json.loads(html.strip())
-            if isinstance(json_dict, list):
-                json_dict = json_dict[0]
-            elif json_dict['TotalRows'] == 1:
-                json_dict = json_dict['KeyObjects'][0]
-            json_dict['Record'] = self._field_dict(json_dict['Items'])
-        except:
-            json_dict = {}
-        return self._get_detail_json(json_dict, this_url)
-
-
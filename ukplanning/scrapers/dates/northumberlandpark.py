@@ -127,7 +127,7 @@ class NorthumberlandParkScraper(base.DateScraper):
             num_recs = 0
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages and (len(final_result) < num_recs or num_recs == 0):
             url = response.geturl()
             #self.logger.debug("Batch html: %s" % html)
@@ -118,11 +118,11 @@ class OcellaScraper(base.DateScraper):
         fields[self._form_name + self._date_from_field_suffix] = date_from.strftime(self._request_date_format)
         fields[self._form_name + self._date_to_field_suffix] = date_to.strftime(self._request_date_format)
         scrapeutils.setup_form(self.br, self._search_form, fields)
-        self.logger.debug("ID batch form: %s" % str(self.br.form))
+        self.logger.debug("ID batch form: %s", self.br.form)
         response = scrapeutils.submit_form(self.br)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -137,14 +137,14 @@ class OcellaScraper(base.DateScraper):
                 break
             try:
                 scrapeutils.setup_form(self.br, self._next_form, self._next_page_fields)
-                self.logger.debug("Next form: %s" % str(self.br.form))
+                self.logger.debug("Next form: %s", self.br.form)
                 response = scrapeutils.submit_form(self.br)
             except: # normal failure to find next page form at end of page sequence here
                 self.logger.debug("No next form after %d pages", page_count)
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
                 
         return final_result
 
@@ -381,7 +381,7 @@ class Ocella2Scraper(base.DateScraper): # alternative form - inherits directly f
         fields[self._date_from_field] = date_from.strftime(self._request_date_format)
         fields[self._date_to_field] = date_to.strftime(self._request_date_format)
         scrapeutils.setup_form(self.br, self._search_form, fields)
-        self.logger.debug("ID batch form: %s" % str(self.br.form))
+        self.logger.debug("ID batch form: %s", self.br.form)
         response = scrapeutils.submit_form(self.br)
         final_result = []
         
@@ -142,7 +142,7 @@ class PlanningExplorerScraper(base.DateScraper):
         response = scrapeutils.submit_form(self.br, self._search_submit)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -153,6 +153,8 @@ class PlanningExplorerScraper(base.DateScraper):
                 page_count += 1
                 self._clean_ids(result['records'])
                 final_result.extend(result['records'])
+                if self._page_seen(result['records']):
+                    break
             else:
                 self.logger.debug("Empty result after %d pages", page_count)
                 break
@@ -168,7 +170,7 @@ class PlanningExplorerScraper(base.DateScraper):
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
                 
         return final_result
         
@@ -509,7 +511,7 @@ class LiverpoolScraper(PlanningExplorerScraper): # solves problem with expired r
             expired = scrapemark.scrape(self._scrape_expired, sub_html)
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             url = response.geturl()
             ##self.logger.debug("ID batch page html: %s", sub_html)
@@ -518,6 +520,8 @@ class LiverpoolScraper(PlanningExplorerScraper): # solves problem with expired r
                 page_count += 1
                 self._clean_ids(result['records'])
                 final_result.extend(result['records'])
+                if self._page_seen(result['records']):
+                    break
             else:
                 self.logger.debug("Empty result after %d pages", page_count)
                 break
@@ -540,7 +544,7 @@ class LiverpoolScraper(PlanningExplorerScraper): # solves problem with expired r
                 break
         
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
         
         return final_result
         
@@ -121,7 +121,7 @@ class PublicAccessScraper(base.DateScraper):
         self.logger.debug("max_recs: %d", max_recs)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
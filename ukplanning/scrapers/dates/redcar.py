@@ -114,7 +114,7 @@ class RedcarScraper(base.DateScraper):
             max_recs = 0 # note max recs is in the footer which is omitted if only one page of results
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("Batch html: %s" % html)
@@ -102,7 +102,7 @@ class SouthSomersetScraper(base.DateScraper):
         
         finished = False
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages and not finished:
             html = response.read()
             url = response.geturl()
@@ -118,7 +118,7 @@ class SouthDerbyshireScraper(base.DateScraper):
             page_list = result['max_pages'].split()
             max_pages = int(page_list[-1]) # can be a space separated list, so take the last value
         except:
-            max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+            max_pages = self._max_pages() # guard against infinite loop
         self.logger.debug("Max pages: %s", str(max_pages))
         
         page_count = 0
@@ -125,7 +125,7 @@ class SurreyHeathScraper(base.DateScraper):
         self.logger.debug("URL: %s", url)
         response = self.br.open(url)
         
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -20,7 +20,7 @@ try:
 except ImportError:
     import scrapemark
 from .. import base
-from .. import basereq
+from . import civicajson
 try:
     from ukplanning import scrapeutils
 except ImportError:
@@ -36,7 +36,7 @@ from datetime import timedelta, datetime
 # Next old system was JSON based and returns records for West Devon and South Hams combined (see 'UnitCode' field to separate them)
 # Current system is a dates based scraper for both councils on their combined planning website - cannot distinguish between authorities
         
-class SWDevonOldScraper(basereq.DateReqScraper):
+class SWDevonOldScraper(civicajson.CivicaJSONScraper):
     
     # note the new version uses the 'requests' library and JSON requests/responses
     
@@ -47,6 +47,7 @@ class SWDevonOldScraper(basereq.DateReqScraper):
     _search_fields = { "refType": "APPPlanCase", "fromRow": 1, "toRow": 10 }
     _date_from_field = 'ReceivedDateFrom'
     _date_to_field = 'ReceivedDateTo'
+    _uid_field = 'LARef'
     
     # specifies JSON dict (sub) element encompassing all fields to be gathered
     _scrape_data_block = [ 'Record' ]
@@ -102,76 +103,17 @@ class SWDevonOldScraper(basereq.DateReqScraper):
     }
     
     def get_id_batch (self, date_from, date_to):
-
         # does not like single day requests - returns all 60k results
         if date_from == date_to: # note min 2 days, rejects same day requests
             date_to = date_to + timedelta(days=1) # increment end date by one day
-            
-        final_result = []
+        return super(SWDevonOldScraper, self).get_id_batch(date_from, date_to)
         
-        fields = {}
-        fields.update(self._search_fields)
-        search = {}
-        search[self._date_from_field] = date_from.strftime(self._request_date_format)
-        search[self._date_to_field] = date_to.strftime(self._request_date_format)
-        fields["searchFields"] = search
-        self.logger.debug("ID batch fields: %s", str(fields))
-        response = self.rs.post(self._json_search_url, json=fields, timeout=self._timeout)
+    def _get_id_record(self, rec_items):
+        """ results are for both councils, so only those with a matching UnitCode are kept """
+        if rec_items.get('UnitCode') and rec_items['UnitCode'].startswith(self._unit_name):
+            return super(SWDevonOldScraper, self)._get_id_record(rec_items)
+        return None
         
-        json_dict = response.json()
-        #print json_dict
-        try:
-            max_recs = int(json_dict['TotalRows'])
-        except:
-            max_recs = 0
-        
-        #print max_recs
-        page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
-        while json_dict and len(final_result) < max_recs and page_count < max_pages:
-            #self.logger.debug("JSON payload: %s" % str(json_dict))
-            result = json_dict.get('KeyObjects')
-            if result:
-                page_count += 1
-                rout = []
-                for r in result:
-                    this_rec = {}
-                    rec_items = self._field_dict(r['Items'])
-                    if rec_items.get('LARef') and rec_items.get('KeyNo') and rec_items.get('UnitCode') and rec_items['UnitCode'].startswith(self._unit_name):
-                        this_rec['uid'] = rec_items['LARef']
-                        this_rec['url'] = self._applic_url + rec_items['KeyNo']
-                        rout.append(this_rec)
-                self._clean_ids(rout)
-                final_result.extend(rout)
-            else:
-                self.logger.debug("Empty payload after %d pages", page_count)
-                break
-            if len(final_result) >= max_recs: break
-            try:
-                fields ['fromRow'] = (page_count * 10) + 1
-                fields ['toRow'] = (page_count * 10) + 10
-                self.logger.debug("ID next fields: %s", str(fields))
-                response = self.rs.post(self._json_search_url, json=fields, timeout=self._timeout)
-                json_dict = response.json()
-            except: # normal failure to find next page form at end of page sequence here
-                self.logger.debug("No next payload after %d pages", page_count)
-                break
-        
-        if page_count >= max_pages:
-            self.logger.warning("Too many payload requests - %d - probable run away loop" % page_count)
-        
-        return final_result
-        
-    def _field_dict(self, items_list):
-        """ turns the Items array into a dict keyed on FieldName """
-        result = {}
-        for i in items_list:
-            k = i.get('FieldName')
-            v = i.get('Value')
-            if k and v is not None and v <> "":
-                result[k] = v
-        return result
-     
     def get_html_from_uid(self, uid):
         """ note returns JSON string not HTML
         in this case the the JSON is a dict payload with TotalRows of 1 and single record in a KeyObjects list
@@ -196,27 +138,6 @@ class SWDevonOldScraper(basereq.DateReqScraper):
             response = self.rs.get(url, timeout=self._timeout)
         return self._get_html(response)
         
-    def _get_full_details(self, html, real_url, update_url=False):
-        """ Return scraped record but never update base url using the website response """
-        self.logger.debug("Real url: %s", real_url)
-        return self._get_details(html, real_url)
-        
-    def _get_details(self, html, this_url):
-        """ Scrapes detailed information for one record given a JSON string (html) and url 
-        - this is an optional hook to allow e.g. data from multiple linked pages to be merged
-        OR to interpolate a JSON decoder """
-        try:
-            #self.logger.debug("JSON to scrape: %s", html)
-            json_dict = json.loads(html.strip())
-            if isinstance(json_dict, list):
-                json_dict = json_dict[0]
-            elif json_dict['TotalRows'] == 1:
-                json_dict = json_dict['KeyObjects'][0]
-            json_dict['Record'] = self._field_dict(json_dict['Items'])
-        except:
-            json_dict = {}
-        return self._get_detail_json(json_dict, this_url)
-            
 class SouthHamsOldScraper(SWDevonOldScraper): 
 
     _authority_name = 'SouthHamsOld'
@@ -352,7 +273,7 @@ class WestDevonOldScraper(SWDevonOldScraper):
             max_recs = 0
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("Batch html: %s" % html)
@@ -523,7 +444,7 @@ class SouthWestDevonScraper(base.DateScraper):
             max_recs = 0
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.geturl()
             #self.logger.debug("Batch html: %s" % html)
@@ -95,13 +95,15 @@ class SwiftLGScraper(base.DateScraper):
                 pass
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             result = scrapemark.scrape(self._scrape_ids, sub_html, url)
             if result and result.get('records'):
                 page_count += 1
                 self._clean_ids(result['records'])
                 final_result.extend(result['records'])
+                if self._page_seen(result['records']):
+                    break
             else:
                 self.logger.debug("Empty result after %d pages", page_count)
                 break
@@ -122,7 +124,7 @@ class SwiftLGScraper(base.DateScraper):
                 break
                 
         if page_count >= max_pages:
-            self.logger.warning("Too many page requests - %d - probable run away loop" % page_count)
+            self.logger.warning("Too many page requests - %d - probable run away loop", page_count)
                
         return final_result
 
@@ -120,7 +120,7 @@ class TamesideScraper(base.DateScraper):
         response = self.br.open(self._search_url, urllib.urlencode(fields))
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             url = response.geturl()
             html = response.read()
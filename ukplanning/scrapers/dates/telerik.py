@@ -112,10 +112,13 @@ class TelerikScraper(base.DateScraper):
         self.logger.debug("ID batch form: %s", str(self.br.form))
         response = scrapeutils.submit_form(self.br, self._submit_control)
         
-        html = response.read()
+        html, url = self._get_html(response)
         #self.logger.debug("ID batch page html: %s", html)
+        postback = scrapeutils.Postback(self.br, fields=fields, get_html=self._get_html,
+            form=self._search_form)
+        postback.update(html, url, [ self._submit_next ])
         
-        runaway_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        runaway_pages = self._max_pages() # guard against infinite loop
         try:
             result = scrapemark.scrape(self._scrape_max_pages, html)
             max_pages = int(result['max_pages'])
@@ -124,7 +127,6 @@ class TelerikScraper(base.DateScraper):
             
         page_count = 0
         while html and page_count < max_pages:
-            url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
             result = scrapemark.scrape(self._scrape_ids, html, url)
             if result and result.get('records'):
@@ -135,12 +137,11 @@ class TelerikScraper(base.DateScraper):
                 self.logger.debug("Empty result after %d pages", page_count)
                 break
             if page_count >= max_pages: break
-            try:
-                scrapeutils.setup_form(self.br, self._search_form)
-                self.logger.debug("ID next form: %s", str(self.br.form))
-                response = scrapeutils.submit_form(self.br, self._submit_next)
-                html = response.read()
-            except: # failure to find next page link at end of page sequence here
+            try: # postback of the next button, without re-parsing the form and its viewstate
+                next_fields = { self._submit_next: postback.state[self._submit_next] }
+                self.logger.debug("ID next fields: %s", str(next_fields))
+                html, url = postback.post(fields=next_fields, names=[ self._submit_next ])
+            except: # failure to find next page button at end of page sequence here
                 self.logger.debug("No next form after %d pages", page_count)
                 break
                 
@@ -104,7 +104,7 @@ class WealdenScraper(base.DateScraper):
         response = scrapeutils.submit_form(self.br, self._search_submit)
         html = response.read()
         
-        runaway_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        runaway_pages = self._max_pages() # guard against infinite loop
         try:
             result = scrapemark.scrape(self._scrape_max_pages, html)
             max_pages = int(result['max_pages'])
@@ -125,7 +125,7 @@ class YorkshireDalesScraper(base.DateScraper):
         response = self.br.open(url)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -153,14 +153,12 @@ class YorkshireDalesScraper(base.DateScraper):
         url =  self._applic_url + urllib.quote_plus(uid)
         return self.get_html_from_url(url)
         
-    def _get_html(self, response):
-        """ Return HTML and URL given the website response """
-        html = response.read()
+    def _adjust_html(self, html):
+        """ Hook to adjust application html if necessary before scraping - removes bad dates """
         #self.logger.debug("Original html: %s" % html)
         html = html.replace('>1/1/1970<', '><')
         html = html.replace('>01/01/1970<', '><') # kludge bad date fix
-        url = response.geturl()
-        return html, url
+        return html
 
         
 
@@ -170,7 +170,7 @@ class HampshireScraper(base.ListScraper):
             max_recs = 0
             
         page_count = 0
-        max_pages = (4 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = (4 * self.min_id_goal / self._page_size) + 20 # guard against infinite loop
         if not final_page:
             end_page = max_pages
         else:
@@ -234,15 +234,15 @@ class HampshireScraper(base.ListScraper):
         # number of records from districts on each 'page'
         if not self._d_maxrecs:
             mx = self.max_sequence
-        rmax = page * 10
-        rmin = rmax - 9
+        rmax = page * self._page_size
+        rmin = rmax - (self._page_size - 1)
         on_all_pages = 0
         for d, n in self._d_maxrecs.items():
             on_this_page = 0
             if rmin <= n and rmax > n: # on end page find remainder
-                on_this_page = n % 10
+                on_this_page = n % self._page_size
             elif rmax <= n: # all other pages within range
-                on_this_page = 10
+                on_this_page = self._page_size
             if district and d == district:
                 return on_this_page
             on_all_pages += on_this_page
@@ -102,7 +102,7 @@ class ColchesterScraper(base.PeriodScraper): # was WeeklyWAM scraper type, now o
         response = self.br.open(self._search_url, urllib.urlencode(fields))
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -210,7 +210,7 @@ class ColchesterScraper(base.PeriodScraper): # was WeeklyWAM scraper type, now o
             return [], None, None
             
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
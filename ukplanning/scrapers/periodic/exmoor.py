@@ -98,7 +98,7 @@ class ExmoorScraper(base.PeriodScraper):
         response = self.br.open(url)
 
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html = response.read()
             url = response.geturl()
@@ -143,7 +143,7 @@ class ExmoorScraper(base.PeriodScraper):
                     text = myutils.GAPS_REGEX.sub('', v) # strip any spaces in urls
                     v = scrapeutils.JSESS_REGEX.sub('', text) # strip any jsessionid parameter
                 elif k.endswith('_date') or k.startswith('date_'):
-                    dt = myutils.get_dt(v, self._response_date_format)
+                    dt = self.date_parser.get_dt(v, self._response_date_format)
                     if not dt:
                         v = None
                     else:
@@ -96,7 +96,7 @@ class IsleOfManScraper(base.PeriodScraper):
             response = self.br.open(rurl + '?' + urllib.urlencode(fields))
     
             page_count = 0
-            max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+            max_pages = self._max_pages() # guard against infinite loop
             while response and page_count < max_pages:
                 html = response.read()
                 url = response.geturl()
@@ -157,7 +157,7 @@ import urllib
             max_recs = self.page_size
 
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages and len(final_result) < max_recs:
             url = response.geturl()
             #self.logger.debug("ID batch page html: %s", html)
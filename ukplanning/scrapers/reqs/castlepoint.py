@@ -62,7 +62,7 @@ class CastlePointScraper(IdoxReqScraper):
         response = self.rs.post(rurl, data=fields, verify=False, timeout=self._timeout)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html, url = self._get_html(response)
             #self.logger.debug("ID batch page html: %s", html)
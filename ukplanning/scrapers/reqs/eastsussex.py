@@ -143,7 +143,7 @@ class EastSussexScraper(basereq.DateReqScraper):
             max_recs = 1
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             url = response.url
             #self.logger.debug("ID batch page html: %s", html)
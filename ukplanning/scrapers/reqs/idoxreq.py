@@ -45,15 +45,16 @@ class IdoxReqScraper(basereq.DateReqScraper, idox.IdoxScraper):
         fields.update(self._search_fields)
         fields[self._date_from_field] = date_from.strftime(self._request_date_format)
         fields[self._date_to_field] = date_to.strftime(self._request_date_format)
+        fields.update(self._page_size_fields())
         rurl = urlparse.urljoin(self._search_url, self._results_page)
         response = self.rs.post(rurl, data=fields, timeout=self._timeout)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and page_count < max_pages:
             html, url = self._get_html(response)
             #self.logger.debug("ID batch page html: %s", html)
-            result = scrapemark.scrape(self._scrape_ids, html, url)
+            result = self._scrape_id_list(html, url)
             if result and result.get('records'):
                 page_count += 1
                 self._clean_ids(result['records'])
@@ -173,7 +173,7 @@ class RibbleValleyScraper(basereq.ListReqScraper):
             max_recs = 0
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         while response and len(final_result) < max_recs and page_count < max_pages:
             #url = response.geturl()
             url = response.url
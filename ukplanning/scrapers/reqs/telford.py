@@ -68,17 +68,6 @@ class TelfordScraper(basereq.DateReqScraper):
             'ctl00$ContentPlaceHolder1$txtDCApplicant': ''
     }
     _next_target = 'ctl00$ContentPlaceHolder1$gvResults$ctl01$lbPagerTopNext'
-    _scrape_state1 = """
-        <input name="__VIEWSTATE" value="{{ __VIEWSTATE }}" />
-        <input name="__VIEWSTATEGENERATOR" value="{{ __VIEWSTATEGENERATOR }}" />
-        <input name="__PREVIOUSPAGE" value="{{ __PREVIOUSPAGE }}" />
-        <input name="__EVENTVALIDATION" value="{{ __EVENTVALIDATION }}" />   
-    """
-    _scrape_state2 = """
-        <input name="__VIEWSTATE" value="{{ __VIEWSTATE }}" />
-        <input name="__VIEWSTATEGENERATOR" value="{{ __VIEWSTATEGENERATOR }}" />
-        <input name="__EVENTVALIDATION" value="{{ __EVENTVALIDATION }}" />   
-    """
     _scrape_ids = """
     <table> <tr /> <tr />
         {* <tr>
@@ -157,37 +146,25 @@ class TelfordScraper(basereq.DateReqScraper):
         #self.logger.debug("Start html: %s", html)
         
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 10) + 20 # guard against infinite loop
+        max_pages = self._max_pages() # guard against infinite loop
         n_recs = 0
+        postback = scrapeutils.Postback(self.rs, self._action_url, self._search_fields, self._get_html,
+            verify=False, timeout=self._timeout)
+        postback.update(html)
                  
         for tab in self._result_tabs:
             
             if not tab['target']:
-                state_result = scrapemark.scrape(self._scrape_state1, html)
                 fields = {}
-                fields.update(self._search_fields)
                 fields[self._search_submit] = 'Search'
-                fields['__EVENTTARGET'] = ''
-                if state_result:
-                    for k,v in state_result.items():
-                        fields[k] = v
                 fields[self._date_from_field] = date_from.strftime(self._request_date_format)
                 fields[self._date_to_field] = date_to.strftime(self._request_date_format)
                 self.logger.debug("Batch form fields: %s", str(fields))
-                response = self.rs.post(self._action_url, verify=False, data=fields, timeout=self._timeout)
-                html, url = self._get_html(response)
+                html, url = postback.post(fields=fields)
                 #self.logger.debug("ID batch page html: %s", html)
             else:
-                state_result = scrapemark.scrape(self._scrape_state2, html)
-                fields = {}
-                fields.update(self._search_fields)
-                fields['__EVENTTARGET'] = tab['target']
-                if state_result:
-                    for k,v in state_result.items():
-                        fields[k] = v
-                self.logger.debug("Tab form fields: %s", str(fields))
-                response = self.rs.post(self._action_url, verify=False, data=fields, timeout=self._timeout)
-                html, url = self._get_html(response)
+                self.logger.debug("Tab target: %s", tab['target'])
+                html, url = postback.post(tab['target'])
                 #self.logger.debug("ID next tab html: %s", html)
             
             try:
@@ -197,7 +174,7 @@ class TelfordScraper(basereq.DateReqScraper):
                 max_recs = 0
 
             n_recs += max_recs
-            while response and len(final_result) < n_recs and page_count < max_pages:
+            while html and len(final_result) < n_recs and page_count < max_pages:
                 result = scrapemark.scrape(self._scrape_ids, html, url)
                 if result and result.get('records'):
                     page_count += 1
@@ -211,16 +188,8 @@ class TelfordScraper(basereq.DateReqScraper):
                     break
                 if len(final_result) >= n_recs: break
                 try:
-                    state_result = scrapemark.scrape(self._scrape_state2, html)
-                    fields = {}
-                    fields.update(self._search_fields)
-                    fields['__EVENTTARGET'] = self._next_target
-                    if state_result:
-                        for k,v in state_result.items():
-                            fields[k] = v
-                    self.logger.debug("Next form fields: %s", str(fields))
-                    response = self.rs.post(self._action_url, verify=False, data=fields, timeout=self._timeout)
-                    html, url = self._get_html(response)
+                    self.logger.debug("Next target: %s", self._next_target)
+                    html, url = postback.post(self._next_target)
                 except: # normal failure to find next page link at end of page sequence here
                     self.logger.debug("No next form after %d pages", page_count)
                     break
@@ -49,6 +49,7 @@ class WokinghamScraper(basereq.PeriodReqScraper):
     
     _authority_name = 'Wokingham'
     _period_type = 'Month'
+    _page_size = 5
     _date_field = { 'month': 'Month', 'year': 'Year' }
     _query_fields = {  'pgid': '1813', 'tid': '147' }
     _scrape_next_link = """
@@ -114,7 +115,7 @@ class WokinghamScraper(basereq.PeriodReqScraper):
         fields [self._date_field['year']] = str(this_date.year)
 
         page_count = 0
-        max_pages = (2 * self.min_id_goal / 5) + 20 # guard against infinite loop  
+        max_pages = self._max_pages() # guard against infinite loop
         for i in range(1, 3):
             fields['Status'] = str(i)
             #response = self.br.open(self._results_url + '?' + urllib.urlencode(fields))
@@ -17,15 +17,139 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 import unittest
-from datetime import timedelta
+import mechanize
+import requests
+import tempfile
+import shutil
+import threading
+import json
+import time
+import os
+from datetime import date, timedelta
 try:
     from ukplanning import myutils
 except ImportError:
     import myutils
+try:
+    from ukplanning import scrapeutils
+except ImportError:
+    import scrapeutils
+try:
+    from ukplanning import archive
+except ImportError:
+    import archive
+try:
+    from ukplanning import seen
+except ImportError:
+    import seen
+try:
+    from ukplanning import checkpoint
+except ImportError:
+    import checkpoint
+try:
+    from ukplanning import sinks
+except ImportError:
+    import sinks
+try:
+    from ukplanning import geo
+except ImportError:
+    import geo
+try: # top level first, so the mock scrapers subclass the same scraper classes as test.py
+    import mockserver, bench, multirun, reextract
+except ImportError:
+    from ukplanning import mockserver, bench, multirun, reextract
+try:
+    from ukplanning import refresh
+except ImportError:
+    import refresh
+try:
+    from ukplanning import metrics
+except ImportError:
+    import metrics
+import basereq
+from BeautifulSoup import BeautifulSoup
 import logging
 
 logger = logging.getLogger(__name__)
 
+# text field values with html tags, entities and spacing to check text cleaning against
+text_corpus = [
+    u'  &amp; <div></div> &eacute; ', u'plain text', 'byte string', u'a &amp b', u'AT&T', u'R&D;', u'&foo; y',
+    u'&#233;&#xe9;&#XE9;', u'&nbsp;x\xa0y', u'a < b', u'a > b', u'<p>A</p><p>B</p>', u'x &#39; y', u'&apos;',
+    u'&quot;x&quot;', u'&lt;b&gt;bold&lt;/b&gt;', u'&amp;amp;', u'&AMP; &Eacute; &pound;5', u'x&#;y', u'\t\r\n',
+    u'&#9;', u'&#128; &#150; &#8217;', u'line 1\r\nline 2', u'<br/>&nbsp;<br/>', u'Caf\xe9 &amp; Bar',
+    'Caf\xc3\xa9 &amp; Bar', 'smart \x93quotes\x94', u'<a href="x">link</a> &gt; next', u'50% &amp; 100%',
+    u'Land at 1&2 High St', u'A&amp;B Ltd;  C &amp D', u'  &#65;&#066; ', u'<!-- comment --> text',
+    u'5 > 3 &amp;amp;', 'Caf\xc3\xa9 &amp;amp; Bar', u'a < b &amp;lt;x&amp;gt;',
+]
+
+# date field values in the variety of formats found on planning sites to check date parsing against get_dt
+date_corpus = [
+    '03/04/2012', '3/4/2012', ' 03/04/2012 ', '03-04-2012', '03.04.2012', '2012-04-03', '2012/04/03', '03/04/12', '25/04/12',
+    '3 Apr 2012', '03 April 2012', 'Tue 03 Apr 2012', 'Tuesday 3 April 2012', 'April 3, 2012', '03/04/2012 12:30',
+    '2012-04-03T10:00:00', '2012-04-03 10:00:00', '23rd March 1980', '13/01/2012', '01/13/2012', '31/02/2012',
+    '03/04/2012\xa0', u'03\xa004\xa02012', 'not a date', '  ', "''", '', '03/04/2012', '3 Apr 2012',
+]
+
+# WebForms page with hidden postback state to check the input tokenizer against mechanize form parsing
+postback_page = """<html><body><form name="quick" action="./quick.aspx"><input type="hidden" name="q" value="1" /></form>
+<form name="aspnetForm" method="post" action="./search.aspx?a=1&amp;b=2" id="aspnetForm">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="/wEPDwUKLTk1OTk3OTQ3Mw9kFgJmD2QWAgIDD2QWAgIBD2QWAg==" />
+<INPUT TYPE=HIDDEN NAME=__VIEWSTATEGENERATOR VALUE=CA0B0334>
+<input type='hidden' name='__EVENTVALIDATION' value='a&amp;b+c/d=' />
+<input type="text" name="ctl00$txtRef" value="12/0001" />
+<input type="submit" name="ctl00$btnNext" value="Next &gt;" />
+<input type="hidden" name="ctl00$hdnPage" value="2" disabled>
+<input type="submit" name="ctl00$btnPrev" value="&lt; Prev" disabled="disabled" />
+</form></body></html>"""
+
+# Yorkshire Dales application page with a bad 1/1/1970 date (which the scraper removes)
+dales_page = """<html><body><div class="content">
+<div> <div> Application Number </div> <div> C/1 </div> </div> <div> <div> Address </div> <div> 1 High St </div> </div>
+<div> <div> Proposal </div> <div> New barn </div> </div>
+<div class="applicationDetailsDateReceived">Received</div> <div class="applicationDetailsDateReceived">02/01/2017</div>
+<div class="applicationDetailsDateValid">03/01/2017</div>
+<div class="applicationDetailsDateDecision">Decided</div> <div class="applicationDetailsDateDecision">1/1/1970</div>
+<div class="applicationDetailsDecision">Pending</div> </div></body></html>"""
+
+def soup_clean_text(text):
+    ' the original BeautifulSoup based text cleaning in _clean_record() '
+    text = scrapeutils.TAGS_REGEX.sub(' ', text)
+    text = BeautifulSoup(text, convertEntities="html").contents[0].string
+    text = myutils.GAPS_REGEX.sub(' ', text)
+    return text.strip()
+
+class ErrorAdapter(requests.adapters.BaseAdapter):
+    ' requests transport adapter which fails every request with an error that says nothing about the host '
+    def send(self, request, **kwargs):
+        raise requests.exceptions.TooManyRedirects('redirect loop')
+    def close(self):
+        pass
+
+class PagedSearchAdapter(requests.adapters.BaseAdapter):
+    """ requests transport adapter serving Civica JSON pagedsearch results - 'failed_pages' are the 1 based page numbers
+    which fail with a response that is not JSON """
+    def __init__(self, total, failed_pages=()):
+        super(PagedSearchAdapter, self).__init__()
+        self.total = total
+        self.failed_pages = failed_pages
+    def send(self, request, **kwargs):
+        fields = json.loads(request.body)
+        rows = range(fields['fromRow'], min(fields['toRow'], self.total) + 1)
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        if (fields['fromRow'] - 1) / (fields['toRow'] - fields['fromRow'] + 1) + 1 in self.failed_pages:
+            response._content = '<html>Server Error</html>'
+        else:
+            response._content = json.dumps({ 'TotalRows': self.total, 'KeyObjects': [ { 'Items': [
+                { 'FieldName': 'ref_no', 'Value': 'R%d' % r }, { 'FieldName': 'KeyNo', 'Value': str(r) } ] } for r in rows ] })
+        return response
+    def close(self):
+        pass
+
 dummy_records = [
     {"authority": 'x', "uid": 'y',  "url": 'z', "date_scraped": '2000-01-01T12:00:00', "start_date": '2000-01-01'},
     {"authority": 'x', "uid": 'b',  "url": 'c', "date_scraped": '2000-01-01T12:00:01', "start_date": '2000-01-01'}
@@ -318,6 +442,691 @@ class ListScraperTest(BaseScraperTest):
                     (self.scraper_name, len(result), test['from'], test['to'], test['len']))
 
     
+class UtilsTest(unittest.TestCase):
+    """ scraper independent tests of the shared utilities - run once (not per scraper) with the 'base' group
+    any scraper is used against a local mock portal, so there is no network access """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.portal = mockserver.MockPortal(per_day=5) # only started by tests which fetch pages
+        self._scraper = bench.mock_scraper(self.portal, 'Idox', log_directory=self.directory)
+        self.authority = self._scraper._authority_name
+
+    def tearDown(self):
+        self._scraper = None
+        self.portal.stop()
+        shutil.rmtree(self.directory)
+        
+    def test_clean_text(self):
+        for text in text_corpus:
+            self.assertEqual(scrapeutils.clean_text(text), soup_clean_text(text), 
+                'Text cleaning differs from BeautifulSoup for %s' % repr(text))
+        records = [ { 'description': t, 'address': t } for t in text_corpus ]
+        expected = [ { 'description': t, 'address': t } for t in text_corpus ]
+        self._scraper.clean_records(records)
+        for r in expected:
+            self._scraper._clean_record(r)
+        self.assertEqual(records, expected, 'Batch cleaning differs from _clean_record')
+        
+    def test_date_parser(self):
+        parser = myutils.DateParser()
+        for i in range(2): # second pass uses the cache and learned formats
+            for text in date_corpus:
+                for fmt in [ None, self._scraper._response_date_format, '%d/%m/%Y' ]:
+                    self.assertEqual(parser.get_dt(text, fmt), myutils.get_dt(text, fmt), 
+                        'Date parsing differs from get_dt for %s' % repr(text))
+        self.assertTrue(parser.stats()['learned'], 'Not learning date formats')
+        
+    def test_input_fields(self):
+        br = mechanize.Browser()
+        br.set_response(mechanize.make_response(postback_page, [ ('Content-Type', 'text/html') ],
+            'http://example.com/x/results.aspx', 200, 'OK'))
+        form = [ f for f in br.forms() if f.name == 'aspnetForm' ][0]
+        expected = dict((c.name, c.value) for c in form.controls if c.type == 'hidden' and not c.disabled)
+        expected['ctl00$btnNext'] = form.find_control('ctl00$btnNext').value
+        attrs, content = scrapeutils.form_html(postback_page, 'aspnetForm')
+        fields = scrapeutils.input_fields(content, [ 'ctl00$btnNext', 'ctl00$btnPrev' ])
+        self.assertEqual(fields, expected, 'Input tokenizer differs from mechanize forms')
+        postback = scrapeutils.Postback(None, form='aspnetForm')
+        postback.update(postback_page, 'http://example.com/x/results.aspx')
+        self.assertEqual(postback.state, dict((k, v) for k, v in expected.items() if k != 'ctl00$btnNext'), 'Wrong postback state')
+        self.assertEqual(postback.url, form.action, 'Postback URL differs from the form action')
+        postback = scrapeutils.Postback(None)
+        postback.update(postback_page, 'http://example.com/x/results.aspx')
+        self.assertEqual(postback.url, 'http://example.com/x/quick.aspx', 'Not using the first form by default')
+        postback.update(postback_page, 'http://example.com/x/results.aspx', form='aspnetForm')
+        self.assertEqual(postback.url, form.action, 'Not using the named form')
+        self.assertEqual(scrapeutils.form_html(postback_page, 'missing'), (None, None), 'Finding a missing form')
+        
+    def test_update_diff(self):
+        scraped = { 'uid': 'x', 'status': 'Decided', 'decision': 'Granted', 'date_scraped': '2017-01-02T00:00:00' }
+        self._scraper.fetch_application = lambda uid, url=None: { 'record': dict(scraped) } # no network access
+        applic = { 'authority': 'a', 'uid': 'x', 'status': 'Pending', 'ward_name': 'w', 'date_scraped': '2017-01-01T00:00:00' }
+        result = self._scraper.update_application(applic, diff=True)
+        self.assertEqual(result['changes'], { 'added': { 'decision': 'Granted' }, 'removed': [ 'ward_name' ],
+            'changed': { 'status': [ 'Pending', 'Decided' ] } }, 'Wrong field changes')
+        self.assertTrue(result['changed'], 'Not flagging changes')
+        self.assertEqual(result['record']['ward_name'], 'w', 'Not preserving old fields')
+        result = self._scraper.update_application(applic, diff=True)
+        self.assertFalse(result['changed'], 'Flagging a change when there is none')
+        
+    def test_archive(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = archive.PageArchive(directory)
+            self._scraper.use_archive(store)
+            self._scraper._archive_uid = 'x'
+            self._scraper._archive_kind = 'detail'
+            for html in [ '<p>one</p>', '<p>two</p>', '<p>one</p>' ]:
+                self._scraper._archive_page(html, 'http://example.com/x')
+            self._scraper._archive_uid = self._scraper._archive_kind = None
+            pages = store.pages(self.authority, 'x')
+            self.assertEqual([ p['kind'] for p in pages ], [ 'detail', 'linked', 'linked' ], 'Not archiving every page of a fetch')
+            self.assertEqual(store.stats()['blobs'], 2, 'Not deduplicating archived pages')
+            self.assertEqual(store.latest(self.authority, 'x')['body'], '<p>one</p>', 'Wrong archived page')
+            store.close()
+        finally:
+            self._scraper.use_archive(None)
+            shutil.rmtree(directory)
+        
+    def test_scrapemark_profile(self):
+        scrapemark = basereq.base.scrapemark # the module as used by the scrapers
+        pattern = '<ul> {* <li> {{ [items] }} </li> *} </ul>'
+        self.assertIs(scrapemark.compile(pattern), scrapemark.compile(pattern), 'Compiled pattern not cached')
+        max_compiled = scrapemark.max_compiled
+        scrapemark.max_compiled = len(scrapemark._compiled) + 2
+        try:
+            for i in range(5):
+                scrapemark.compile('<p> {{ x%d }} </p>' % i)
+            self.assertLessEqual(len(scrapemark._compiled), scrapemark.max_compiled, 'Compile cache grows beyond its limit')
+        finally:
+            scrapemark.max_compiled = max_compiled
+        self.assertEqual(scrapemark.scrape(pattern, '<ul><li>a</li><li>b</li></ul>'), { 'items': [ 'a', 'b' ] },
+            'Wrong result after the compile cache is cleared')
+        scrapemark.tag_pattern(pattern, 'UtilsTest', 'list')
+        profiling = scrapemark.profiling
+        scrapemark.profiling = True
+        scrapemark.reset_profile()
+        try:
+            for html in [ '<ul><li>a</li><li>b</li></ul>', '<ul></ul>', '<p>no list</p>' ]:
+                scrapemark.scrape(pattern, html)
+            stats = [ s for s in scrapemark.profile_stats() if s['group'] == 'UtilsTest' ]
+        finally:
+            scrapemark.profiling = profiling
+            scrapemark.reset_profile()
+        self.assertEqual([ (s['name'], s['calls'], s['hits'], s['misses']) for s in stats ], [ ('list', 3, 1, 2) ],
+            'Wrong pattern profile - an empty list is a miss')
+
+    def test_reextract(self):
+        this_class = bench.run.get_class('scrapers.dates.yorkshiredales', 'YorkshireDalesScraper') # removes bad dates from its pages
+        url = this_class._applic_url + 'C/1'
+        html = dales_page
+        store = archive.PageArchive(os.path.join(self.directory, 'archive'))
+        try:
+            scraper = this_class(log_directory=self.directory)
+            scraper.use_archive(store)
+            scraper._archive_uid, scraper._archive_kind = 'C/1', 'detail'
+            page, url = scraper._get_html(mechanize.make_response(html, [ ('Content-Type', 'text/html') ], url, 200, 'OK'))
+            scraper._archive_uid = scraper._archive_kind = None
+            live = scraper._get_full_details(page, url, True)
+            scraper._process_applic(live)
+            self.assertNotIn('decision_date', live, 'Bad date not removed')
+            result = reextract.extract_application(reextract.offline_parser(this_class), store, this_class._authority_name, 'C/1')
+            live['uid'] = 'C/1' # as set by extract_application()
+            for record in [ live, result['record'] ]:
+                del record['date_scraped']
+            self.assertEqual(result['record'], live, 'Re-extracted record differs from the live one')
+        finally:
+            store.close()
+
+    def test_json_log(self):
+        directory = tempfile.mkdtemp()
+        try:
+            writer = myutils.LogWriter(myutils.file_handler(os.path.join(directory, 'test.log')))
+            writer.handler.setFormatter(myutils.JSONFormatter())
+            log = logging.getLogger('json_log_test')
+            log.propagate = False
+            log.addHandler(myutils.QueueHandler(writer))
+            try:
+                raise ValueError('x')
+            except ValueError:
+                log.exception("%d ids from %s", 3, self.authority, extra={ 'uid': 'y' })
+            log.handlers = []
+            writer.close()
+            with open(os.path.join(directory, 'test.log')) as f:
+                record = json.loads(f.readline())
+            self.assertEqual(record['message'], '3 ids from %s' % self.authority, 'Wrong JSON log message')
+            self.assertEqual(record['uid'], 'y', 'Extra fields not logged')
+            self.assertIn('ValueError', record['exception'], 'Exception not logged')
+        finally:
+            shutil.rmtree(directory)
+        
+    def test_seen_index(self):
+        try:
+            self._scraper.use_seen_index(seen.SeenIndex(':memory:', bloom=True))
+            self.assertEqual(self._scraper._mark_seen([ { 'uid': 'a' }, { 'uid': 'b' } ]), [ { 'uid': 'a' }, { 'uid': 'b' } ],
+                'Marking new uids as seen')
+            self.assertEqual(self._scraper._mark_seen([ { 'uid': 'b' }, { 'uid': 'c' } ]), [ { 'uid': 'b' }, { 'uid': 'c' } ],
+                'Marking gathered uids as seen before they are stored')
+            self._scraper.mark_stored([ 'a', 'b', 'd' ])
+            self.assertEqual(self._scraper._mark_seen([ { 'uid': 'b' }, { 'uid': 'c' } ]), [ { 'uid': 'b', 'seen': True }, { 'uid': 'c' } ],
+                'Not marking seen uids')
+            self._scraper.use_seen_index(self._scraper._seen, filter_seen=True, stop_when_seen=True)
+            self.assertEqual(self._scraper._mark_seen([ { 'uid': 'a' }, { 'uid': 'e' } ]), [ { 'uid': 'e' } ],
+                'Not filtering seen uids')
+            self.assertEqual(self._scraper._mark_seen([ { 'uid': 'a' }, { 'uid': 'e' } ]), [ { 'uid': 'e' } ],
+                'Filtered uid lost before it is stored')
+            self.assertTrue(self._scraper._page_seen([ { 'uid': 'a' }, { 'uid': 'd' } ]), 'Not stopping at a seen page')
+            self.assertFalse(self._scraper._page_seen([ { 'uid': 'a' }, { 'uid': 'e' } ]), 'Stopping at a page with new uids')
+        finally:
+            self._scraper.use_seen_index(None, filter_seen=False, stop_when_seen=False)
+        
+    def test_seen_sink(self):
+        self.portal.start()
+        index = seen.SeenIndex(':memory:')
+        self._scraper.use_seen_index(index)
+        pool = multirun.ScraperPool(workers=1, seen=index)
+        pool._scrapers[self.authority] = self._scraper # no need to find the mock scraper by name
+        pool._locks[self.authority] = threading.Lock()
+        sink = sinks.JSONLSink(os.path.join(self.directory, 'records.jsonl'))
+        try:
+            gathered = pool.gather_ids([ self.authority ], '2017-01-01', '2017-01-02', sink=sink)[self.authority]['result']
+            uids = [ r['uid'] for r in gathered ]
+            self.assertFalse(index.known(self.authority, uids), 'Uids added to the seen index before they are stored')
+            sink.flush()
+            self.assertEqual(index.known(self.authority, uids), set(uids), 'Stored uids not added to the seen index')
+        finally:
+            sink.close()
+            pool.close()
+            index.close()
+        
+    def test_seen_bloom(self):
+        index = seen.SeenIndex(':memory:', bloom=True, capacity=100, error_rate=0.5) # lots of possible matches
+        queries = []
+        class CountingDB(object):
+            def __init__(self, db):
+                self.db = db
+            def execute(self, sql, *args):
+                queries.append(sql)
+                return self.db.execute(sql, *args)
+            def __getattr__(self, name):
+                return getattr(self.db, name)
+            def __enter__(self):
+                return self.db.__enter__()
+            def __exit__(self, *args):
+                return self.db.__exit__(*args)
+        try:
+            uids = [ 'U%d' % i for i in range(1200) ]
+            index.add(self.authority, uids[::2])
+            index.flush()
+            index._db = CountingDB(index._db)
+            self.assertEqual(index.known(self.authority, uids), set(uids[::2]), 'Wrong known uids in bloom mode')
+            self.assertLessEqual(len(queries), 1 + len(uids) / seen.QUERY_SIZE, 'Not checking the possible matches in batches')
+        finally:
+            index.close()
+
+    def test_seen_goal(self):
+        self.portal.start()
+        requests = self.portal.requests
+        gathered = self._scraper.gather_ids('2016-06-01', '2017-01-10')
+        requests = self.portal.requests - requests
+        try:
+            self._scraper.use_seen_index(seen.SeenIndex(':memory:', bloom=True), filter_seen=True)
+            self._scraper.mark_stored([ r['uid'] for r in gathered['result'] ])
+            start = self.portal.requests
+            result = self._scraper.gather_ids('2016-06-01', '2017-01-10')
+            self.assertEqual(result['result'], [], 'Known uids not filtered')
+            self.assertEqual((result['from'], result['to']), (gathered['from'], gathered['to']), 'Wrong range gathered with known uids')
+            self.assertEqual(self.portal.requests - start, requests, 'Filtered uids not counted towards the id goal')
+        finally:
+            self._scraper.use_seen_index(None, filter_seen=False)
+
+    def test_scraper_pool(self):
+        pool = multirun.ScraperPool(workers=2)
+        finished = []
+        def slow_call(name, seconds):
+            time.sleep(seconds)
+            finished.append(name)
+            return { 'name': name }
+        for name in [ 'A', 'B' ]: # no need to find the scrapers by name
+            pool._scrapers[name] = bench.mock_scraper(self.portal, 'Idox', log_directory=self.directory)
+            pool._scrapers[name].slow_call = slow_call
+            pool._locks[name] = threading.Lock()
+        try:
+            busy = [ pool.submit('A', 'slow_call', 'A%d' % i, 0.05) for i in range(6) ]
+            other = pool.submit('B', 'slow_call', 'B', 0.01)
+            self.assertEqual(other.get(5)['name'], 'B', 'Wrong pool result')
+            self.assertLess(finished.index('B'), 2, 'Call for another authority waiting behind a busy one')
+            self.assertEqual([ p.get(5)['name'] for p in busy ], [ 'A%d' % i for i in range(6) ], 'Wrong pool results')
+            self.assertEqual([ n for n in finished if n != 'B' ], [ 'A%d' % i for i in range(6) ], 'Calls for one authority not run in turn')
+            results = pool.map([ ('A', 'slow_call', ('x', 0)), ('C', 'gather_ids') ])
+            self.assertEqual(results[0]['name'], 'x', 'Wrong mapped result')
+            self.assertEqual(results[1]['scrape_error'], self._scraper.errors[self._scraper.GET_ERROR], 'Wrong error for an unknown scraper')
+        finally:
+            pool.close()
+        self.assertTrue(all(p.ready() for p in busy), 'Pool closed before its queued calls ran')
+
+    def test_postcodes(self):
+        csv_path = os.path.join(self.directory, 'postcodes.csv')
+        with open(csv_path, 'wb') as f:
+            f.write('pcd,lat,long\nN16 5JE,51.561,-0.074\nSW1A1AA,51.501009,-0.141588\nZZ9 9ZZ,99.999999,0.0\nAB1 2CD,x,y\n,51.0,0.0\n')
+        index_path = os.path.join(self.directory, 'postcodes.idx')
+        self.assertEqual(geo.postcodes.build_index(csv_path, index_path), 2, 'Not skipping postcodes with no valid location')
+        index = geo.PostcodeIndex(index_path)
+        try:
+            self.assertEqual(len(index), 2, 'Wrong postcode index size')
+            lng, lat = index.lookup('sw1a 1aa')
+            self.assertAlmostEqual(lat, 51.501009, 6, 'Wrong postcode latitude')
+            self.assertAlmostEqual(lng, -0.141588, 6, 'Wrong postcode longitude')
+            self.assertIsNone(index.lookup('ZZ9 9ZZ'), 'Finding a postcode with no location')
+            self.assertIsNone(index.lookup('N1 1AA'), 'Finding a missing postcode')
+            self.assertIsNone(index.lookup(''), 'Finding an empty postcode')
+            self._scraper.postcode_index = index
+            applic = { 'address': '1 High St, London n16 5je' }
+            self._scraper._process_applic(applic)
+            self.assertAlmostEqual(applic['lat'], 51.561, 6, 'Not locating applications by postcode')
+        finally:
+            self._scraper.postcode_index = None
+            index.close()
+        with open(index_path, 'r+b') as f:
+            f.write('XXXXXXXX')
+        self.assertRaises(ValueError, geo.PostcodeIndex, index_path)
+        
+    def test_geo_batch(self):
+        eastings = [ 529090, 448000, 311000.5, 0, 530000, 900000, 215000 ]
+        northings = [ 179645, 552000, 1140000.5, 0, 1000, 100000, 770000 ]
+        expected = [ geo.lnglat_from_eastnorth(e, n) if geo.eastnorth_in_range(e, n, 'GB') else None
+            for e, n in zip(eastings, northings) ]
+        self.assertTrue(len([ x for x in expected if x ]) >= 3, 'Too few valid test coordinates')
+        numpy = geo.vector.np
+        try:
+            for np in [ numpy, None ]: # vectorised and the pure python fallback
+                geo.vector.np = np
+                results = geo.lnglats_from_eastnorths(eastings, northings)
+                for result, lnglat in zip(results, expected):
+                    if lnglat is None:
+                        self.assertIsNone(result, 'Converting an out of range easting/northing')
+                    else:
+                        self.assertAlmostEqual(result[0], lnglat[0], 6, 'Batch longitude differs from geo_helper')
+                        self.assertAlmostEqual(result[1], lnglat[1], 6, 'Batch latitude differs from geo_helper')
+        finally:
+            geo.vector.np = numpy
+        applics = [ { 'easting': '529090', 'northing': '179645' }, { 'latitude': '51.5', 'longitude': '-0.1' },
+            { 'easting': '315000', 'northing': '380000', 'postcode': 'BT1 1AA' }, { 'address': 'no location' } ]
+        for result, applic in zip(geo.lnglats_from_applics(applics), applics):
+            lnglat = geo.lnglat_from_applic(applic)
+            if lnglat is None:
+                self.assertIsNone(result, 'Locating an application with no location')
+            else:
+                self.assertAlmostEqual(result[0], lnglat[0], 6, 'Batch application longitude differs')
+                self.assertAlmostEqual(result[1], lnglat[1], 6, 'Batch application latitude differs')
+
+    def test_geo_caches(self):
+        geo.clear_caches()
+        try:
+            applic = { 'easting': '529090', 'northing': '179645' }
+            first = geo.lnglat_from_applic(applic)
+            self.assertEqual(geo.lnglat_from_applic(dict(applic)), first, 'Wrong cached conversion')
+            self.assertEqual(geo.cache_stats()['eastnorth'], { 'size': 1, 'maxsize': geo.eastnorth_cache.maxsize,
+                'hits': 1, 'misses': 1 }, 'Wrong easting/northing cache counts')
+            for i in range(2): # invalid grid refs are cached too
+                self.assertRaises(ValueError, geo.eastnorth_from_grid_ref, 'XX 123')
+            self.assertEqual(geo.eastnorth_from_grid_ref('TQ 29090 79645'), geo.osgb_to_eastnorth('TQ 29090 79645'),
+                'Wrong cached grid ref')
+            stats = geo.cache_stats()['grid_ref']
+            self.assertEqual((stats['size'], stats['hits'], stats['misses']), (2, 1, 2), 'Wrong grid ref cache counts')
+            cache = myutils.LRUCache(2)
+            for k in [ 'a', 'b', 'a', 'c' ]: # 'b' is least recently used when 'c' is added
+                if cache.get(k) is None:
+                    cache.put(k, k.upper())
+            self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), ('A', None, 'C'), 'Wrong entry discarded')
+        finally:
+            geo.clear_caches()
+
+    def test_spatial_index(self):
+        index = geo.SpatialIndex(cell_size=0.05)
+        points = [ ('a%d' % i, -0.2 + 0.013 * (i % 31), 51.4 + 0.011 * (i % 23)) for i in range(300) ]
+        for key, lng, lat in points:
+            index.add(key, lng, lat)
+        self.assertEqual(len(index), 300, 'Wrong index size')
+        box = (-0.1, 51.45, 0.05, 51.55)
+        expected = sorted(k for k, lng, lat in points if box[0] <= lng <= box[2] and box[1] <= lat <= box[3])
+        self.assertEqual(sorted(index.within_bbox(*box)), expected, 'Wrong items in the bounding box')
+        for radius in [ 0.5, 3.0, 50.0 ]:
+            expected = sorted((geo.haversine(0.0, 51.5, lng, lat), k) for k, lng, lat in points
+                if geo.haversine(0.0, 51.5, lng, lat) <= radius)
+            results = index.within_radius(0.0, 51.5, radius)
+            self.assertEqual([ k for d, k in results ], [ k for d, k in expected ], 'Wrong items within %s km' % radius)
+        record = { 'authority': 'x', 'uid': 'y', 'lat': 51.5, 'lng': 0.0 }
+        self.assertTrue(index.add_record(record), 'Located record not indexed')
+        self.assertEqual(index.within_radius(0.0, 51.5, 0.001), [ (0.0, record) ], 'Indexed record not found')
+        record.update({ 'lat': 52.5, 'lng': 1.0 })
+        index.add_record(record)
+        self.assertNotIn(record, [ i for d, i in index.within_radius(0.0, 51.5, 0.001) ], 'Moved record found at its old location')
+        self.assertEqual(index.within_bbox(0.9, 52.4, 1.1, 52.6), [ record ], 'Moved record not found')
+        del record['lat']
+        self.assertFalse(index.add_record(record), 'Record with no location indexed')
+        self.assertNotIn(('x', 'y'), index, 'Record with no location left in the index')
+
+    def test_metrics(self):
+        one = metrics.Metrics(authority='One')
+        two = metrics.Metrics(authority='Two "2"')
+        one.record_request('GET', 'http://example.com/x', 200, 0.5, 100)
+        one.record_request('POST', 'http://example.com/y', None, 1.5, 0, 'timeout')
+        two.record_request('GET', 'http://example.org/x', 200, 0.25, 50)
+        one.record_call('detail', 2.0, 2, { 'uid': 'x' })
+        one.record_call('detail', 1.0, 1, { 'scrape_error': 'x' })
+        self.assertEqual(one.requests, 2, 'Wrong request count')
+        self.assertEqual(one.total('http_requests_total'), 2, 'Wrong request total')
+        self.assertEqual(one.total('http_requests_total', status='error'), 1, 'Wrong failed request total')
+        self.assertEqual(one.total('calls_total', kind='detail', outcome='ok'), 1, 'Wrong call total')
+        self.assertEqual(one.summary('call_seconds', kind='detail'), { 'count': 2, 'sum': 3.0, 'max': 2.0, 'mean': 1.5 },
+            'Wrong call time summary')
+        text = metrics.to_prometheus([ one, two ])
+        lines = text.splitlines()
+        for line in [ '# TYPE ukplanning_http_requests_total counter',
+                'ukplanning_http_requests_total{authority="One",host="example.com",method="GET",status="200"} 1',
+                'ukplanning_http_requests_total{authority="Two \\"2\\"",host="example.org",method="GET",status="200"} 1',
+                'ukplanning_http_response_bytes_total{authority="One",host="example.com"} 100',
+                '# TYPE ukplanning_call_seconds summary',
+                'ukplanning_call_seconds_count{authority="One",kind="detail"} 2',
+                'ukplanning_call_seconds_sum{authority="One",kind="detail"} 3.0',
+                'ukplanning_call_seconds_max{authority="One",kind="detail"} 2.0' ]:
+            self.assertIn(line, lines, 'Missing Prometheus line %s' % line)
+        self.assertEqual(len([ l for l in lines if l.startswith('# TYPE ukplanning_http_requests_total ') ]), 1,
+            'Metric type repeated for each scraper')
+        self.assertEqual(one.to_prometheus(), metrics.to_prometheus([ one ]), 'Wrong single scraper export')
+        one.reset()
+        self.assertEqual((one.requests, one.total('http_requests_total')), (0, 0), 'Metrics not reset')
+
+    def test_parse_pool(self):
+        this_class = bench.run.get_class('scrapers.dates.yorkshiredales', 'YorkshireDalesScraper')
+        scraper = this_class(log_directory=self.directory)
+        url = this_class._applic_url + 'C/1'
+        expected = scraper._get_detail(dales_page, url)
+        self.assertNotIn('scrape_error', expected, 'Test page not scraped')
+        with multirun.ParsePool(processes=1) as parse_pool:
+            self.assertEqual(parse_pool.submit(this_class, dales_page, url).get(10), expected, 'Parse pool record differs')
+            result = parse_pool.submit(scraper, dales_page, url, update_url=True, process=True).get(10)
+            self.assertEqual(result['url'], url, 'Parse pool not setting the url')
+            self.assertTrue(result.get('start_date') and result.get('date_scraped'), 'Parse pool record not processed')
+            result = parse_pool.submit(this_class, '<html><body>Not found</body></html>', url).get(10)
+            self.assertIn('scrape_error', result, 'No error from the parse pool for a page which does not match')
+            result = parse_pool.submit(dict, dales_page, url).get(10) # not a scraper class, so the worker raises
+            self.assertEqual(result, { 'scrape_error': self._scraper.errors[self._scraper.GET_ERROR] }, 'Wrong parse pool error code')
+
+    def test_cassette_handler(self):
+        self.portal.start()
+        url = self.portal.url + '/idox/applicationDetails.do?activeTab=summary&keyVal=' + mockserver.make_uid(date(2017, 1, 3), 1)
+        path = os.path.join(self.directory, 'browser.cassette') # the cassette module the browser host tracking knows
+        tape = scrapeutils.cassette.Cassette(path, 'record')
+        br, cj = scrapeutils.get_browser()
+        br.add_handler(scrapeutils.cassette.CassetteHandler(tape))
+        page = br.open(url).read()
+        tape.save()
+        requests = self.portal.requests
+        self.portal.stop()
+        tape = scrapeutils.cassette.Cassette(path, 'replay')
+        br, cj = scrapeutils.get_browser()
+        br.add_handler(scrapeutils.cassette.CassetteHandler(tape))
+        self.assertEqual(br.open(url).read(), page, 'Page not replayed from the cassette')
+        self.assertEqual(br.open(url).read(), page, 'Repeated request not replayed from the cassette')
+        self.assertEqual(self.portal.requests, requests, 'Replayed request sent to the server')
+        failures = scrapeutils.host_health(url).failures
+        self.assertRaises(scrapeutils.cassette.MissURLError, br.open, url + '&other')
+        self.assertEqual(tape.misses, 1, 'Request not in the cassette not counted')
+        self.assertEqual(scrapeutils.host_health(url).failures, failures, 'Request not in the cassette counted as a host failure')
+
+    def test_host_probe(self):
+        def open_circuit(health):
+            for i in range(health.fail_threshold):
+                health.failure()
+            health.opened_at -= health.reset_after # ready for a probe
+        def browser_error(*args, **kwargs):
+            raise mechanize.BrowserStateError('not viewing HTML')
+        br, cj = scrapeutils.get_browser()
+        br._mech_open = browser_error
+        health = scrapeutils.host_health('http://probe1.example.com/')
+        open_circuit(health)
+        self.assertRaises(mechanize.BrowserStateError, br.open, 'http://probe1.example.com/')
+        self.assertTrue(health.allow(), 'Browser probe left in progress after a non network error')
+        rs = basereq.HealthSession()
+        rs.mount('http://', ErrorAdapter())
+        health = basereq.scrapeutils.host_health('http://probe2.example.com/')
+        open_circuit(health)
+        self.assertRaises(requests.exceptions.TooManyRedirects, rs.get, 'http://probe2.example.com/')
+        self.assertTrue(health.allow(), 'Session probe left in progress after a non network error')
+        health.failure()
+        self.assertFalse(health.allow(), 'Circuit not open after a failed probe')
+        
+    def test_host_down(self):
+        scraper = self._scraper
+        def refused(*args, **kwargs):
+            raise mechanize.URLError('connection refused')
+        scraper.br._mech_open = refused # no network access
+        tried = []
+        def detail(uidurl):
+            tried.append(uidurl)
+            scraper.br.open(uidurl if uidurl.startswith('http') else 'http://' + host + '/' + uidurl)
+        scraper.get_detail_from_url = scraper.get_detail_from_uid = detail
+        host = 'detail-down.example.com' # detail pages on another host to the search pages
+        health = basereq.scrapeutils.host_health('http://%s/' % host)
+        for i in range(health.fail_threshold):
+            health.failure()
+        url = 'http://%s/y' % host
+        self.assertEqual(scraper.fetch_application('x', url)['scrape_error'], scraper.errors[scraper.FETCH_FAIL], 'Wrong fetch error')
+        self.assertEqual(tried, [ url ], 'Trying the uid when the host of the detail pages is down')
+        del tried[:]
+        host = 'detail-up.example.com'
+        url = 'http://%s/y' % host
+        scraper.fetch_application('x', url)
+        self.assertEqual(tried, [ url, 'x' ], 'Not trying the uid after a failure on a host that is up')
+        
+    def test_checkpoint_resume(self):
+        self.portal.start()
+        store = checkpoint.CheckpointStore(os.path.join(self.directory, 'checkpoints.db'))
+        def gather(batches=None):
+            scraper = bench.mock_scraper(self.portal, 'Idox', log_directory=self.directory) # a new process each time
+            scraper.use_checkpoints(store)
+            scraper.batch_size = 1 # one day per batch
+            scraper.min_id_goal = 1000
+            if batches is not None: # the process dies after this many batches
+                get_batch = scraper._get_id_batch_wrapper
+                def dying_batch(date_from, date_to):
+                    if not batches:
+                        raise RuntimeError('process died')
+                    batches.pop()
+                    return get_batch(date_from, date_to)
+                scraper._get_id_batch_wrapper = dying_batch
+            return scraper.gather_ids('2017-01-01', '2017-01-06')
+        try:
+            expected = gather()
+            requests = self.portal.requests
+            self.assertRaises(RuntimeError, gather, [ 1, 1, 1 ])
+            self.assertEqual([ p[1] for p in store.pending() ], [ 'gather_ids(2017-01-05, 2017-01-01)' ],
+                'No checkpoint of the range gathered left by a failed gather')
+            with store._db: # saved on an earlier day
+                store._db.execute("UPDATE checkpoints SET updated='2017-01-01T00:00:00'")
+            start = self.portal.requests
+            self.assertEqual(gather(), expected, 'Gather result differs after a stale checkpoint')
+            self.assertEqual(self.portal.requests - start, requests, 'Resuming a stale checkpoint')
+            self.assertRaises(RuntimeError, gather, [ 1, 1, 1 ])
+            start = self.portal.requests
+            result = gather()
+            self.assertEqual(result, expected, 'Resumed gather result differs')
+            self.assertLess(self.portal.requests - start, requests, 'Resumed gather not carrying on from the checkpoint')
+            self.assertFalse(store.pending(), 'Checkpoint not deleted after a completed gather')
+        finally:
+            store.close()
+        
+    def test_sinks(self):
+        full = { 'authority': 'a', 'uid': 'x', 'reference': 'x', 'decision': 'Granted', 'date_scraped': '2017-01-02T00:00:00' }
+        stub = { 'authority': 'a', 'uid': 'x', 'url': 'http://example.com/x', 'date_scraped': '2017-01-03T00:00:00' }
+        db = sinks.SQLiteSink(os.path.join(self.directory, 'records.db'), buffer_size=1)
+        try:
+            db.write(full)
+            db.write(stub) # eg gathered again after the full record was stored
+            self.assertEqual(db.get('a', 'x'), dict(full, **stub), 'Later record not merged into the stored one')
+            db.buffer_size = 10
+            db.write({ 'authority': 'a', 'uid': 'y', 'decision': 'Refused' })
+            db.write({ 'authority': 'a', 'uid': 'y', 'url': 'http://example.com/y' })
+            self.assertEqual(db.get('a', 'y'), { 'authority': 'a', 'uid': 'y', 'decision': 'Refused', 'url': 'http://example.com/y' },
+                'Buffered records not merged')
+        finally:
+            db.close()
+        csv_sink = sinks.CSVSink(os.path.join(self.directory, 'records.csv'), buffer_size=1)
+        csv_sink.write(stub)
+        csv_sink.write(full)
+        csv_sink.close()
+        self.assertEqual(csv_sink.dropped, set([ 'reference', 'decision' ]), 'Fields left out of the CSV columns not reported')
+        
+    def test_cassette_adapters(self):
+        # Wirral mounts its own TLS adapter after the cassette is attached in the base __init__
+        # others (eg Bolton, Telford) mount one on a longer host prefix, which is used in preference to the 'https://' one
+        this_class = bench.run.get_class('scrapers.reqs.wirral', 'WirralScraper')
+        urls = [ 'https://planning.wirral.gov.uk/x', 'https://www.example.gov.uk/x' ]
+        tape = basereq.base.cassette.Cassette(os.path.join(self.directory, this_class._authority_name + '.cassette'), 'record')
+        for url in urls:
+            tape.record('GET', url, None, 200, 'OK', [ ('Content-Type', 'text/html') ], '<p>replayed</p>')
+        tape.save()
+        this_class.cassette_directory = self.directory
+        try:
+            scraper = this_class(log_directory=self.directory)
+        finally:
+            del this_class.cassette_directory
+        scraper.rs.mount('https://www.example.gov.uk', requests.adapters.HTTPAdapter())
+        for url in urls:
+            self.assertEqual(scraper.rs.get(url).content, '<p>replayed</p>', 'Request to %s not replayed from the cassette' % url)
+            self.assertRaises(basereq.base.cassette.MissConnectionError, scraper.rs.get, url + '?other')
+            self.assertEqual(basereq.scrapeutils.host_health(url).failures, 0, 'Request to %s not in the cassette counted as a host failure' % url)
+        
+    def test_page_size(self):
+        this_class = type(self._scraper) # a new mock class for each test
+        this_class._page_size_field = 'pageSize'
+        this_class._page_size_max = 100
+        other = this_class(log_directory=self.directory)
+        sizes = []
+        def no_ids(x):
+            sizes.append(self._scraper.page_size)
+            return []
+        self.assertEqual(self._scraper._with_page_size(no_ids, 1), [], 'Wrong page size result')
+        self.assertEqual(sizes, [ 100 ], 'Falling back to the default page size after an empty result')
+        def fails_with_page_size(x):
+            sizes.append(self._scraper.page_size)
+            if self._scraper._use_page_size:
+                raise ValueError('results page not parsed')
+            self.assertTrue(other._use_page_size, 'Page size turned off for other scrapers while it is tried')
+            return [ x ]
+        def always_fails(x):
+            raise ValueError('results page not parsed')
+        self.assertRaises(ValueError, self._scraper._with_page_size, always_fails, 1)
+        self.assertTrue(other._use_page_size and self._scraper._use_page_size, 'Page size refused after failing either way')
+        sizes = []
+        self.assertEqual(self._scraper._with_page_size(fails_with_page_size, 1), [ 1 ], 'Wrong default page size result')
+        self.assertEqual(sizes, [ 100, self._scraper._page_size ], 'Not falling back to the default page size')
+        self.assertFalse(other._use_page_size, 'Refused page size still used by other scrapers')
+        
+    def test_json_pages(self):
+        this_class = bench.run.get_class('scrapers.dates.northampton', 'NorthamptonScraper')
+        scraper = this_class(log_directory=self.directory)
+        scraper.rs.mount('http://', PagedSearchAdapter(350, [ 3 ]))
+        sessions = []
+        def page_session(new_session=scraper._page_session):
+            sessions.append(new_session())
+            return sessions[-1]
+        scraper._page_session = page_session
+        result = scraper.get_id_batch(date(2017, 1, 1), date(2017, 1, 2))
+        self.assertEqual([ r['uid'] for r in result ], [ 'R%d' % r for r in range(1, 201) ], 'Not keeping the pages before a failed page')
+        self.assertEqual(len(sessions), min(this_class._page_workers, 3), 'Not one session for each page worker')
+        for rs in sessions:
+            self.assertIsNot(rs, scraper.rs, 'Page workers sharing the scraper session')
+            self.assertIs(rs.cookies, scraper.rs.cookies, 'Page worker session not sharing the cookies')
+            self.assertIs(rs.get_adapter('http://x'), scraper.rs.get_adapter('http://x'), 'Page worker session not sharing the connection pools')
+        self.assertFalse(this_class._page_size_refused, 'Page size refused after a failed later page')
+        scraper.rs.mount('http://', PagedSearchAdapter(350, [ 1 ]))
+        result = scraper._get_id_batch_wrapper(date(2017, 1, 1), date(2017, 1, 2))
+        self.assertIn('scrape_error', result, 'No error after a failed first page')
+        
+    def test_listing_only(self):
+        self.portal.start()
+        gathered = self._scraper.gather_ids('2017-01-01', '2017-01-02')['result']
+        self.assertTrue(gathered, 'No ids gathered from the mock portal')
+        for record in gathered:
+            self.assertFalse(self._scraper.needs_detail(record), 'Listing record %s needs the detail pages' % record['uid'])
+        requests = self.portal.requests
+        for record in gathered:
+            result = self._scraper.update_application(record, listing_only=True)
+            self.assertIs(result['record'], record, 'Wrong listing only update result')
+            for f in [ 'date_scraped', 'start_date', 'authority', 'source_url' ]:
+                self.assertTrue(record.get(f), 'Listing only record %s not processed - no %s' % (record['uid'], f))
+        result = self._scraper.update_application(gathered[-1], listing_only=True, diff=True)
+        self.assertFalse(result['changed'], 'Flagging a change in a processed listing record')
+        self.assertEqual(self.portal.requests, requests, 'Detail pages fetched for listing only updates')
+        self.assertEqual(self._scraper.metrics.total('detail_skipped_total'), len(gathered) + 1, 'Skipped detail fetches not counted')
+        del gathered[0]['description']
+        result = self._scraper.update_application(gathered[0], listing_only=True)
+        self.assertTrue(result['record'].get('description'), 'Incomplete listing record not updated from the detail pages')
+        self.assertGreater(self.portal.requests, requests, 'Detail pages not fetched for an incomplete listing record')
+        self.assertEqual(self._scraper.metrics.total('detail_skipped_total'), len(gathered) + 1, 'Fetched detail counted as skipped')
+
+    def test_listing_rows(self):
+        rows = []
+        for uid in [ 'A1', 'A2', 'A3' ]:
+            validated = '' if uid == 'A2' else 'Validated: 02/01/2017 <span>|</span>' # missing from one row
+            rows.append("""<li><a href="applicationDetails.do?keyVal=%s">Extension</a> <p class="address">1 High St</p>
+                <p class="metaInfo"> No: %s <span>|</span> Received: 01/01/2017 <span>|</span> %s Status: Pending </p></li>"""
+                % (uid, uid, validated))
+        html = '<html><body><ul id="searchresults">%s</ul></body></html>' % ''.join(rows)
+        result = self._scraper._scrape_id_list(html, 'http://example.com/x/results.do')
+        self.assertEqual([ r['uid'] for r in result['records'] ], [ 'A1', 'A2', 'A3' ], 'Results row with a listing field missing lost')
+        self.assertEqual(result['records'][0]['address'], '1 High St', 'Listing fields not merged in')
+        self.assertTrue(self._scraper.needs_detail(result['records'][1]), 'Incomplete listing row does not need the detail pages')
+
+    def test_refresh_plan(self):
+        planner = refresh.RefreshPlanner(budget=10, default_cost=3.0)
+        today = date(2017, 6, 1)
+        decided = { 'authority': 'a', 'uid': 'd', 'decision': 'Granted', 'decision_date': '2016-01-01', 'date_scraped': '2017-01-01' }
+        appeal = dict(decided, uid='x', appeal_date='2017-01-01')
+        pending = { 'authority': 'a', 'uid': 'p', 'target_decision_date': '2017-08-01', 'date_scraped': '2017-05-01' }
+        due = dict(pending, uid='u', target_decision_date='2017-06-03')
+        overdue = dict(pending, uid='o', target_decision_date='2017-05-01')
+        self.assertEqual(planner.base_rate(decided, today), refresh.DECIDED_RATE, 'Wrong decided rate')
+        self.assertEqual(planner.base_rate(appeal, today), refresh.APPEAL_RATE, 'Wrong appeal rate')
+        self.assertEqual(planner.base_rate(pending, today), refresh.PENDING_RATE, 'Wrong pending rate')
+        self.assertEqual(planner.base_rate(due, today), refresh.PENDING_RATE * refresh.DUE_FACTOR, 'Wrong due rate')
+        self.assertEqual(planner.base_rate(overdue, today), refresh.PENDING_RATE * refresh.OVERDUE_FACTOR, 'Wrong overdue rate')
+        scores = [ planner.score(r, today) for r in [ due, overdue, pending, decided ] ]
+        self.assertEqual(scores, sorted(scores, reverse=True), 'Records not scored by their chance of change')
+        self.assertGreater(planner.score(pending, today), planner.score(dict(pending, date_scraped='2017-05-20'), today),
+            'Recently checked record scored higher')
+        cheap = dict(decided, authority='b', uid='c', date_scraped='2017-05-25') # least likely to have changed, but fits in the budget
+        planner.record_result(cheap, False, requests=1, today=date(2017, 5, 25))
+        self.assertEqual(planner.cost('b'), 1.0, 'Request cost not recorded')
+        planned = [ r['uid'] for s, r in planner.plan([ decided, pending, cheap, due, overdue ], today=today) ]
+        self.assertEqual(planned, [ 'u', 'o', 'p', 'c' ], 'Wrong records planned within the request budget') # 3 + 3 + 3 + 1 (not 'd' for 3 more)
+        
+    def test_refresh_costs(self):
+        self.portal.start()
+        gathered = self._scraper.gather_ids('2017-01-01', '2017-01-02')['result']
+        pool = multirun.ScraperPool(workers=2)
+        pool._scrapers[self.authority] = self._scraper # no need to find the mock scraper by name
+        pool._locks[self.authority] = threading.Lock()
+        planner = refresh.RefreshPlanner(budget=1000, default_cost=10.0)
+        try:
+            requests = self.portal.requests
+            results = planner.refresh(pool, gathered)
+            self.assertEqual(len(results), len(gathered), 'Not all records refreshed')
+            self.assertFalse(any('requests' in r for r in results), 'Request counts added to the results')
+            self.assertEqual(planner.cost(self.authority), (self.portal.requests - requests) / float(len(gathered)),
+                'Request costs not recorded by refresh')
+            requests = self.portal.requests
+            pending = pool.submit(self.authority, 'update_application', dict(gathered[0]))
+            self.assertEqual(pending.get(10).keys(), [ 'record' ], 'Pool result differs from update_application')
+            self.assertEqual(pending.requests, self.portal.requests - requests, 'Wrong request count')
+        finally:
+            pool.close()
+            planner.close()
+    
 if __name__ == '__main__':
     try: unittest.main()
     except SystemExit: pass
@@ -24,12 +24,26 @@ import lxml.html
 import lxml.html.soupparser
 import lxml.etree
 import socket
+import httplib
+import threading
+import time
+import logging
+from collections import deque
 from datetime import timedelta
 from datetime import datetime
 from datetime import date
 from BeautifulSoup import BeautifulSoup
+from htmlentitydefs import name2codepoint
 import cookielib
 import urllib, urlparse
+try:
+    from ukplanning import myutils
+except ImportError:
+    import myutils
+try:
+    from ukplanning import cassette
+except ImportError:
+    import cassette
 
 RFC822_DATE = "%a, %d %b %Y %H:%M:%S %z"
 ISO8601_DATE = "%Y-%m-%d"
@@ -39,26 +53,192 @@ SCRIPT_REGEX = re.compile(r'<script\s.*?</script>', re.I | re.S)
 HTCOM_REGEX = re.compile(r'<!--.*?-->', re.S)
 TAGS_REGEX = re.compile(r'<[^<]+?>')
 JSESS_REGEX = re.compile(r';jsessionid=\w*')
+ENTITY_REGEX = re.compile(r'&(?:#([0-9]+)|([A-Za-z][A-Za-z0-9]*));')
+MAX_UNICHR = 0x10FFFF
 WEEKDAYS = { 'Mon': 0, 'Tue': 1, 'Wed': 2, 'Thu': 3, 'Fri': 4, 'Sat': 5, 'Sun': 6 }
 
 mechanize._sockettimeout._GLOBAL_DEFAULT_TIMEOUT = 300.0 # fall back 5 mins inactivity note default is object() meaning no timeout?
 
 # various classes and utilty functions for use in UKPlanning
 
+# tracks the health of each remote host - shared by all scrapers in this process
+class HostHealth(object):
+    """ consecutive fetch failures open a circuit, so further requests to the host fail fast
+    until 'reset_after' seconds have passed, after which one probe request is let through
+    (success closes the circuit again, failure restarts the wait)
+    also keeps recent response times so a per host timeout can be derived from them """
+    
+    fail_threshold = 5 # consecutive failures before the circuit opens
+    reset_after = 300.0 # seconds before an open circuit lets a probe request through
+    window = 200 # number of recent response times kept
+    min_samples = 10 # response times needed before an adaptive timeout is used
+    percentile = 95 # response time percentile used as the basis of the adaptive timeout
+    factor = 3.0 # multiple of the percentile response time allowed before timing out
+    min_timeout = 5.0 # adaptive timeout limits in seconds
+    max_timeout = 120.0
+    
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0 # consecutive failures
+        self.opened_at = None # time the circuit was opened (None if closed)
+        self.probing = False # a probe request is in progress on an open circuit
+        self.latencies = deque(maxlen=self.window)
+        self._lock = threading.Lock()
+        
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+        
+    def allow(self):
+        """ returns True if a request to this host can go ahead """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.time() - self.opened_at >= self.reset_after:
+                self.probing = True # let one request through to see if the host is back
+                return True
+            return False
+            
+    def success(self, elapsed=None):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            if elapsed is not None:
+                self.latencies.append(elapsed)
+                
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.fail_threshold:
+                self.opened_at = time.time() # open the circuit or restart the wait after a failed probe
+            self.probing = False
+            
+    def release(self):
+        """ after a request which neither succeeded nor failed (eg a redirect loop or a browser state error)
+        says nothing about the host, but ends any probe so another one can go ahead """
+        with self._lock:
+            self.probing = False
+            
+    def latency(self, percentile=None):
+        """ observed response time (seconds) at the percentile - None if too few samples """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            values = sorted(self.latencies)
+        if percentile is None:
+            percentile = self.percentile
+        index = int(round((len(values) - 1) * percentile / 100.0))
+        return values[index]
+            
+    def timeout(self, default):
+        """ adaptive timeout derived from observed response times - 'default' if there are not yet enough """
+        observed = self.latency()
+        if observed is None:
+            return default
+        return min(max(observed * self.factor, self.min_timeout), self.max_timeout)
+        
+    def status(self):
+        return { 'host': self.host, 'open': self.is_open, 'failures': self.failures,
+            'samples': len(self.latencies), 'latency': self.latency() }
+            
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def host_health(url):
+    """ get the (shared) health tracker for the host of a URL """
+    if not isinstance(url, basestring):
+        url = url.get_full_url() # mechanize/urllib2 Request object
+    host = urlparse.urlsplit(url).netloc.lower()
+    with _hosts_lock:
+        health = _hosts.get(host)
+        if not health:
+            health = HostHealth(host)
+            _hosts[host] = health
+        return health
+        
+def all_host_health():
+    ' current status of all hosts accessed in this process '
+    with _hosts_lock:
+        hosts = _hosts.values()
+    return [ h.status() for h in hosts ]
+
+def record_health(method, url, status, elapsed, nbytes, error=None):
+    """ request observer which updates the health of the host (see HostHealth)
+    'status' is None if there was no response, server errors also count as failures """
+    health = host_health(url)
+    if status is None or status >= 500:
+        health.failure()
+    else: # host is responding
+        health.success(elapsed)
+        
+def notify_observers(observers, method, url, status, elapsed, nbytes, error=None):
+    ' calls each request observer - an observer error is logged but never stops the request '
+    for observer in observers:
+        try:
+            observer(method, url, status, elapsed, nbytes, error)
+        except Exception:
+            logging.getLogger(__name__).exception('Error in request observer')
+    
 # subclass the mechanize browser to add an individual per browser timeout setting
+# and to check/record the health of each host accessed
 class Browser(mechanize.Browser):
     def __init__(self, history=None, request_class=None, timeout=None):
         self._timeout = timeout if timeout else mechanize._sockettimeout._GLOBAL_DEFAULT_TIMEOUT
+        self.track_hosts = True # fail fast if the host circuit is open
+        self.adaptive_timeout = False # use the per host timeout derived from response times
+        self.observers = [] # functions called after every request - see notify_observers
+        self.last_url = None # URL of the latest request, set before it is sent (so also if it fails)
         # do this last to avoid __getattr__ problems
         mechanize.Browser.__init__(self, history=history, request_class=request_class)
 
     def open_novisit(self, url, data=None, timeout=None):
         timeout = timeout if timeout else self._timeout
-        return self._mech_open(url, data, visit=False, timeout=timeout)
+        return self._tracked_open(url, data, False, timeout)
 
     def open(self, url, data=None, timeout=None):
         timeout = timeout if timeout else self._timeout
-        return self._mech_open(url, data, timeout=timeout)
+        return self._tracked_open(url, data, None, timeout)
+        
+    def _tracked_open(self, url, data, visit, timeout):
+        full_url = url if isinstance(url, basestring) else url.get_full_url() # mechanize/urllib2 Request object
+        self.last_url = full_url
+        observers = [ record_health ] + self.observers if self.track_hosts else self.observers
+        if not observers:
+            return self._mech_open(url, data, visit=visit, timeout=timeout)
+        if self.track_hosts:
+            health = host_health(full_url)
+            if not health.allow():
+                raise mechanize.URLError('circuit open for host %s' % health.host)
+            if self.adaptive_timeout:
+                timeout = health.timeout(timeout)
+        if isinstance(url, basestring):
+            method = 'POST' if data else 'GET'
+        else:
+            method = url.get_method()
+        start = time.time()
+        try:
+            response = self._mech_open(url, data, visit=visit, timeout=timeout)
+        except cassette.CassetteMiss: # says nothing about the host
+            if self.track_hosts:
+                health.release()
+            raise
+        except mechanize.HTTPError as e:
+            notify_observers(observers, method, full_url, e.code, time.time() - start, 0, e)
+            raise
+        except (mechanize.URLError, socket.error, httplib.HTTPException) as e:
+            notify_observers(observers, method, full_url, None, time.time() - start, 0, e)
+            raise
+        except Exception:
+            if self.track_hosts:
+                health.release()
+            raise
+        try:
+            nbytes = len(response.get_data()) # note browser responses are seekable, so this does not consume the data
+        except Exception:
+            nbytes = 0
+        notify_observers(observers, method, full_url, response.code, time.time() - start, nbytes)
+        return response
     
 # gets a mechanize browser
 def get_browser(headers = None, handler_type = '', proxy = '', timeout=None):
@@ -207,6 +387,107 @@ def list_forms(br):
         nr += 1
     return result
         
+# lightweight ASP.NET WebForms postbacks - for paging through results without re-parsing every form on each page
+# only the <input> tags are tokenized, and only the enabled hidden ones (plus any requested by name) are kept
+# note a viewstate can be hundreds of KB, which is expensive for mechanize forms or scrapemark to pull out
+INPUT_REGEX = re.compile(r'<input\b[^>]*>', re.I)
+FORM_REGEX = re.compile(r'<form\b[^>]*>', re.I)
+FORM_END_REGEX = re.compile(r'</form\s*>', re.I)
+TAG_NAME_REGEX = re.compile(r'<\s*[\w:-]+')
+ATTR_REGEX = re.compile(r'([\w:.$-]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+def tag_attrs(tag):
+    """ dict of the attributes of one html tag - names in lower case, entities decoded in values
+    attributes without a value (eg disabled) are included with an empty value """
+    attrs = {}
+    start = TAG_NAME_REGEX.match(tag)
+    for name, dq, sq, bare in ATTR_REGEX.findall(tag, start.end() if start else 0):
+        value = dq or sq or bare
+        if '&' in value:
+            decoded = _decode_entities(value)
+            value = decoded.encode('utf-8') if isinstance(value, str) and isinstance(decoded, unicode) else decoded
+        attrs[name.lower()] = value
+    return attrs
+
+def form_html(html, form):
+    """ the attributes and the html content of the form with name or id 'form' on a page
+    returns (None, None) if there is no such form """
+    for match in FORM_REGEX.finditer(html):
+        attrs = tag_attrs(match.group(0))
+        if form in (attrs.get('name'), attrs.get('id')):
+            end = FORM_END_REGEX.search(html, match.end())
+            return attrs, html[match.end():end.start() if end else len(html)]
+    return None, None
+
+def input_fields(html, names=None):
+    """ dict of the name/values of all the hidden inputs on a page (eg __VIEWSTATE, __EVENTVALIDATION)
+    plus any other inputs named in 'names' (eg a submit button)
+    disabled inputs are left out, as a browser does not submit them """
+    fields = {}
+    for match in INPUT_REGEX.finditer(html):
+        tag = match.group(0)
+        attrs = tag_attrs(tag)
+        name = attrs.get('name')
+        if name and 'disabled' not in attrs and (attrs.get('type', '').lower() == 'hidden' or (names and name in names)):
+            fields[name] = attrs.get('value', '')
+    return fields
+
+class Postback(object):
+    """ keeps the ASP.NET postback state of a page and posts the next event (eg a pager link or button)
+    'opener' is a requests session (eg basereq.rs) or a mechanize browser, so the pooled connections and cookies are shared
+    'fields' are extra values carried on every postback (eg the search criteria)
+    each postback returns (html, url) of the response and updates the state from it """
+    
+    def __init__(self, opener, url=None, fields=None, get_html=None, form=None, **kwargs):
+        """ 'url' fixes the postback URL (otherwise the action of the form on the current page is used)
+        'get_html' returns (html, url) from a response, by default read() and geturl() - or text and url for requests
+        'form' is the name or id of the form to post back (otherwise the inputs of the whole page and the first form are used)
+        other named arguments are passed to requests (eg timeout, verify) """
+        self.opener = opener
+        self.fixed_url = url
+        self.url = url
+        self.fields = dict(fields or {})
+        self.form = form
+        self.state = {}
+        self.get_html = get_html
+        self.kwargs = kwargs
+        
+    def update(self, html, url=None, names=None, form=None):
+        """ refresh the state from a page - returns the state dict
+        'names' are any other inputs to carry to the next postback (eg a submit button)
+        'form' overrides the name or id of the form to post back """
+        form = form or self.form
+        attrs, content = form_html(html, form) if form else (None, None)
+        if attrs is None:
+            match = FORM_REGEX.search(html)
+            attrs = tag_attrs(match.group(0)) if match else {}
+            content = html
+        self.state = input_fields(content, names)
+        if not self.fixed_url and url:
+            action = attrs.get('action')
+            self.url = urlparse.urljoin(url, action) if action else url
+        return self.state
+        
+    def post(self, target='', argument='', fields=None, names=None):
+        """ post back an event to the current URL - 'target' and 'argument' are the __EVENTTARGET/__EVENTARGUMENT
+        'fields' are values for this postback only (eg a submit button name and value) """
+        data = {}
+        data.update(self.state)
+        data.update(self.fields)
+        data['__EVENTTARGET'] = target
+        data['__EVENTARGUMENT'] = argument
+        if fields:
+            data.update(fields)
+        if isinstance(self.opener, mechanize.Browser):
+            data = dict((k, v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in data.items())
+            response = self.opener.open(self.url, urllib.urlencode(data))
+            html, url = self.get_html(response) if self.get_html else (response.read(), response.geturl())
+        else:
+            response = self.opener.post(self.url, data=data, **self.kwargs)
+            html, url = self.get_html(response) if self.get_html else (response.text, response.url)
+        self.update(html, url, names)
+        return html, url
+
 class EtreeHandler(mechanize.BaseHandler):
     def http_response(self, request, response):
         if not hasattr(response, "seek"):
@@ -233,6 +514,44 @@ class SoupHandler(mechanize.BaseHandler):
             response.set_data(soup.prettify())      
         return response
         
+def clean_text(text):
+    """ replace any html tags with spaces, convert html entities to unicode, normalise internal spaces
+    and strip leading and trailing spaces - returns a unicode string
+    gives the same result as the original per field BeautifulSoup conversion, which is still used
+    for anything other than plain entities (e.g. bare or unknown entities, stray brackets, non-ascii byte strings) """
+    text = TAGS_REGEX.sub(' ', text) # replace any html tag content with spaces
+    soup = '<' in text or '>' in text
+    if not soup and not isinstance(text, unicode):
+        try:
+            text = text.decode('ascii')
+        except UnicodeDecodeError:
+            soup = True # leave the encoding guesswork to beautiful soup
+    if soup: # note beautiful soup also converts the entities, so they must not be decoded again
+        text = _soup_decode(text)
+    elif '&' in text:
+        text = _decode_entities(text)
+    text = myutils.GAPS_REGEX.sub(' ', text) # normalise any internal space
+    return text.strip() # strip leading and trailing space
+    
+def _soup_decode(text):
+    ' use beautiful soup to convert html entities to unicode strings '
+    return BeautifulSoup(text, convertEntities="html").contents[0].string
+    
+def _decode_entities(text):
+    ' decode complete named or decimal entities directly, otherwise fall back to beautiful soup '
+    entities = ENTITY_REGEX.findall(text)
+    if len(entities) != text.count('&'):
+        return _soup_decode(text)
+    for num, name in entities:
+        if (num and int(num) > MAX_UNICHR) or (name and name not in name2codepoint):
+            return _soup_decode(text)
+    return ENTITY_REGEX.sub(_entity_char, text)
+    
+def _entity_char(match):
+    if match.group(1):
+        return unichr(int(match.group(1)))
+    return unichr(name2codepoint[match.group(2)])
+        
 # increment a date by a number OR to the next available weekday if a string
 # return the start and end dates of the permissible range
 def inc_dt(start_dt, increment=1):
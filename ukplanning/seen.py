@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+import threading
+import hashlib
+import sqlite3
+import struct
+import math
+
+# cross-run index of the uids already gathered for each authority - see BaseScraper.use_seen_index()
+# forward gather_ids() runs deliberately overlap (current_span re-covers recent weeks), so most uids returned
+# are already known - the index lets gather_ids() mark or drop those, and lets paging stop at a page of known uids
+# the uids are persisted in SQLite - by default each authority's uids are loaded into an in-memory set when first used,
+# with 'bloom' set a compact Bloom filter per authority is kept in memory instead, so most new uids are recognised
+# without any lookup and only the possible matches are checked against the database (in one query per batch of uids)
+# new uids are written in batches - flush() or close() writes everything out
+
+QUERY_SIZE = 500 # max uids checked in one query (SQLite allows 999 parameters)
+
+class BloomFilter(object):
+    """ fixed size probabilistic set - 'in' is never wrong for an added value, but may be True for others
+    at about 'error_rate' when 'capacity' values have been added """
+
+    def __init__(self, capacity=100000, error_rate=0.001, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))) # number of bits
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray(bits) if bits else bytearray((self.size + 7) // 8)
+        self.count = count # number of values added
+
+    def _positions(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(value).digest()) # double hashing gives all the positions from one digest
+        return [ (h1 + i * h2) % self.size for i in xrange(self.hashes) ]
+
+    def add(self, value):
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        for p in self._positions(value):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+class SeenIndex(object):
+
+    def __init__(self, path=':memory:', bloom=False, capacity=100000, error_rate=0.001, batch_size=1000):
+        """ 'path' is the SQLite database file (one index can be shared by many scrapers and threads)
+        if 'bloom' is set each authority has a Bloom filter in memory sized for 'capacity' uids (grown as needed)
+        instead of the set of all its uids - 'batch_size' is the number of new uids written per transaction """
+        self.path = path
+        self.bloom = bloom
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.batch_size = batch_size
+        self._sets = {} # authority -> set of uids (or BloomFilter if 'bloom')
+        self._new = [] # (authority, uid) rows not yet written
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS seen (authority TEXT, uid TEXT, PRIMARY KEY (authority, uid))")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _uids(self, authority):
+        ' the in-memory set or Bloom filter for an authority, loaded from the database when first used '
+        found = self._sets.get(authority)
+        if found is None:
+            if self.bloom:
+                total = self.count(authority)
+                found = BloomFilter(max(self.capacity, 2 * total), self.error_rate)
+                for row in self._db.execute("SELECT uid FROM seen WHERE authority=?", (authority,)):
+                    found.add(row[0])
+            else:
+                self.flush()
+                found = set(row[0] for row in self._db.execute("SELECT uid FROM seen WHERE authority=?", (authority,)))
+            self._sets[authority] = found
+        return found
+
+    def known(self, authority, uids):
+        ' the set of these uids which are already in the index '
+        with self._lock:
+            found = self._uids(authority)
+            maybe = set(u for u in uids if u in found)
+            if not self.bloom or not maybe:
+                return maybe
+            self.flush()
+            known = set()
+            maybe = list(maybe)
+            for i in range(0, len(maybe), QUERY_SIZE): # confirm the possible matches
+                batch = maybe[i:i+QUERY_SIZE]
+                sql = "SELECT uid FROM seen WHERE authority=? AND uid IN (%s)" % ','.join('?' * len(batch))
+                rows = set(row[0] for row in self._db.execute(sql, [ authority ] + batch))
+                known.update(u for u in batch if u in rows)
+            return known
+
+    def __contains__(self, key):
+        ' (authority, uid) in index '
+        authority, uid = key
+        return bool(self.known(authority, [ uid ]))
+
+    def add(self, authority, uids):
+        """ adds uids to the index for an authority - returns the number which were definitely new
+        (in 'bloom' mode a uid which may be known is written anyway - the database ignores it if it is) """
+        with self._lock:
+            found = self._uids(authority)
+            added = 0
+            for uid in uids:
+                if not uid:
+                    continue
+                if uid not in found:
+                    found.add(uid)
+                    added += 1
+                elif not self.bloom:
+                    continue
+                self._new.append((authority, uid))
+                if self.bloom and found.count > found.capacity: # rebuild the filter larger to keep the error rate
+                    self.flush()
+                    del self._sets[authority]
+                    found = self._uids(authority)
+            if len(self._new) >= self.batch_size:
+                self.flush()
+            return added
+
+    def count(self, authority):
+        ' number of uids in the index for an authority '
+        with self._lock:
+            self.flush()
+            return self._db.execute("SELECT COUNT(*) FROM seen WHERE authority=?", (authority,)).fetchone()[0]
+
+    def flush(self):
+        with self._lock:
+            if self._new:
+                with self._db: # one transaction per batch
+                    self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?,?)", self._new)
+                self._new = []
+
+    def clear(self, authority):
+        ' forget all the uids of an authority '
+        with self._lock:
+            self.flush()
+            with self._db:
+                self._db.execute("DELETE FROM seen WHERE authority=?", (authority,))
+            self._sets.pop(authority, None)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
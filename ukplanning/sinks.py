@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2013-2017  Andrew Speakman
+
+This file is part of UKPlanning, a library of scrapers for UK planning applications
+
+UKPlanning is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+UKPlanning is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+from collections import OrderedDict
+import threading
+import sqlite3
+import json
+import gzip
+import csv
+import os
+
+# output sinks for scraped records - each buffers records in memory and writes them in bulk
+# (one append or one transaction per flush) when the buffer is full, on flush() and on close()
+# write_result() accepts the result dicts from gather_ids() ('result' list) and update_application() ('record')
+# all sinks can be shared by many threads (eg the workers of a multirun.ScraperPool)
+# observers are called with each batch of records once it has been written - eg see multirun.ScraperPool.mark_stored
+
+def record_key(record):
+    return (record.get('authority'), record.get('uid'))
+
+def dumps(record):
+    ' compact JSON for one record '
+    return json.dumps(record, default=str, separators=(',', ':'), sort_keys=True)
+
+class Sink(object):
+
+    def __init__(self, buffer_size=1000):
+        """ 'buffer_size' is the max number of records held before they are written """
+        self.buffer_size = buffer_size
+        self.written = 0 # number of records written so far
+        self._buffer = []
+        self._lock = threading.RLock()
+        self.observers = [] # functions called with the records of each batch written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        ' add one record to the output '
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def write_many(self, records):
+        with self._lock:
+            for record in records:
+                self.write(record)
+
+    def write_result(self, result):
+        """ add the records from a gather_ids() or update_application() result - results with errors are ignored
+        as are update_application(diff=True) results with no material change
+        returns the number of records added """
+        if not result or 'scrape_error' in result or result.get('changed') is False:
+            return 0
+        if result.get('record'):
+            self.write(result['record'])
+            return 1
+        records = result.get('result') or []
+        self.write_many(records)
+        return len(records)
+
+    def flush(self):
+        ' write out any buffered records '
+        with self._lock:
+            if self._buffer:
+                records = self._buffer
+                self._write(records)
+                self.written += len(records)
+                self._buffer = []
+                self._notify(records)
+
+    def _notify(self, records):
+        for observer in self.observers:
+            observer(records)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._close()
+
+    def _write(self, records): # bulk write to be implemented in the children
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+class JSONLSink(Sink):
+    """ appends one JSON record per line - compressed with gzip if the file name ends in '.gz'
+    note records are appended, so a later record for the same authority/uid supersedes an earlier one """
+
+    def __init__(self, path, buffer_size=1000):
+        super(JSONLSink, self).__init__(buffer_size)
+        self.path = path
+        if path.endswith('.gz'):
+            self._file = gzip.open(path, 'ab') # each append is a new gzip member, readable as one stream
+        else:
+            self._file = open(path, 'ab')
+
+    def _write(self, records):
+        self._file.write(''.join(dumps(r) + '\n' for r in records))
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+class CSVSink(Sink):
+    """ appends records as CSV rows - 'fields' are the columns written (others are ignored)
+    if not supplied they are taken from the first batch of records written (or the header of an existing file)
+    NOTE the columns are then fixed, so any field first seen in a later batch is not written - eg the detail fields
+    of updated records written after gather_ids() stubs - supply the full 'fields' list if that matters
+    the names of any fields left out are kept in 'dropped' """
+
+    first_fields = [ 'authority', 'uid' ]
+
+    def __init__(self, path, fields=None, buffer_size=1000):
+        super(CSVSink, self).__init__(buffer_size)
+        self.path = path
+        self.fields = fields
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and not fields:
+            with open(path, 'rb') as f:
+                self.fields = csv.reader(f).next()
+        self._header = not exists
+        self._file = open(path, 'ab')
+        self._writer = None
+        self.dropped = set() # fields of records written which are not in the columns
+
+    def _write(self, records):
+        if not self._writer:
+            if not self.fields:
+                keys = set()
+                for r in records:
+                    keys.update(r.keys())
+                self.fields = [ k for k in self.first_fields if k in keys ] + sorted(keys - set(self.first_fields))
+            self._writer = csv.DictWriter(self._file, self.fields, extrasaction='ignore')
+            if self._header:
+                self._writer.writeheader()
+        columns = set(self.fields)
+        for r in records:
+            if len(r) > len(columns) or not columns.issuperset(r):
+                self.dropped.update(k for k in r if k not in columns)
+        self._writer.writerows([ self._encode(r) for r in records ])
+        self._file.flush()
+
+    def _encode(self, record):
+        ' the python 2 csv module only writes byte strings '
+        row = {}
+        for k, v in record.items():
+            if isinstance(v, unicode):
+                v = v.encode('utf-8')
+            elif isinstance(v, (list, dict)):
+                v = dumps(v)
+            row[k] = v
+        return row
+
+    def _close(self):
+        self._file.close()
+
+class SQLiteSink(Sink):
+    """ upserts records into an SQLite table keyed on (authority, uid) - the fields of the latest record are merged
+    into any existing one (as update_application), so a gather_ids() stub written later does not lose the detail fields
+    each record is stored as compact JSON, with its 'date_scraped' as a separate column """
+
+    def __init__(self, path, table='applications', buffer_size=1000):
+        super(SQLiteSink, self).__init__(buffer_size)
+        self.path = path
+        self.table = table
+        self._buffer = OrderedDict() # (authority, uid) -> record, so repeated records in a batch are only written once
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS %s (authority TEXT, uid TEXT, date_scraped TEXT, record TEXT,
+                PRIMARY KEY (authority, uid))""" % table)
+
+    def write(self, record):
+        with self._lock:
+            key = record_key(record)
+            merged = self._buffer.pop(key, None)
+            if merged:
+                merged.update(record)
+            else:
+                merged = dict(record)
+            self._buffer[key] = merged
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                records = self._buffer.values()
+                self._write(records)
+                self.written += len(records)
+                self._buffer = OrderedDict()
+                self._notify(records)
+
+    def _write(self, records):
+        with self._db: # one transaction per batch
+            self._db.execute("BEGIN IMMEDIATE") # holds the write lock from the reads, so other writers cannot interleave with the merges
+            rows = []
+            for r in records:
+                row = self._db.execute("SELECT record FROM %s WHERE authority=? AND uid=?" % self.table, record_key(r)).fetchone()
+                if row:
+                    stored = json.loads(row[0])
+                    stored.update(r)
+                    r = stored
+                rows.append((r.get('authority'), r.get('uid'), r.get('date_scraped'), dumps(r)))
+            self._db.executemany("INSERT OR REPLACE INTO %s VALUES (?,?,?,?)" % self.table, rows)
+
+    def get(self, authority, uid):
+        ' returns the stored record or None '
+        with self._lock:
+            self.flush()
+            row = self._db.execute("SELECT record FROM %s WHERE authority=? AND uid=?" % self.table, (authority, uid)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _close(self):
+        self._db.close()
+
+def open_sink(path, **kwargs):
+    ' returns a sink of the type matching the file extension (.jsonl, .jsonl.gz, .csv or .db/.sqlite) '
+    if path.endswith('.csv'):
+        return CSVSink(path, **kwargs)
+    elif path.endswith('.db') or path.endswith('.sqlite'):
+        return SQLiteSink(path, **kwargs)
+    return JSONLSink(path, **kwargs)
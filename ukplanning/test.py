@@ -17,6 +17,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 from scrapers import tests
+from scrapers import base
 try:
     from ukplanning import myutils
 except ImportError:
@@ -64,6 +65,8 @@ def get_suite(scraper_list=None, module=None, test_list=None, group=None, kwargs
         for test in these_tests:
             testcase = scraper_test_class(test, scraper_class, kwargs)
             suite.addTest(testcase)
+    if group == 'base': # scraper independent tests are run once, not per scraper
+        suite.addTest(unittest.TestLoader().loadTestsFromTestCase(tests.UtilsTest))
     return suite
 
 def run_suite(suite, verbosity=1):
@@ -83,6 +86,9 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--verbosity", help="verbosity level", default='1', choices=v_choices)
     parser.add_argument("-l", "--level", help="log level", default='DEBUG', choices=log_choices)
     parser.add_argument("-f", "--logfile", help="log file", default='../tests.log')
+    parser.add_argument("-c", "--cassettes", help="directory of HTTP cassettes - tests are replayed offline from '<authority>.cassette' files")
+    parser.add_argument("-r", "--record", help="record the HTTP traffic of the tests into the cassettes directory", action='store_true')
+    parser.add_argument("-p", "--profile", help="profile scrapemark patterns and report the slowest per scraper type", action='store_true')
     
     excl1 = parser.add_mutually_exclusive_group(required=True)
     excl1.add_argument("-m", "--module", help="scraper module to test", choices=s_modules)
@@ -92,6 +98,8 @@ if __name__ == "__main__":
     excl2.add_argument("-n", "--names", help="names of tests to run", nargs=argparse.REMAINDER)
     excl2.add_argument("-g", "--group", help="group of tests to run", choices=t_groups)
     args = parser.parse_args()
+    if args.record and not args.cassettes:
+        parser.error('--record requires a --cassettes directory')
 
     #logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s: %(message)s', 
     #    level=args.level, datefmt='%Y-%m-%dT%H:%M:%S',
@@ -121,8 +129,18 @@ if __name__ == "__main__":
     kwargs = { 'log_level': args.level, 'log_name': args.logfile, 'log_directory': '.' }
     print 'Getting test suite'
     suite = get_suite(scraper, args.module, args.names, args.group, kwargs)
+    if args.cassettes:
+        base.BaseScraper.cassette_directory = args.cassettes
+        base.BaseScraper.cassette_mode = base.cassette.RECORD if args.record else base.cassette.REPLAY
+    scrapemark = base.scrapemark # the module as used by the scrapers
+    scrapemark.profiling = args.profile
     print 'Running test suite'
     run_suite(suite, int(args.verbosity))
+    if args.record:
+        base.cassette.save_all()
+    if args.profile:
+        print 'Slowest scrapemark patterns'
+        print scrapemark.profile_report()
 
 
 